@@ -0,0 +1,85 @@
+"""
+使用者帳號
+
+密碼以 werkzeug 的雜湊格式儲存，帳號一律存放在主資料庫；個人資料
+（飲食、體重、檢查清單、設定）依 database.user_db_path 存放在主資料庫
+或各使用者自己的資料庫檔。
+"""
+
+import re
+import sqlite3
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import database
+import writer
+
+USERNAME_PATTERN = re.compile(r'^[A-Za-z0-9_.\-]{3,32}$')
+MIN_PASSWORD_LENGTH = 8
+
+USER_QUERY = 'SELECT * FROM users WHERE username=?'
+USERS_QUERY = 'SELECT id, username, is_admin FROM users ORDER BY id'
+
+# 帳號不存在時也做一次雜湊比對，回應時間不透露帳號是否存在
+_DUMMY_HASH = generate_password_hash('not-a-real-password')
+
+
+def _public(row):
+    return {'id': row['id'], 'username': row['username'], 'is_admin': bool(row['is_admin'])}
+
+
+def authenticate(username, password):
+    """帳密正確時回傳使用者，否則回傳 None"""
+    with database.borrow() as db:
+        row = db.execute(USER_QUERY, (username or '',)).fetchone()
+    if row is None:
+        check_password_hash(_DUMMY_HASH, password or '')
+        return None
+    if not check_password_hash(row['password_hash'], password or ''):
+        return None
+    return _public(row)
+
+
+def list_users():
+    """所有使用者（不含密碼雜湊）"""
+    with database.borrow() as db:
+        rows = db.execute(USERS_QUERY).fetchall()
+    return [_public(row) for row in rows]
+
+
+def _validate(username, password):
+    if not USERNAME_PATTERN.match(username or ''):
+        raise ValueError('帳號須為 3-32 個英數字或 _ . -')
+    if len(password or '') < MIN_PASSWORD_LENGTH:
+        raise ValueError(f'密碼至少 {MIN_PASSWORD_LENGTH} 個字元')
+
+
+def create_user(username, password, is_admin=False):
+    """新增使用者並寫入預設設定，回傳使用者；帳號格式錯誤或重複時拋出 ValueError"""
+    _validate(username, password)
+    password_hash = generate_password_hash(password)
+
+    def insert(db):
+        cursor = db.execute(
+            'INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)',
+            (username, password_hash, int(is_admin)))
+        if not database.USER_DB_DIR:
+            # 分檔模式下，預設設定在使用者的資料庫檔第一次開啟時寫入
+            database.insert_default_settings(db, cursor.lastrowid)
+        return cursor.lastrowid
+
+    try:
+        user_id = writer.run(insert, path=database.DATABASE)
+    except sqlite3.IntegrityError:
+        raise ValueError('帳號已存在') from None
+    return {'id': user_id, 'username': username, 'is_admin': bool(is_admin)}
+
+
+def set_password(username, password):
+    """變更密碼，回傳是否有此帳號"""
+    if len(password or '') < MIN_PASSWORD_LENGTH:
+        raise ValueError(f'密碼至少 {MIN_PASSWORD_LENGTH} 個字元')
+    result = writer.execute('UPDATE users SET password_hash=? WHERE username=?',
+                            (generate_password_hash(password), username),
+                            path=database.DATABASE)
+    return result.rowcount > 0
@@ -0,0 +1,99 @@
+"""
+非同步資料庫存取
+
+SQLite 本身是同步 API，這裡包裝成 awaitable，供 ASGI 的原生 async handler
+（目前為 /api/events）使用：讀取在 reader 執行緒池執行（WAL 下互不阻擋，
+向 database 的連線池借用連線），等待寫入 commit 則由 writer 的 commit
+listener 喚醒，不佔用執行緒。事件迴圈本身從不碰 SQLite。
+
+    rows = await aiodb.executor.read(events.changes, user_id, since, path=path)
+    await aiodb.executor.wait_for_commit(1.0)
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import writer
+
+# 讀取執行緒數；預設比連線池少一條，保留給 writer
+READERS = int(os.environ.get('ASGI_READERS', max(database.POOL_SIZE - 1, 1)))
+
+
+class AsyncExecutor:
+    """reader 執行緒池 + 本進程寫入 commit 的非同步通知"""
+
+    def __init__(self, readers=READERS):
+        self.readers = readers
+        self._lock = threading.Lock()
+        self._reader = None
+        self._pid = None
+        self._loop = None
+        self._committed = None
+
+    def _pool(self):
+        # 與連線池相同，fork 之後重新建立執行緒
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._reader = ThreadPoolExecutor(self.readers, thread_name_prefix='db-reader')
+                    self._loop = self._committed = None
+                    self._pid = pid
+        return self._reader
+
+    def run_reader(self, fn, *args):
+        """在 reader 執行緒執行任意函式（不借連線）"""
+        return asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+
+    async def read(self, fn, *args, path=None):
+        """以借來的連線在 reader 執行緒執行 fn(db, *args)（path 預設為主資料庫）"""
+        return await self.run_reader(_with_connection, path, fn, args)
+
+    async def wait_for_commit(self, timeout):
+        """等待本進程下一次 commit（最多 timeout 秒），回傳是否有 commit"""
+        self._pool()
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 每個進程的事件迴圈只註冊一次；writer 執行緒 commit 後切回迴圈喚醒等待者
+            self._loop = loop
+            self._committed = asyncio.Event()
+            writer.get_writer().add_commit_listener(lambda: self._wake(loop))
+        committed = self._committed
+        try:
+            await asyncio.wait_for(committed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _wake(self, loop):
+        # 在 writer 執行緒呼叫；迴圈已關閉（例如重新啟動）時略過
+        try:
+            loop.call_soon_threadsafe(self._notify, loop)
+        except RuntimeError:
+            pass
+
+    def _notify(self, loop):
+        if self._loop is loop:
+            committed, self._committed = self._committed, asyncio.Event()
+            committed.set()
+
+    def shutdown(self):
+        """等待進行中的工作結束並關閉執行緒與閒置連線"""
+        with self._lock:
+            pool = self._reader
+            self._reader = self._pid = self._loop = self._committed = None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        for pool in database.open_pools():
+            pool.close_all()
+
+
+def _with_connection(path, fn, args):
+    with database.borrow(path) as db:
+        return fn(db, *args)
+
+
+executor = AsyncExecutor()
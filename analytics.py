@@ -0,0 +1,215 @@
+"""
+體重趨勢分析
+
+以 NumPy 對整段體重序列一次算出指數加權移動平均（EWMA）與 7 天滾動斜率，
+並推估達標日期、與計畫減重速率比較。結果依 table_versions 的版本快取；
+只有新增較晚日期的記錄時，只重算序列尾端。
+"""
+
+import datetime
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import cache
+import user_settings
+
+EWMA_ALPHA = 0.25        # EWMA 平滑係數，越大越貼近當日數值
+SLOPE_WINDOW_DAYS = 7    # 滾動斜率的時間窗（天）
+PLAN_DAYS = 80           # 計畫天數
+_EWMA_BLOCK = 64         # 分塊計算 EWMA，避免 decay 的負次方溢位
+TREND_CACHE_USERS = 256  # 每個 worker 最多快取幾位使用者的趨勢
+
+# 完整序列；已算過的部分（筆數與總和）；較晚日期的新記錄
+SERIES_QUERY = 'SELECT date, weight FROM weight_records WHERE user_id = ? ORDER BY date'
+PREFIX_QUERY = 'SELECT COUNT(*), TOTAL(weight) FROM weight_records WHERE user_id = ? AND date <= ?'
+TAIL_QUERY = 'SELECT date, weight FROM weight_records WHERE user_id = ? AND date > ? ORDER BY date'
+
+
+def ewma(values, alpha=EWMA_ALPHA, initial=None):
+    """向量化 EWMA：y[i] = alpha * x[i] + (1 - alpha) * y[i-1]
+
+    initial 為前一段序列最後的 EWMA 值，用於只計算尾端；未提供時以第一筆為起點。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    prev = values[0] if initial is None else initial
+    for start in range(0, len(values), _EWMA_BLOCK):
+        block = values[start:start + _EWMA_BLOCK]
+        steps = np.arange(len(block))
+        # y[i] = decay^(i+1) * prev + alpha * decay^i * Σ_{j<=i} x[j] / decay^j
+        out[start:start + len(block)] = (
+            decay ** (steps + 1) * prev
+            + alpha * decay ** steps * np.cumsum(block * decay ** -steps)
+        )
+        prev = out[start + len(block) - 1]
+    return out
+
+
+def rolling_slope(days, values, window=SLOPE_WINDOW_DAYS):
+    """每一點往前 window 天內的最小平方斜率（kg/天），點數不足 2 時為 NaN"""
+    days = np.asarray(days, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(days)
+    if not n:
+        return np.empty(0)
+    t = days - days[0]
+    start = np.searchsorted(days, days - (window - 1), side='left')
+    end = np.arange(1, n + 1)
+
+    def window_sum(a):
+        cumulative = np.concatenate(([0.0], np.cumsum(a)))
+        return cumulative[end] - cumulative[start]
+
+    count = end - start
+    st, sy = window_sum(t), window_sum(values)
+    stt, sty = window_sum(t * t), window_sum(t * values)
+    denom = count * stt - st * st
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (count * sty - st * sy) / denom
+    return np.where(denom > 0, slope, np.nan)
+
+
+class TrendState:
+    """某個資料版本的完整序列與計算結果"""
+
+    def __init__(self, versions, dates, days, weights, smoothed, slopes, total):
+        self.versions = versions
+        self.dates = dates
+        self.days = days
+        self.weights = weights
+        self.smoothed = smoothed
+        self.slopes = slopes
+        self.total = total
+        self.result = None
+
+    @classmethod
+    def build(cls, versions, rows):
+        dates = [row['date'] for row in rows]
+        weights = np.array([row['weight'] for row in rows], dtype=np.float64)
+        days = np.array(dates, dtype='datetime64[D]').astype(np.int64)
+        return cls(versions, dates, days, weights, ewma(weights),
+                   rolling_slope(days, weights), float(weights.sum()))
+
+    def extend(self, versions, rows):
+        """只計算新增的尾端：EWMA 接續最後一個值，斜率只看尾端所需的時間窗"""
+        dates = [row['date'] for row in rows]
+        weights = np.array([row['weight'] for row in rows], dtype=np.float64)
+        days = np.array(dates, dtype='datetime64[D]').astype(np.int64)
+
+        initial = self.smoothed[-1] if len(self.smoothed) else None
+        all_days = np.concatenate((self.days, days))
+        all_weights = np.concatenate((self.weights, weights))
+        first = np.searchsorted(all_days, days[0] - (SLOPE_WINDOW_DAYS - 1), side='left')
+        tail_slopes = rolling_slope(all_days[first:], all_weights[first:])[-len(days):]
+
+        return TrendState(
+            versions, self.dates + dates, all_days, all_weights,
+            np.concatenate((self.smoothed, ewma(weights, initial=initial))),
+            np.concatenate((self.slopes, tail_slopes)),
+            self.total + float(weights.sum()),
+        )
+
+
+def _rounded(value, digits=3):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def summarize(state, settings):
+    """由序列與設定（user_settings.Settings）計算摘要：目前趨勢、推估達標日、與計畫速率比較"""
+    start_weight = settings.start_weight
+    target_weight = settings.target_weight
+    plan_weekly = -(start_weight - target_weight) / PLAN_DAYS * 7
+
+    result = {
+        'count': len(state.dates),
+        'start_weight': start_weight,
+        'target_weight': target_weight,
+        'plan_weekly_rate': round(plan_weekly, 3),
+        'points': [
+            {'date': date, 'weight': float(weight), 'ewma': _rounded(smooth),
+             'slope': _rounded(slope, 4)}
+            for date, weight, smooth, slope in zip(
+                state.dates, state.weights, state.smoothed, state.slopes)
+        ],
+    }
+    if not state.dates:
+        return result
+
+    current = float(state.smoothed[-1])
+    slope = state.slopes[-1]
+    weekly = None if np.isnan(slope) else float(slope) * 7
+    last_day = datetime.date.fromisoformat(state.dates[-1])
+
+    projected = None
+    if current <= target_weight:
+        projected = state.dates[-1]
+    elif weekly is not None and slope < 0:
+        days_left = int(np.ceil((current - target_weight) / -slope))
+        projected = (last_day + datetime.timedelta(days=days_left)).isoformat()
+
+    result.update({
+        'latest_date': state.dates[-1],
+        'latest_weight': float(state.weights[-1]),
+        'ewma': round(current, 3),
+        'weekly_rate': _rounded(weekly),
+        # 正值代表比計畫慢（每週少減的公斤數）
+        'weekly_rate_vs_plan': _rounded(None if weekly is None else weekly - plan_weekly),
+        'projected_target_date': projected,
+    })
+    return result
+
+
+class TrendCache:
+    """依資料版本快取各使用者的趨勢結果（每個 worker 一份，LRU）"""
+
+    def __init__(self, max_users=TREND_CACHE_USERS):
+        self.max_users = max_users
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db, user_id):
+        key = (db.path, user_id)
+        versions = cache.table_versions(db, ('weight_records', 'settings'))
+        with self._lock:
+            state = self._states.get(key)
+        if state is not None and state.versions == versions:
+            return state.result
+
+        if state is not None and state.versions[0] != versions[0]:
+            state = self._advance(db, user_id, state, versions)
+        elif state is not None:
+            # 只有設定變動：序列沿用，重算摘要
+            state = TrendState(versions, state.dates, state.days, state.weights,
+                               state.smoothed, state.slopes, state.total)
+        if state is None:
+            rows = db.execute(SERIES_QUERY, (user_id,)).fetchall()
+            state = TrendState.build(versions, rows)
+
+        state.result = summarize(state, user_settings.get(db, user_id))
+        with self._lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        return state.result
+
+    def _advance(self, db, user_id, state, versions):
+        """既有記錄未變時只讀取並計算較晚日期的新記錄，否則回傳 None 重算"""
+        if not state.dates:
+            return None
+        count, total = db.execute(PREFIX_QUERY, (user_id, state.dates[-1])).fetchone()
+        if count != len(state.dates) or abs(total - state.total) > 1e-6:
+            return None
+        rows = db.execute(TAIL_QUERY, (user_id, state.dates[-1])).fetchall()
+        if not rows:
+            return TrendState(versions, state.dates, state.days, state.weights,
+                              state.smoothed, state.slopes, state.total)
+        return state.extend(versions, rows)
+
+
+trend_cache = TrendCache()
@@ -2,31 +2,140 @@
 80天減重計畫 - Flask 應用程式
 """
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import (Flask, Response, abort, g, render_template, request, jsonify, session,
+                   redirect, stream_with_context, url_for)
+from flask.cli import AppGroup
+from collections import namedtuple
+from contextlib import contextmanager
 from functools import wraps
+import accounts
+import analytics
+import archive
+import assets
+import backup
+import click
+import cache
+import database
+import events
+import ingredients
+import metrics
+import migrations
+import planner
+import search
+import serialize
+import transfer
+import user_settings
+import writer
 from database import init_db, get_db
-import json
+import datetime
+import gzip
+import hmac
 import os
+import shutil
+import tempfile
+import time
 
 app = Flask(__name__, static_folder='static', static_url_path='', template_folder='templates')
-app.config['JSON_AS_ASCII'] = False
+# JSON 編碼（有安裝 orjson 時使用），中文直接輸出不轉義
+app.json = serialize.JSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'fitness-plan-secret-key-2024')
 
-# 登入設定
-ADMIN_USERNAME = 'admin'
-ADMIN_PASSWORD = 'aa552300'
-
-# 初始化資料庫
-init_db()
+# 資料庫連線管理（schema 由 `flask db upgrade` 或 gunicorn on_starting 建立）
+database.init_app(app)
+
+
+# ==================== 效能指標 ====================
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.registry.observe_request(
+            route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+
+def metrics_authorized():
+    """/metrics 不經登入流程（抓取端沒有 session），在此檢查 token 或管理員 session"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return bool(session.get('is_admin'))
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 指標：需帶 METRICS_TOKEN 的 Bearer token，或以管理員登入"""
+    if not metrics_authorized():
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    pools = [pool.snapshot() for pool in database.open_pools()]
+    writes = writer.get_writer().snapshot()
+    gauges = {
+        'gym_plan_db_open_files': ('開啟中的資料庫檔數', len(pools)),
+        'gym_plan_db_pool_open': ('連線池開啟的連線數', sum(p['open'] for p in pools)),
+        'gym_plan_db_pool_in_use': ('連線池借出中的連線數', sum(p['in_use'] for p in pools)),
+        'gym_plan_db_pool_checkouts': ('連線池累計借出次數', sum(p['checkouts'] for p in pools)),
+        'gym_plan_db_pool_waits': ('連線池累計等待次數', sum(p['waits'] for p in pools)),
+        'gym_plan_write_batches': ('寫入佇列累計 commit 次數', writes['batches']),
+        'gym_plan_write_operations': ('寫入佇列累計寫入工作數', writes['operations']),
+        'gym_plan_write_pending': ('寫入佇列等待中的工作數', writes['pending']),
+        'gym_plan_response_cache_hits': ('回應快取命中次數', response_cache.hits),
+        'gym_plan_response_cache_misses': ('回應快取未命中次數', response_cache.misses),
+        'gym_plan_backup_last_success_timestamp': (
+            '最近一次備份完成的時間（Unix 秒）',
+            (backup.last_success() or {}).get('finished_ts', 0)),
+    }
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 
 # ==================== 登入驗證 ====================
 
-def login_required(f):
+# 不需登入即可存取的 endpoint
+PUBLIC_ENDPOINTS = frozenset(('login', 'logout', 'static', 'asset'))
+# 自行驗證（METRICS_TOKEN 或管理員 session）、未登入時回 401 而非導向登入頁的 endpoint
+TOKEN_ENDPOINTS = frozenset(('get_metrics',))
+
+
+@app.before_request
+def load_user():
+    """除了公開頁面外都需要登入：API 回傳 401 JSON，頁面導向登入頁"""
+    if request.endpoint in PUBLIC_ENDPOINTS or request.endpoint in TOKEN_ENDPOINTS:
+        return None
+    user_id = session.get('user_id')
+    if user_id is None:
+        if request.path.startswith('/api/'):
+            return jsonify({'error': '請先登入'}), 401
+        return redirect('login')
+    g.user_id = user_id
+    return None
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not session.get('is_admin'):
+            return jsonify({'error': '需要管理員權限'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def can_edit_catalog():
+    """菜單、採買清單、運動參數未分檔時（未設定 USER_DB_DIR）為所有使用者共用，只有管理員可以修改"""
+    return bool(database.USER_DB_DIR) or bool(session.get('is_admin'))
+
+
+def catalog_write(f):
+    """共用資料的寫入路由：未分檔時限管理員，分檔時每位使用者各有一份、可自行修改"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not session.get('logged_in'):
-            return redirect('login')
+        if not can_edit_catalog():
+            return jsonify({'error': '需要管理員權限'}), 403
         return f(*args, **kwargs)
     return decorated_function
 
@@ -35,10 +144,12 @@ def login_required(f):
 def login():
     error = None
     if request.method == 'POST':
-        username = request.form.get('username')
-        password = request.form.get('password')
-        if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
-            session['logged_in'] = True
+        user = accounts.authenticate(request.form.get('username'), request.form.get('password'))
+        if user:
+            session.clear()
+            session['user_id'] = user['id']
+            session['username'] = user['username']
+            session['is_admin'] = user['is_admin']
             return redirect('./')
         else:
             error = '帳號或密碼錯誤'
@@ -47,64 +158,400 @@ def login():
 
 @app.route('/logout')
 def logout():
-    session.pop('logged_in', None)
+    session.clear()
     return redirect('login')
 
 
+@app.route('/api/me', methods=['GET'])
+def get_current_user():
+    """目前登入的使用者"""
+    return jsonify({'id': g.user_id, 'username': session.get('username'),
+                    'is_admin': bool(session.get('is_admin'))})
+
+
 # ==================== 頁面路由 ====================
 
+# 靜態檔永久快取（檔名含內容雜湊，內容一改網址就變）
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@app.template_global()
+def asset_url(name):
+    """模板中引用靜態檔；除錯模式下直接用原檔，修改後重新整理即生效"""
+    return name if app.debug else assets.store.url(name)
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """建置好的靜態檔，依 Accept-Encoding 回傳預先壓縮的版本"""
+    item = assets.store.get(filename)
+    if item is None:
+        abort(404)
+    encoding = assets.negotiate(request.accept_encodings, item.bodies)
+    response = Response(item.bodies[encoding], mimetype=item.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+    response.set_etag(f'{item.etag}-{encoding}')
+    return response.make_conditional(request)
+
+
+def cached_page(template):
+    """渲染結果依靜態檔版本快取（模板不含請求相關內容），附 gzip 版本與 ETag"""
+    if app.debug:
+        return render_template(template)
+    version = assets.store.current_version()
+    key = ('page', template)
+    entry = response_cache.get(key, version)
+    if entry is None:
+        entry = response_cache.put(key, version, render_template(template).encode())
+    if request.accept_encodings['gzip'] > 0:
+        body = entry.body
+        entry = response_cache.get(key + ('gzip',), version)
+        if entry is None:
+            entry = response_cache.put(key + ('gzip',), version,
+                                       gzip.compress(body, compresslevel=9, mtime=0))
+        response = Response(entry.body, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(entry.body, mimetype='text/html')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(entry.etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 @app.route('/')
-@login_required
 def index():
-    return render_template('index.html')
+    return cached_page('index.html')
+
+
+# ==================== 回應快取 ====================
+
+response_cache = cache.ResponseCache()
+
+USER_SCOPED_TABLES = frozenset(table for table, _, _ in migrations.USER_TABLES)
+
+
+def cached_json(*tables):
+    """依資料表版本快取 GET 回應，並以強 ETag 處理 If-None-Match（304）"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            db = get_db()
+            # 先讀版本再查資料，快取內容只可能比版本新，不會過期
+            version = cache.table_versions(db, tables)
+            # 個人資料依使用者區分；共用的菜單等在分檔模式下依資料庫檔區分
+            user = g.user_id if USER_SCOPED_TABLES.intersection(tables) else None
+            key = (db.path, user, request.path, request.query_string)
+            entry = response_cache.get(key, version)
+            if entry is None:
+                response = app.make_response(f(*args, **kwargs))
+                # 錯誤（例如參數不正確）不快取；?stream= 的串流回應直接送出，
+                # 不整個讀進記憶體，也保留原本的 mimetype（NDJSON）
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                entry = response_cache.put(key, version, response.get_data())
+            response = Response(entry.body, mimetype='application/json')
+            response.set_etag(entry.etag)
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return decorated_function
+    return decorator
+
+
+# ==================== 共用查詢 ====================
+
+# API 的查詢一律寫成常數或組成函式，`flask db check-plans` 檢查的就是同一份 SQL
+MEALS_QUERY = 'SELECT * FROM meals ORDER BY meal_type, id'
+SHOPPING_QUERY = 'SELECT * FROM shopping_list ORDER BY category, id'
+EXERCISES_QUERY = 'SELECT * FROM exercise_params ORDER BY id'
+MEAL_INGREDIENTS_QUERY = 'SELECT ingredients FROM meals WHERE id=?'
+WEIGHTS_QUERY = 'SELECT * FROM weight_records WHERE user_id=? ORDER BY date DESC'
+DAILY_TOTALS_QUERY = 'SELECT * FROM daily_totals WHERE user_id=? AND date BETWEEN ? AND ? ORDER BY date'
+CLEAR_MEALS_SQL = 'DELETE FROM daily_meals WHERE user_id=? AND date=? AND meal_type=?'
+
+# 可能合併封存檔的查詢（參數：user_id, date）
+DAY_MEALS = archive.Query('daily_meals', '*', 'user_id=? AND date=?', ' ORDER BY meal_order')
+DAY_CHECKLIST = archive.Query('daily_checklist', '*', 'user_id=? AND date=?', '')
+
+
+def query_daily_meals(db, user_id, date):
+    """指定日期的飲食記錄（已封存的日期合併封存檔）"""
+    sql, params = archive.query(db, DAY_MEALS, user_id, (user_id, date), since=date)
+    return serialize.fetch_dicts(db.execute(sql, params))
+
+
+def query_weight_records(db, user_id):
+    """所有體重記錄（新到舊）"""
+    return serialize.fetch_dicts(db.execute(WEIGHTS_QUERY, (user_id,)))
+
+
+def query_checklist(db, user_id, date):
+    """指定日期的檢查清單（已封存的日期合併封存檔）"""
+    sql, params = archive.query(db, DAY_CHECKLIST, user_id, (user_id, date), since=date)
+    return serialize.fetch_dicts(db.execute(sql, params))
+
+
+def query_exercises(db):
+    """運動參數"""
+    return serialize.fetch_dicts(db.execute(EXERCISES_QUERY))
+
+
+def query_settings(db, user_id):
+    """設定（key → 原始字串）"""
+    return dict(user_settings.get(db, user_id).raw)
+
+
+# ==================== 分頁與串流 ====================
+
+PAGE_LIMIT_MAX = 1000       # 每頁最多幾個日期
+STREAM_BATCH_SIZE = 500     # 串流時每次從 cursor 取出的筆數
+DATE_MAX = '9999-12-31'
+
+# 分頁的 WHERE 子句（參數：user_id, before／user_id, oldest, before）
+PAGE_BEFORE = 'user_id = ? AND date < ?'
+PAGE_RANGE = 'user_id = ? AND date >= ? AND date < ?'
+PAGE_OLDEST_SQL = 'SELECT MIN(date) FROM ({})'
+WEIGHT_PAGE_SQL = 'SELECT * FROM weight_records WHERE {} ORDER BY date DESC'
+
+
+def page_queries(table):
+    """分頁用的查詢：before 之前最近 limit 個日期、某日期之前是否還有記錄"""
+    return (archive.Query(table, 'DISTINCT date', PAGE_BEFORE, ' ORDER BY date DESC LIMIT ?'),
+            archive.Query(table, '1', PAGE_BEFORE, ' LIMIT 1'))
+
+
+def history_query(where):
+    """飲食記錄歷史（where 為 PAGE_BEFORE 或 PAGE_RANGE）"""
+    return archive.Query('daily_meals', '*', where, ' ORDER BY date DESC, meal_order')
+
+
+def date_page(db, table, user_id):
+    """解析 ?before=<date>&limit=<n> 的 keyset 分頁
+
+    以日期為游標，一頁包含 before 之前最近的 limit 個日期的所有記錄（含已封存的日期）。
+    回傳 (WHERE 子句, 參數, 下一頁的 before；沒有更舊資料時為 None)。
+    """
+    before = request.args.get('before') or DATE_MAX
+    limit = request.args.get('limit', type=int)
+    if not limit:
+        return PAGE_BEFORE, (user_id, before), None
+
+    limit = min(max(limit, 1), PAGE_LIMIT_MAX)
+    dates, earlier = page_queries(table)
+    sql, params = archive.query(db, dates, user_id, (user_id, before), (limit,))
+    oldest = db.execute(PAGE_OLDEST_SQL.format(sql), params).fetchone()[0]
+    if oldest is None:
+        return PAGE_BEFORE, (user_id, ''), None
+
+    sql, params = archive.query(db, earlier, user_id, (user_id, oldest))
+    more = db.execute(sql, params).fetchone()
+    return PAGE_RANGE, (user_id, oldest, before), oldest if more else None
+
+
+def stream_rows(cursor, stream, fmt):
+    """逐批從 cursor 輸出 NDJSON 或 JSON，記憶體用量固定
+
+    fmt 為 columns 時 JSON 為 {"columns": [...], "rows": [...]}，NDJSON 首行為欄名陣列。
+    """
+    names = serialize.columns(cursor)
+    serialize.plain(cursor)
+    try:
+        if stream == 'json':
+            yield b'{"columns":' + serialize.dumps(names) + b',"rows":[' if fmt == 'columns' else b'['
+        elif fmt == 'columns':
+            yield serialize.dumps(names) + b'\n'
+        first = True
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            items = serialize.row_items(names, rows, fmt)
+            if stream == 'json':
+                # 整批編碼成陣列後去掉外層的 []
+                yield (b'' if first else b',') + serialize.dumps(items)[1:-1]
+            else:
+                yield b''.join(serialize.dumps(item) + b'\n' for item in items)
+            first = False
+        if stream == 'json':
+            yield b']}' if fmt == 'columns' else b']'
+    finally:
+        cursor.close()
+
+
+def rows_response(cursor, next_before=None):
+    """回傳查詢結果；?format=columns 時為欄名加陣列，?stream=ndjson|json 時改用串流輸出"""
+    fmt = request.args.get('format', 'objects')
+    if fmt not in serialize.FORMATS:
+        cursor.close()
+        return jsonify({'error': f'不支援的格式：{fmt}'}), 400
+    stream = request.args.get('stream')
+    if stream in ('ndjson', 'json'):
+        mimetype = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+        response = Response(stream_with_context(stream_rows(cursor, stream, fmt)), mimetype=mimetype)
+    else:
+        names = serialize.columns(cursor)
+        body = serialize.encode_rows(names, serialize.plain(cursor).fetchall(), fmt)
+        response = Response(body, mimetype='application/json')
+    if next_before:
+        response.headers['X-Next-Before'] = next_before
+    return response
+
+
+# ==================== 批次寫入 ====================
+
+BULK_MAX_ITEMS = 5000
+
+
+def parse_bulk(required, build):
+    """檢查批次請求的每一筆資料
+
+    required 為必填欄位，build(item) 把一筆資料轉成 SQL 參數（可拋出
+    ValueError / TypeError）。回傳 (參數列表, 每筆結果, 通過檢查的結果)，
+    請求本身格式錯誤時回傳 (None, 錯誤回應, None)。
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return None, (jsonify({'error': '請傳入陣列'}), 400), None
+    if len(items) > BULK_MAX_ITEMS:
+        return None, (jsonify({'error': f'一次最多 {BULK_MAX_ITEMS} 筆'}), 400), None
+
+    rows, results, accepted = [], [], []
+    for index, item in enumerate(items):
+        result = {'index': index, 'ok': False}
+        results.append(result)
+        if not isinstance(item, dict):
+            result['error'] = '格式錯誤'
+            continue
+        missing = [key for key in required if item.get(key) in (None, '')]
+        if missing:
+            result['error'] = f"缺少欄位: {', '.join(missing)}"
+            continue
+        try:
+            rows.append(build(item))
+        except (TypeError, ValueError) as e:
+            result['error'] = f'資料錯誤: {e}'
+            continue
+        result['ok'] = True
+        accepted.append(result)
+    return rows, results, accepted
+
+
+def bulk_response(results, saved):
+    """批次寫入的回應"""
+    return jsonify({
+        'saved': saved,
+        'failed': len(results) - saved,
+        'results': results,
+    })
+
+
+# ==================== 總覽 API ====================
+
+@app.route('/api/dashboard', methods=['GET'])
+@cached_json('settings', 'exercise_params', 'weight_records')
+def get_dashboard():
+    """頁面載入時畫出的資料：設定、運動參數與體重記錄（同一連線、同一個讀取交易）
+
+    seq 為同一快照中最新的變更序號，前端以 /api/events?since=<seq> 接續，
+    載入到串流連上之間的寫入不會遺漏。快取的回應中 seq 可能較舊，
+    串流會重送之後的變更，套用結果相同。
+    """
+    db = get_db()
+    user_id = g.user_id
+    # 明確開啟讀取交易，WAL 下各查詢看到的是同一個快照
+    db.execute('BEGIN')
+    try:
+        data = {
+            'seq': events.latest_seq(db),
+            'settings': query_settings(db, user_id),
+            'exercises': query_exercises(db),
+            'weights': query_weight_records(db, user_id),
+        }
+    finally:
+        db.rollback()
+    return jsonify(data)
 
 
 # ==================== 菜單 API ====================
 
 @app.route('/api/meals', methods=['GET'])
+@cached_json('meals')
 def get_meals():
-    """取得所有菜單"""
-    db = get_db()
-    meals = db.execute('''
-        SELECT * FROM meals ORDER BY meal_type, id
-    ''').fetchall()
-    return jsonify([dict(row) for row in meals])
+    """取得所有菜單（?format=columns 時為欄名加陣列）"""
+    return rows_response(get_db().execute(MEALS_QUERY))
 
 
 @app.route('/api/meals', methods=['POST'])
+@catalog_write
 def add_meal():
     """新增菜單"""
     data = request.json
-    db = get_db()
-    cursor = db.execute('''
-        INSERT INTO meals (name, meal_type, ingredients, calories, protein)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (data['name'], data['meal_type'], data['ingredients'],
-          data['calories'], data['protein']))
-    db.commit()
-    return jsonify({'id': cursor.lastrowid, 'message': '新增成功'})
+
+    def insert(db):
+        cursor = db.execute('''
+            INSERT INTO meals (name, meal_type, ingredients, calories, protein)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (data['name'], data['meal_type'], data['ingredients'],
+              data['calories'], data['protein']))
+        ingredients.sync_meal(db, cursor.lastrowid, data['ingredients'])
+        return cursor.lastrowid
+
+    return jsonify({'id': writer.run(insert), 'message': '新增成功'})
+
+
+@app.route('/api/meals/bulk', methods=['POST'])
+@catalog_write
+def add_meals_bulk():
+    """批次新增菜單（單一交易）"""
+    rows, results, accepted = parse_bulk(
+        ('name', 'meal_type'),
+        lambda item: (item['name'], item['meal_type'], item.get('ingredients', ''),
+                      int(item.get('calories') or 0), int(item.get('protein') or 0)))
+    if rows is None:
+        return results
+
+    def insert(db):
+        ids = database.insert_many(
+            db, 'meals', ('name', 'meal_type', 'ingredients', 'calories', 'protein'), rows)
+        for row_id, row in zip(ids, rows):
+            ingredients.sync_meal(db, row_id, row[2])
+        return ids
+
+    ids = writer.run(insert)
+    for result, row_id in zip(accepted, ids):
+        result['id'] = row_id
+    return bulk_response(results, len(rows))
 
 
 @app.route('/api/meals/<int:meal_id>', methods=['PUT'])
+@catalog_write
 def update_meal(meal_id):
     """更新菜單"""
     data = request.json
-    db = get_db()
-    db.execute('''
-        UPDATE meals SET name=?, meal_type=?, ingredients=?, calories=?, protein=?
-        WHERE id=?
-    ''', (data['name'], data['meal_type'], data['ingredients'],
-          data['calories'], data['protein'], meal_id))
-    db.commit()
+
+    def update(db):
+        old = db.execute(MEAL_INGREDIENTS_QUERY, (meal_id,)).fetchone()
+        db.execute('''
+            UPDATE meals SET name=?, meal_type=?, ingredients=?, calories=?, protein=?
+            WHERE id=?
+        ''', (data['name'], data['meal_type'], data['ingredients'],
+              data['calories'], data['protein'], meal_id))
+        # 食材文字有變才重新解析
+        if old is not None and old['ingredients'] != data['ingredients']:
+            ingredients.sync_meal(db, meal_id, data['ingredients'])
+
+    writer.run(update)
     return jsonify({'message': '更新成功'})
 
 
 @app.route('/api/meals/<int:meal_id>', methods=['DELETE'])
+@catalog_write
 def delete_meal(meal_id):
     """刪除菜單"""
-    db = get_db()
-    db.execute('DELETE FROM meals WHERE id=?', (meal_id,))
-    db.commit()
+    writer.execute('DELETE FROM meals WHERE id=?', (meal_id,))
     return jsonify({'message': '刪除成功'})
 
 
@@ -114,37 +561,25 @@ def delete_meal(meal_id):
 def get_daily_meals():
     """取得指定日期的飲食記錄"""
     date = request.args.get('date')
-    db = get_db()
-    records = db.execute('''
-        SELECT * FROM daily_meals WHERE date=? ORDER BY
-        CASE meal_type
-            WHEN 'breakfast' THEN 1
-            WHEN 'lunch' THEN 2
-            WHEN 'dinner' THEN 3
-        END
-    ''', (date,)).fetchall()
-    return jsonify([dict(row) for row in records])
+    return jsonify(query_daily_meals(get_db(), g.user_id, date))
 
 
 @app.route('/api/daily-meals', methods=['POST'])
 def add_daily_meal():
     """記錄今日吃了什麼"""
     data = request.json
-    db = get_db()
-    cursor = db.execute('''
-        INSERT INTO daily_meals (date, meal_type, meal_id, meal_name)
-        VALUES (?, ?, ?, ?)
-    ''', (data['date'], data['meal_type'], data.get('meal_id'), data['meal_name']))
-    db.commit()
-    return jsonify({'id': cursor.lastrowid, 'message': '記錄成功'})
+    result = writer.execute('''
+        INSERT INTO daily_meals (user_id, date, meal_type, meal_id, meal_name, meal_order)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (g.user_id, data['date'], data['meal_type'], data.get('meal_id'), data['meal_name'],
+          database.MEAL_ORDER.get(data['meal_type'])))
+    return jsonify({'id': result.lastrowid, 'message': '記錄成功'})
 
 
 @app.route('/api/daily-meals/<int:record_id>', methods=['DELETE'])
 def delete_daily_meal(record_id):
     """刪除飲食記錄"""
-    db = get_db()
-    db.execute('DELETE FROM daily_meals WHERE id=?', (record_id,))
-    db.commit()
+    writer.execute('DELETE FROM daily_meals WHERE id=? AND user_id=?', (record_id, g.user_id))
     return jsonify({'message': '刪除成功'})
 
 
@@ -152,232 +587,705 @@ def delete_daily_meal(record_id):
 def clear_daily_meals():
     """清除指定日期的某餐記錄"""
     data = request.json
-    db = get_db()
-    db.execute('''
-        DELETE FROM daily_meals WHERE date=? AND meal_type=?
-    ''', (data['date'], data['meal_type']))
-    db.commit()
+    writer.execute(CLEAR_MEALS_SQL, (g.user_id, data['date'], data['meal_type']))
     return jsonify({'message': '清除成功'})
 
 
 @app.route('/api/daily-meals/history', methods=['GET'])
 def get_meal_history():
-    """取得所有飲食記錄歷史（按日期分組）"""
+    """取得飲食記錄歷史（按日期分組，支援 ?before=&limit= 分頁與 ?stream=）"""
+    db = get_db()
+    where, params, next_before = date_page(db, 'daily_meals', g.user_id)
+    sql, params = archive.query(db, history_query(where), g.user_id, params)
+    return rows_response(db.execute(sql, params), next_before)
+
+
+@app.route('/api/daily-totals', methods=['GET'])
+def get_daily_totals():
+    """取得日期區間內每日的熱量／蛋白質總計（?from=&to=，含兩端）"""
+    date_from = request.args.get('from') or ''
+    date_to = request.args.get('to') or DATE_MAX
+    cursor = get_db().execute(DAILY_TOTALS_QUERY, (g.user_id, date_from, date_to))
+    return rows_response(cursor)
+
+
+# ==================== 菜單規劃 API ====================
+
+@app.route('/api/plan/generate', methods=['POST'])
+def generate_plan():
+    """自動規劃 ?days= 天的三餐（?start= 起始日，?seed= 變化，?dry_run=1 只預覽不寫入）"""
+    days = min(max(request.args.get('days', 7, type=int), 1), planner.MAX_DAYS)
+    try:
+        start = datetime.date.fromisoformat(request.args.get('start') or datetime.date.today().isoformat())
+    except ValueError:
+        return jsonify({'error': '日期格式錯誤'}), 400
+    seed = request.args.get('seed', type=int)
+
     db = get_db()
-    records = db.execute('''
-        SELECT * FROM daily_meals ORDER BY date DESC,
-        CASE meal_type
-            WHEN 'breakfast' THEN 1
-            WHEN 'lunch' THEN 2
-            WHEN 'dinner' THEN 3
-        END
-    ''').fetchall()
-    return jsonify([dict(row) for row in records])
+    try:
+        plan = planner.build_plan(db, start, days, user_settings.get(db, g.user_id), seed)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    written = 0
+    if not request.args.get('dry_run'):
+        written = writer.run(planner.write_plan, plan, database.MEAL_ORDER, g.user_id)
+    return jsonify({'plan': plan, 'written': written})
+
+
+# ==================== 搜尋 API ====================
+
+@app.route('/api/search', methods=['GET'])
+def search_catalog():
+    """全文搜尋菜單與採買清單（?q=，?type=meals|shopping 限定來源，?limit=）"""
+    query = (request.args.get('q') or '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    source = request.args.get('type')
+    sources = (source,) if source in search.SOURCES else tuple(search.SOURCES)
+    return jsonify(search.search(get_db(), query, sources, limit))
 
 
 # ==================== 採買清單 API ====================
 
 @app.route('/api/shopping', methods=['GET'])
+@cached_json('shopping_list')
 def get_shopping():
-    """取得採買清單"""
-    db = get_db()
-    items = db.execute('''
-        SELECT * FROM shopping_list ORDER BY category, id
-    ''').fetchall()
-    return jsonify([dict(row) for row in items])
+    """取得採買清單（?format=columns 時為欄名加陣列）"""
+    return rows_response(get_db().execute(SHOPPING_QUERY))
 
 
 @app.route('/api/shopping', methods=['POST'])
+@catalog_write
 def add_shopping_item():
     """新增採買項目"""
     data = request.json
-    db = get_db()
-    cursor = db.execute('''
+    result = writer.execute('''
         INSERT INTO shopping_list (name, category, brand, spec, price, weekly_amount, note)
         VALUES (?, ?, ?, ?, ?, ?, ?)
     ''', (data['name'], data['category'], data.get('brand', ''), data.get('spec', ''),
           data.get('price', ''), data.get('weekly_amount', ''), data.get('note', '')))
-    db.commit()
-    return jsonify({'id': cursor.lastrowid, 'message': '新增成功'})
+    return jsonify({'id': result.lastrowid, 'message': '新增成功'})
+
+
+@app.route('/api/shopping/generate', methods=['GET', 'POST'])
+def generate_shopping():
+    """依 ?from=&to= 的飲食記錄計算採買份量；POST 時一併寫回每週份量
+
+    採買清單為所有使用者共用時（未設定 USER_DB_DIR），只有管理員可以寫回，
+    避免以一位使用者的飲食記錄覆寫其他人看到的份量。
+    """
+    if request.method == 'POST' and not can_edit_catalog():
+        return jsonify({'error': '需要管理員權限'}), 403
+    today = datetime.date.today()
+    try:
+        date_from = datetime.date.fromisoformat(request.args.get('from') or today.isoformat())
+        date_to = datetime.date.fromisoformat(
+            request.args.get('to') or (date_from + datetime.timedelta(days=6)).isoformat())
+    except ValueError:
+        return jsonify({'error': '日期格式錯誤'}), 400
+    if date_to < date_from:
+        return jsonify({'error': '結束日期早於開始日期'}), 400
+
+    db = get_db()
+    needs, unmatched = ingredients.shopping_needs(
+        db, g.user_id, date_from.isoformat(), date_to.isoformat())
+    updated = 0
+    if request.method == 'POST':
+        updated = writer.run(ingredients.apply_weekly_amounts, needs, (date_to - date_from).days + 1)
+    return jsonify({'items': needs, 'unmatched': unmatched, 'updated': updated})
+
+
+@app.route('/api/shopping/bulk', methods=['POST'])
+@catalog_write
+def add_shopping_bulk():
+    """批次新增採買項目（單一交易）"""
+    rows, results, accepted = parse_bulk(
+        ('name', 'category'),
+        lambda item: (item['name'], item['category'], item.get('brand', ''), item.get('spec', ''),
+                      item.get('price', ''), item.get('weekly_amount', ''), item.get('note', '')))
+    if rows is None:
+        return results
+    ids = writer.run(
+        database.insert_many, 'shopping_list',
+        ('name', 'category', 'brand', 'spec', 'price', 'weekly_amount', 'note'), rows)
+    for result, row_id in zip(accepted, ids):
+        result['id'] = row_id
+    return bulk_response(results, len(rows))
 
 
 @app.route('/api/shopping/<int:item_id>', methods=['PUT'])
+@catalog_write
 def update_shopping_item(item_id):
     """更新採買項目"""
     data = request.json
-    db = get_db()
-    db.execute('''
+    writer.execute('''
         UPDATE shopping_list SET name=?, category=?, brand=?, spec=?, price=?, weekly_amount=?, note=?
         WHERE id=?
     ''', (data['name'], data['category'], data.get('brand', ''), data.get('spec', ''),
           data.get('price', ''), data.get('weekly_amount', ''), data.get('note', ''), item_id))
-    db.commit()
     return jsonify({'message': '更新成功'})
 
 
 @app.route('/api/shopping/<int:item_id>', methods=['DELETE'])
+@catalog_write
 def delete_shopping_item(item_id):
     """刪除採買項目"""
-    db = get_db()
-    db.execute('DELETE FROM shopping_list WHERE id=?', (item_id,))
-    db.commit()
+    writer.execute('DELETE FROM shopping_list WHERE id=?', (item_id,))
     return jsonify({'message': '刪除成功'})
 
 
 # ==================== 體重追蹤 API ====================
 
+WEIGHT_COLUMNS = ('user_id', 'date', 'weight', 'day')
+
 @app.route('/api/weight', methods=['GET'])
 def get_weight_records():
-    """取得體重記錄"""
+    """取得體重記錄（支援 ?before=&limit= 分頁與 ?stream=）"""
     db = get_db()
-    records = db.execute('''
-        SELECT * FROM weight_records ORDER BY date DESC
-    ''').fetchall()
-    return jsonify([dict(row) for row in records])
+    where, params, next_before = date_page(db, 'weight_records', g.user_id)
+    cursor = db.execute(WEIGHT_PAGE_SQL.format(where), params)
+    return rows_response(cursor, next_before)
 
 
 @app.route('/api/weight', methods=['POST'])
 def add_weight_record():
     """新增體重記錄"""
     data = request.json
-    db = get_db()
+    # 同一天已有記錄則覆寫
+    writer.run(database.upsert, 'weight_records', WEIGHT_COLUMNS,
+               [(g.user_id, data['date'], data['weight'], data.get('day', 1))],
+               ('user_id', 'date'))
+    return jsonify({'message': '記錄成功'})
 
-    # 檢查是否已有今天的記錄
-    existing = db.execute(
-        'SELECT id FROM weight_records WHERE date=?', (data['date'],)
-    ).fetchone()
 
-    if existing:
-        db.execute('''
-            UPDATE weight_records SET weight=?, day=? WHERE date=?
-        ''', (data['weight'], data.get('day', 1), data['date']))
-    else:
-        db.execute('''
-            INSERT INTO weight_records (date, weight, day)
-            VALUES (?, ?, ?)
-        ''', (data['date'], data['weight'], data.get('day', 1)))
+@app.route('/api/weight/trend', methods=['GET'])
+def get_weight_trend():
+    """取得體重趨勢：EWMA、7 天斜率、推估達標日與計畫速率比較"""
+    return jsonify(analytics.trend_cache.get(get_db(), g.user_id))
 
-    db.commit()
-    return jsonify({'message': '記錄成功'})
+
+@app.route('/api/weight/bulk', methods=['POST'])
+def add_weight_records_bulk():
+    """批次匯入體重記錄（同日期覆蓋，單一交易）"""
+    user_id = g.user_id
+    rows, results, _ = parse_bulk(
+        ('date', 'weight'),
+        lambda item: (user_id, item['date'], float(item['weight']), int(item.get('day', 1))))
+    if rows is None:
+        return results
+    writer.run(database.upsert, 'weight_records', WEIGHT_COLUMNS, rows, ('user_id', 'date'))
+    return bulk_response(results, len(rows))
 
 
 @app.route('/api/weight/<int:record_id>', methods=['DELETE'])
 def delete_weight_record(record_id):
     """刪除體重記錄"""
-    db = get_db()
-    db.execute('DELETE FROM weight_records WHERE id=?', (record_id,))
-    db.commit()
+    writer.execute('DELETE FROM weight_records WHERE id=? AND user_id=?', (record_id, g.user_id))
     return jsonify({'message': '刪除成功'})
 
 
 # ==================== 每日檢查 API ====================
 
+CHECKLIST_COLUMNS = ('user_id', 'date', 'item_key', 'checked')
+CHECKLIST_KEY = ('user_id', 'date', 'item_key')
+
 @app.route('/api/checklist', methods=['GET'])
 def get_checklist():
     """取得今日檢查清單狀態"""
     date = request.args.get('date')
-    db = get_db()
-    items = db.execute('''
-        SELECT * FROM daily_checklist WHERE date=?
-    ''', (date,)).fetchall()
-    return jsonify([dict(row) for row in items])
+    return jsonify(query_checklist(get_db(), g.user_id, date))
 
 
 @app.route('/api/checklist', methods=['POST'])
 def update_checklist():
     """更新檢查清單項目"""
     data = request.json
-    db = get_db()
-
-    existing = db.execute('''
-        SELECT id FROM daily_checklist WHERE date=? AND item_key=?
-    ''', (data['date'], data['item_key'])).fetchone()
+    writer.run(database.upsert, 'daily_checklist', CHECKLIST_COLUMNS,
+               [(g.user_id, data['date'], data['item_key'], data['checked'])], CHECKLIST_KEY)
+    return jsonify({'message': '更新成功'})
 
-    if existing:
-        db.execute('''
-            UPDATE daily_checklist SET checked=? WHERE id=?
-        ''', (data['checked'], existing['id']))
-    else:
-        db.execute('''
-            INSERT INTO daily_checklist (date, item_key, checked)
-            VALUES (?, ?, ?)
-        ''', (data['date'], data['item_key'], data['checked']))
 
-    db.commit()
-    return jsonify({'message': '更新成功'})
+@app.route('/api/checklist/bulk', methods=['POST'])
+def update_checklist_bulk():
+    """批次更新檢查清單（例如一次勾選整天，單一交易）"""
+    user_id = g.user_id
+    rows, results, _ = parse_bulk(
+        ('date', 'item_key'),
+        lambda item: (user_id, item['date'], item['item_key'], int(bool(item.get('checked', 1)))))
+    if rows is None:
+        return results
+    writer.run(database.upsert, 'daily_checklist', CHECKLIST_COLUMNS, rows, CHECKLIST_KEY)
+    return bulk_response(results, len(rows))
 
 
 # ==================== 運動計畫 API ====================
 
 @app.route('/api/exercise', methods=['GET'])
+@cached_json('exercise_params')
 def get_exercise():
-    """取得運動參數"""
-    db = get_db()
-    exercises = db.execute('SELECT * FROM exercise_params ORDER BY id').fetchall()
-    return jsonify([dict(row) for row in exercises])
+    """取得運動參數（?format=columns 時為欄名加陣列）"""
+    return rows_response(get_db().execute(EXERCISES_QUERY))
 
 
 @app.route('/api/exercise', methods=['POST'])
+@catalog_write
 def add_exercise():
     """新增運動項目"""
     data = request.json
-    db = get_db()
-    cursor = db.execute('''
+    result = writer.execute('''
         INSERT INTO exercise_params (name, duration, intensity, distance, calories)
         VALUES (?, ?, ?, ?, ?)
     ''', (data['name'], data['duration'], data['intensity'],
           data['distance'], data['calories']))
-    db.commit()
-    return jsonify({'id': cursor.lastrowid, 'message': '新增成功'})
+    return jsonify({'id': result.lastrowid, 'message': '新增成功'})
 
 
 @app.route('/api/exercise/<int:exercise_id>', methods=['PUT'])
+@catalog_write
 def update_exercise(exercise_id):
     """更新運動項目"""
     data = request.json
-    db = get_db()
-    db.execute('''
+    writer.execute('''
         UPDATE exercise_params SET name=?, duration=?, intensity=?, distance=?, calories=?
         WHERE id=?
     ''', (data['name'], data['duration'], data['intensity'],
           data['distance'], data['calories'], exercise_id))
-    db.commit()
     return jsonify({'message': '更新成功'})
 
 
 @app.route('/api/exercise/<int:exercise_id>', methods=['DELETE'])
+@catalog_write
 def delete_exercise(exercise_id):
     """刪除運動項目"""
-    db = get_db()
-    db.execute('DELETE FROM exercise_params WHERE id=?', (exercise_id,))
-    db.commit()
+    writer.execute('DELETE FROM exercise_params WHERE id=?', (exercise_id,))
     return jsonify({'message': '刪除成功'})
 
 
 # ==================== 設定 API ====================
 
 @app.route('/api/settings', methods=['GET'])
+@cached_json('settings')
 def get_settings():
     """取得設定"""
-    db = get_db()
-    settings = db.execute('SELECT * FROM settings').fetchall()
-    return jsonify({row['key']: row['value'] for row in settings})
+    return jsonify(query_settings(get_db(), g.user_id))
 
 
 @app.route('/api/settings', methods=['POST'])
 def update_settings():
     """更新設定"""
     data = request.json
-    db = get_db()
-    for key, value in data.items():
-        db.execute('''
-            INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)
-        ''', (key, str(value)))
-    db.commit()
+    writer.executemany('''
+        INSERT OR REPLACE INTO settings (user_id, key, value) VALUES (?, ?, ?)
+    ''', [(g.user_id, key, str(value)) for key, value in data.items()])
     return jsonify({'message': '設定已更新'})
 
 
+# ==================== 變更串流 API ====================
+
+def event_stream_args():
+    """目前請求的變更串流參數 (資料庫檔, user_id, since, 秒數)，asgi.py 的 async 版本共用"""
+    # 瀏覽器自動重連時帶的 Last-Event-ID 比網址上第一次連線的 since 新
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    duration = request.args.get('timeout', events.EVENTS_MAX_SECONDS, type=float)
+    duration = min(max(duration, 0), events.EVENTS_MAX_SECONDS)
+    return database.db_path(), g.user_id, since, duration
+
+
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """以 Server-Sent Events 推送資料變更（Last-Event-ID 或 ?since=<seq> 續傳，?timeout= 秒）"""
+    args = event_stream_args()
+    if not events.acquire_stream():
+        response = jsonify({'error': '同時連線數已滿，請稍後再試'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    response = Response(events.stream(*args), mimetype='text/event-stream')
+    response.call_on_close(events.release_stream)
+    response.headers.update(events.RESPONSE_HEADERS)
+    return response
+
+
+# ==================== 匯出匯入 API ====================
+
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024   # 上傳超過此大小時暫存到磁碟
+
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """串流匯出資料（?tables=a,b 預設全部，?format=ndjson|csv；CSV 限單一資料表）"""
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        tables = transfer.parse_tables(request.args.get('tables'))
+        chunks = transfer.dump(get_db(), tables, fmt, g.user_id)
+        first = next(chunks, '')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        yield first
+        yield from chunks
+
+    name = tables[0] if len(tables) == 1 else 'export'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=gym_plan-{name}.{fmt}'
+    return response
+
+
+@app.route('/api/import', methods=['POST'])
+def import_data():
+    """匯入 NDJSON / CSV（?format=，CSV 需 ?table=），整個檔案在同一個交易中寫入
+
+    不經過寫入佇列（不受 WRITE_TIMEOUT 限制）：先把上傳內容收完（大檔暫存到磁碟），
+    再以自己的連線在單一交易中寫入，寫鎖只在實際寫入時持有；任何一行有錯就整批回滾。
+    檔案含共用資料（菜單等）時與其他共用資料的寫入相同，未分檔時限管理員。
+    """
+    upload = request.files.get('file')
+    fmt = request.args.get('format') or transfer.guess_format(upload and upload.filename)
+    table = request.args.get('table')
+    if upload is not None:
+        spool = upload.stream
+    else:
+        spool = tempfile.SpooledTemporaryFile(IMPORT_SPOOL_BYTES)
+        shutil.copyfileobj(request.stream, spool)
+        spool.seek(0)
+    db = database.connect(database.db_path())
+    try:
+        with database.transaction(db):
+            counts = transfer.load(db, transfer.text_stream(spool), fmt, g.user_id, table,
+                                   shared=can_edit_catalog())
+    except transfer.SharedTableError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close()
+        spool.close()
+    return jsonify({'imported': counts, 'message': '匯入成功'})
+
+
+# ==================== 系統狀態 API ====================
+
+@app.route('/api/admin/pool-stats', methods=['GET'])
+@admin_required
+def get_pool_stats():
+    """取得本 worker 的資料庫連線池統計（分檔模式下為目前開啟的每個檔案）"""
+    return jsonify([pool.snapshot() for pool in database.open_pools()])
+
+
+@app.route('/api/admin/backup', methods=['GET'])
+@admin_required
+def get_backup_status():
+    """取得目前（或最近一次）備份的進度、耗時與保留的快照"""
+    return jsonify(backup.status())
+
+
+@app.route('/api/admin/backup', methods=['POST'])
+@admin_required
+def start_backup():
+    """在背景開始一次備份，進度以 GET 查詢"""
+    try:
+        backup.run_in_background()
+    except backup.BackupRunning as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'message': '已開始備份'}), 202
+
+
+# ==================== 帳號管理 API ====================
+
+@app.route('/api/admin/users', methods=['GET'])
+@admin_required
+def get_users():
+    """列出所有使用者"""
+    return jsonify(accounts.list_users())
+
+
+@app.route('/api/admin/users', methods=['POST'])
+@admin_required
+def add_user():
+    """建立使用者"""
+    data = request.json
+    try:
+        user = accounts.create_user(data.get('username'), data.get('password'),
+                                    bool(data.get('is_admin')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({**user, 'message': '新增成功'})
+
+
+# ==================== 指令列 ====================
+
+db_cli = AppGroup('db', help='資料庫管理')
+
+
+@db_cli.command('upgrade')
+def db_upgrade():
+    """套用 schema migration 並寫入預設資料"""
+    applied = init_db()
+    if applied:
+        click.echo(f"已套用 migration: {', '.join(map(str, applied))}")
+    else:
+        click.echo('資料庫已是最新版本')
+
+
+@db_cli.command('status')
+def db_status():
+    """顯示目前 schema 版本與待套用的 migration"""
+    db = database.connect()
+    try:
+        click.echo(f'目前版本: {migrations.current_version(db)}')
+        for version, description, _ in migrations.pending(db):
+            click.echo(f'  待套用 {version}: {description}')
+    finally:
+        db.close()
+
+
+@db_cli.command('archive')
+@click.option('--days', type=int, default=archive.ARCHIVE_AFTER_DAYS, show_default=True,
+              help='封存幾天以前的記錄')
+@click.option('--before', help='封存此日期（不含）以前的記錄（YYYY-MM-DD），優先於 --days')
+@click.option('--user', 'user_id', type=int, help='只封存指定的使用者（預設為全部）')
+@click.option('--vacuum/--no-vacuum', default=None, help='封存後是否 VACUUM（預設在空頁過多時執行）')
+def db_archive(days, before, user_id, vacuum):
+    """把舊的飲食記錄與檢查清單搬到封存檔，之後 ANALYZE／PRAGMA optimize"""
+    if before:
+        try:
+            datetime.date.fromisoformat(before)
+        except ValueError:
+            raise click.ClickException('日期格式錯誤')
+    else:
+        before = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+    init_db()
+
+    user_ids = [user_id] if user_id else [user['id'] for user in accounts.list_users()]
+    paths = {}
+    for uid in user_ids:
+        paths.setdefault(database.user_db_path(uid), []).append(uid)
+    for path, uids in paths.items():
+        counts = archive.run(path, before, uids)
+        vacuumed = archive.maintain(path, vacuum)
+        moved = '、'.join(f'{table} {count} 筆' for table, count in counts.items())
+        click.echo(f"{path}：封存 {before} 以前的記錄（{moved}）{'，已 VACUUM' if vacuumed else ''}")
+
+
+@db_cli.command('backup')
+@click.option('--keep', type=int, default=backup.BACKUP_KEEP, show_default=True,
+              help='保留的快照份數')
+def db_backup(keep):
+    """線上備份資料庫（服務不需停止），驗證後輪替舊快照"""
+    try:
+        result = backup.run(keep=keep)
+    except backup.BackupRunning as e:
+        raise click.ClickException(str(e))
+    except backup.BackupError as e:
+        raise click.ClickException(f'備份失敗：{e}')
+    for item in result['files']:
+        click.echo(f"  {item['name']}：{item['bytes']} bytes，{item['seconds']} 秒，integrity_check {item['integrity']}")
+    click.echo(f"已建立快照 {os.path.join(backup.BACKUP_DIR, result['snapshot'])}"
+               f"（{result['duration_seconds']} 秒）")
+    for name in result['removed']:
+        click.echo(f'  已刪除舊快照 {name}')
+
+
+# `flask db check-plans` 檢查的查詢：(SQL, 範例參數, 可接受的計畫明細)
+PlanCheck = namedtuple('PlanCheck', 'sql params allow')
+
+# 本來就整表回傳的小表（依主鍵順序讀取，不需額外索引）
+FULL_SCAN_OK = ('exercise_params',)
+
+
+def _archived_checks(spec, user_id, params, tail_params=()):
+    """可封存資料表的查詢：只讀熱資料表與合併封存檔兩種 SQL 都要檢查"""
+    yield PlanCheck(archive.plain_sql(spec), (*params, *tail_params), ())
+    if spec.table in archive.TABLES:
+        yield PlanCheck(archive.union_sql(spec), (*params, *params, user_id, *tail_params), ())
+
+
+def plan_checks():
+    """由 API 實際使用的查詢常數與組成函式產生檢查清單，查詢改了檢查也跟著改"""
+    user, day, week_end = 1, '2024-01-01', '2024-01-07'
+    checks = [PlanCheck(sql, params, ()) for sql, params in [
+        (MEALS_QUERY, ()),
+        (SHOPPING_QUERY, ()),
+        (EXERCISES_QUERY, ()),
+        (MEAL_INGREDIENTS_QUERY, (1,)),
+        (planner.MEALS_QUERY, ()),
+        (WEIGHTS_QUERY, (user,)),
+        (WEIGHT_PAGE_SQL.format(PAGE_BEFORE), (user, DATE_MAX)),
+        (WEIGHT_PAGE_SQL.format(PAGE_RANGE), (user, day, week_end)),
+        (DAILY_TOTALS_QUERY, (user, day, week_end)),
+        (CLEAR_MEALS_SQL, (user, day, 'breakfast')),
+        (ingredients.NEEDS_QUERY, (user, day, week_end)),
+        (analytics.SERIES_QUERY, (user,)),
+        (analytics.PREFIX_QUERY, (user, day)),
+        (analytics.TAIL_QUERY, (user, day)),
+        (user_settings.SETTINGS_QUERY, (user,)),
+        (accounts.USER_QUERY, ('admin',)),
+        (events.CHANGES_QUERY, (0, user, events.BATCH_SIZE)),
+        (events.OLDEST_QUERY, ()),
+        (cache.versions_sql(1), ('meals',)),
+        # migration 中 daily_totals_catalog_* trigger 依 meal_id 找出受影響的日期
+        # （trigger 內的語句不會出現在 EXPLAIN QUERY PLAN，DDL 也不再變動）
+        ('SELECT user_id, date FROM daily_meals WHERE meal_id = ?', (1,)),
+    ]]
+
+    # 本來就要整表讀取：採買對照表、帳號列表（依 rowid 順序）
+    checks.append(PlanCheck(ingredients.SHOPPING_INDEX_QUERY, (), ('SCAN shopping_list',)))
+    checks.append(PlanCheck(accounts.USERS_QUERY, (), ('SCAN users',)))
+
+    checks += _archived_checks(DAY_MEALS, user, (user, day))
+    checks += _archived_checks(DAY_CHECKLIST, user, (user, day))
+    checks += _archived_checks(history_query(PAGE_BEFORE), user, (user, DATE_MAX))
+    checks += _archived_checks(history_query(PAGE_RANGE), user, (user, day, week_end))
+    for table in ('daily_meals', 'weight_records'):
+        dates, earlier = page_queries(table)
+        for check in _archived_checks(dates, user, (user, DATE_MAX), (30,)):
+            checks.append(check._replace(sql=PAGE_OLDEST_SQL.format(check.sql)))
+        checks += _archived_checks(earlier, user, (user, day))
+
+    for table, spec in transfer.TABLES.items():
+        if table in archive.TABLES:
+            checks += _archived_checks(transfer.export_query(table), user, (user,))
+        else:
+            # 共用資料表整表匯出
+            allow = () if spec.scoped else (f'SCAN {table}',)
+            checks.append(PlanCheck(transfer.export_sql(table), (user,) if spec.scoped else (), allow))
+
+    for source, (fts, _, _) in search.SOURCES.items():
+        sql, params = search.search_sql(source, ['雞胸肉'])
+        checks.append(PlanCheck(sql, params + [20], ()))
+        # 不足 3 字的關鍵字無法使用 trigram 索引，逐列以 LIKE 比對並依命中排序
+        sql, params = search.search_sql(source, ['雞胸'])
+        checks.append(PlanCheck(sql, params + [20],
+                                (f'SCAN {fts} VIRTUAL TABLE', 'USE TEMP B-TREE FOR ORDER BY')))
+    return checks
+
+
+@contextmanager
+def plan_archive(db):
+    """讓合併封存檔的查詢可以 EXPLAIN：沒有封存檔時掛上暫時建立的空封存檔"""
+    if archive.attach(db):
+        yield
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        target = archive.ensure(os.path.join(directory, 'plans.db'))
+        db.execute(f'ATTACH DATABASE ? AS {archive.ALIAS}', (target,))
+        try:
+            yield
+        finally:
+            db.execute(f'DETACH DATABASE {archive.ALIAS}')
+
+
+@contextmanager
+def plan_database(live):
+    """EXPLAIN 用的連線：預設為暫存目錄中以 migration 建立的空白資料庫，
+    計畫只取決於 schema 與索引，不受 ANALYZE 統計與資料量影響"""
+    if live:
+        db = database.connect()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        db = database.connect(os.path.join(directory, 'plans.db'))
+        try:
+            migrations.upgrade(db)
+            yield db
+        finally:
+            db.close()
+
+
+@db_cli.command('check-plans')
+@click.option('--live', is_flag=True,
+              help='改用目前的資料庫與其統計檢查（資料少時小表整表讀取較快，可能列為 SCAN）')
+@click.option('--quiet', '-q', is_flag=True, help='只列出有問題的查詢')
+def db_check_plans(live, quiet):
+    """檢查 API 查詢是否退化為全表掃描，有問題時以非 0 結束"""
+    failed = 0
+    with plan_database(live) as db, plan_archive(db):
+        for check in plan_checks():
+            problems = [
+                detail for detail in database.plan_problems(db, check.sql, check.params, FULL_SCAN_OK)
+                if not detail.startswith(check.allow)
+            ]
+            sql = ' '.join(check.sql.split())
+            if problems:
+                failed += 1
+                click.echo(f'[FAIL] {sql}')
+                for detail in problems:
+                    click.echo(f'       {detail}')
+            elif not quiet:
+                click.echo(f'[ OK ] {sql}')
+    if failed:
+        raise click.ClickException(f'{failed} 個查詢未使用索引')
+
+
+app.cli.add_command(db_cli)
+
+
+user_cli = AppGroup('user', help='帳號管理')
+
+
+@user_cli.command('create')
+@click.argument('username')
+@click.option('--admin', is_flag=True, help='設為管理員')
+@click.password_option()
+def user_create(username, admin, password):
+    """建立使用者"""
+    try:
+        user = accounts.create_user(username, password, admin)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"已建立使用者 {user['username']}（id {user['id']}）")
+
+
+@user_cli.command('passwd')
+@click.argument('username')
+@click.password_option()
+def user_passwd(username, password):
+    """重設密碼"""
+    try:
+        changed = accounts.set_password(username, password)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not changed:
+        raise click.ClickException(f'找不到使用者 {username}')
+    click.echo('密碼已更新')
+
+
+@user_cli.command('list')
+def user_list():
+    """列出所有使用者"""
+    for user in accounts.list_users():
+        role = ' (admin)' if user['is_admin'] else ''
+        click.echo(f"{user['id']:>5}  {user['username']}{role}")
+
+
+app.cli.add_command(user_cli)
+
+
+assets_cli = AppGroup('assets', help='靜態檔建置')
+
+
+@assets_cli.command('build')
+def assets_build():
+    """依內容雜湊命名並預先壓縮 static/ 下的 JS / CSS"""
+    for name, hashed in assets.build().items():
+        click.echo(f'{name} -> {hashed}')
+    if assets.brotli is None:
+        click.echo('（未安裝 brotli，只產生 gzip）')
+
+
+app.cli.add_command(assets_cli)
+
+
 if __name__ == '__main__':
+    init_db()
+    assets.build()
     print("="*50)
     print("80天減重計畫 Server")
     print("請開啟瀏覽器訪問: http://127.0.0.1:5000")
@@ -0,0 +1,278 @@
+"""
+歷史資料封存
+
+daily_meals、daily_checklist 只增不減，過去週期的記錄一直留在熱資料表，
+依日期的查詢、歷史分頁與匯出都跟著變慢。封存把早於指定日期的記錄搬到
+資料庫旁的封存檔（fitness.db → fitness.archive.db，分檔模式下每個使用者檔
+各一個），熱資料表只留最近的資料；每日營養總計（daily_totals）留在主資料庫
+作為各日的摘要，不隨搬移扣除。
+
+讀取時以 ATTACH 掛上封存檔，查詢範圍早於使用者的 cutoff 時改為
+「熱資料表 UNION ALL 封存表」，兩邊都依索引順序讀取再合併，API 的結果與
+封存前相同。已封存的日期仍可新增記錄（寫入熱資料表），檢查清單的同一項目
+以熱資料表為準。
+
+    flask --app app db archive --days 160
+"""
+
+import os
+from collections import OrderedDict, namedtuple
+
+import database
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 160))   # 預設保留最近兩個 80 天週期
+ARCHIVE_BATCH_ROWS = 20000   # 每個交易約搬移的筆數（以整天為單位），寫鎖不會佔用太久
+VACUUM_FREE_RATIO = 0.25     # 空頁佔檔案的比例超過此值時 VACUUM
+ALIAS = 'archive'
+
+# columns：搬移與查詢的欄位（與熱資料表相同）；schema／index：封存檔中的表；
+# preferred：這些欄位相同時以熱資料表的記錄為準（None 表示兩邊都列出）
+ArchiveTable = namedtuple('ArchiveTable', 'columns schema index preferred')
+
+TABLES = OrderedDict([
+    ('daily_meals', ArchiveTable(
+        'id, user_id, date, meal_type, meal_id, meal_name, meal_order',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_meals (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            meal_id INTEGER,
+            meal_name TEXT,
+            meal_order INTEGER
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_daily_meals_user_date_order '
+        'ON daily_meals(user_id, date DESC, meal_order)',
+        None)),
+    ('daily_checklist', ArchiveTable(
+        'id, user_id, date, item_key, checked',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_checklist (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            checked INTEGER DEFAULT 0,
+            UNIQUE(user_id, date, item_key)
+        )
+        ''',
+        None,
+        ('user_id', 'date', 'item_key'))),
+])
+
+# 搬移時暫停的 trigger：刪除熱資料不應扣掉每日總計，也不是使用者的變更，不寫入變更記錄
+SUSPENDED_TRIGGERS = ('daily_totals_meal_delete', 'daily_meals_change_delete',
+                      'daily_checklist_change_delete')
+
+
+def archive_path(path):
+    """資料庫檔對應的封存檔"""
+    base, ext = os.path.splitext(path)
+    return f'{base}.archive{ext}'
+
+
+def cutoff(db, user_id):
+    """使用者封存到哪一天（早於此日期的記錄在封存檔），沒有封存時為 None"""
+    row = db.execute('SELECT cutoff FROM archive_state WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def attach(db):
+    """在連線上掛上封存檔，回傳是否可用（封存檔不存在時為 False）"""
+    if getattr(db, 'archive_attached', False):
+        return True
+    path = archive_path(db.path)
+    if not os.path.exists(path):
+        return False
+    db.execute(f'ATTACH DATABASE ? AS {ALIAS}', (path,))
+    db.archive_attached = True
+    return True
+
+
+def covers(db, table, user_id, since=''):
+    """查詢 since（含）以後的 table 記錄是否需要合併封存檔"""
+    if table not in TABLES:
+        return False
+    value = cutoff(db, user_id)
+    return value is not None and since < value and attach(db)
+
+
+# 可能合併封存檔的查詢：`SELECT {select} FROM {table} WHERE {where}{tail}`
+Query = namedtuple('Query', 'table select where tail')
+
+
+def plain_sql(spec):
+    """只讀熱資料表的 SQL"""
+    return f'SELECT {spec.select} FROM {spec.table} WHERE {spec.where}{spec.tail}'
+
+
+def union_sql(spec):
+    """熱資料表 UNION ALL 封存表的 SQL（參數依序為 where、where、user_id、tail）
+
+    封存表只取 cutoff 之前的記錄（cutoff 在同一個查詢中讀取，不會與搬移中的
+    記錄重複）；tail（ORDER BY、LIMIT）套用在合併後的結果。select 以 DISTINCT
+    開頭時以 UNION 去除兩邊重複的值。
+    """
+    table = spec.table
+    select = TABLES[table].columns if spec.select == '*' else spec.select
+    # 封存表的記錄本來就都早於 cutoff，這個條件只是過濾；+date 讓索引用在 where 的條件上
+    archived = (f'SELECT {select} FROM {ALIAS}.{table} AS {table} WHERE {spec.where} '
+                f'AND +date < (SELECT cutoff FROM main.archive_state WHERE user_id = ?)')
+    preferred = TABLES[table].preferred
+    if preferred:
+        match = ' AND '.join(f'hot.{column} = {table}.{column}' for column in preferred)
+        archived += f' AND NOT EXISTS (SELECT 1 FROM main.{table} AS hot WHERE {match})'
+    union = 'UNION' if select.upper().startswith('DISTINCT ') else 'UNION ALL'
+    return (f'SELECT {select} FROM main.{table} AS {table} WHERE {spec.where} '
+            f'{union} {archived}{spec.tail}')
+
+
+def query(db, spec, user_id, params, tail_params=(), since=''):
+    """依 spec 組成查詢，需要時合併封存檔，回傳 (SQL, 參數)"""
+    if not covers(db, spec.table, user_id, since):
+        return plain_sql(spec), (*params, *tail_params)
+    return union_sql(spec), (*params, *params, user_id, *tail_params)
+
+
+# ==================== 搬移 ====================
+
+def ensure(path):
+    """建立封存檔與其中的資料表，回傳封存檔路徑"""
+    target = archive_path(path)
+    db = database.connect(target)
+    try:
+        for spec in TABLES.values():
+            db.execute(spec.schema)
+            if spec.index:
+                db.execute(spec.index)
+        db.commit()
+    finally:
+        db.close()
+    return target
+
+
+def _next_boundary(db, user_id, before, batch):
+    """本批搬移的上界：各表從最舊的記錄起約 batch 筆、補滿最後一天後的下一個日期"""
+    upto = before
+    for table in TABLES:
+        row = db.execute(f'''
+            SELECT date FROM {table} WHERE user_id = ? AND date < ? ORDER BY date LIMIT 1 OFFSET ?
+        ''', (user_id, before, batch)).fetchone()
+        if row is None:
+            continue
+        following = db.execute(f'''
+            SELECT MIN(date) FROM {table} WHERE user_id = ? AND date > ? AND date < ?
+        ''', (user_id, row[0], before)).fetchone()[0]
+        upto = min(upto, following or before)
+    return upto
+
+
+def _suspend_triggers(db):
+    rows = db.execute(f'''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'trigger' AND name IN ({', '.join('?' * len(SUSPENDED_TRIGGERS))})
+    ''', SUSPENDED_TRIGGERS).fetchall()
+    for row in rows:
+        db.execute(f'DROP TRIGGER {row["name"]}')
+    return [row['sql'] for row in rows]
+
+
+def _pending(db, user_id, before):
+    return any(
+        db.execute(f'SELECT 1 FROM {table} WHERE user_id = ? AND date < ? LIMIT 1',
+                   (user_id, before)).fetchone()
+        for table in TABLES)
+
+
+def archive_user(db, store, user_id, before, batch=ARCHIVE_BATCH_ROWS):
+    """把使用者早於 before 的記錄分批搬到封存檔，回傳各表搬移的筆數
+
+    db 為主資料庫連線，store 為掛上主資料庫（hot）的封存檔連線。每批先鎖住主資料庫的
+    寫入，由 store 複製並 commit 封存檔，再刪除熱資料、更新 cutoff 並 commit；
+    兩次 commit 之間中斷時 cutoff 尚未前進，讀取不會重複，重新執行即可。
+    """
+    counts = dict.fromkeys(TABLES, 0)
+    if not _pending(db, user_id, before):
+        return counts
+    while True:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            upto = _next_boundary(db, user_id, before, batch)
+            store.execute('BEGIN')
+            for table, spec in TABLES.items():
+                store.execute(f'''
+                    INSERT OR REPLACE INTO main.{table} ({spec.columns})
+                    SELECT {spec.columns} FROM hot.{table} WHERE user_id = ? AND date < ?
+                ''', (user_id, upto))
+            store.commit()
+
+            triggers = _suspend_triggers(db)
+            for table in TABLES:
+                counts[table] += db.execute(
+                    f'DELETE FROM {table} WHERE user_id = ? AND date < ?', (user_id, upto)).rowcount
+            for sql in triggers:
+                db.execute(sql)
+            db.execute('''
+                INSERT INTO archive_state (user_id, cutoff) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    cutoff = MAX(cutoff, excluded.cutoff), archived_at = CURRENT_TIMESTAMP
+            ''', (user_id, upto))
+            db.commit()
+        except BaseException:
+            if store.in_transaction:
+                store.rollback()
+            db.rollback()
+            raise
+        if upto == before:
+            return counts
+
+
+def run(path, before, user_ids):
+    """封存 path 中各使用者早於 before（YYYY-MM-DD）的記錄，回傳各表搬移的筆數"""
+    target = ensure(path)
+    db = database.connect(path)
+    store = database.connect(target)
+    counts = dict.fromkeys(TABLES, 0)
+    try:
+        store.execute('ATTACH DATABASE ? AS hot', (path,))
+        for user_id in user_ids:
+            for table, count in archive_user(db, store, user_id, before).items():
+                counts[table] += count
+    finally:
+        store.close()
+        db.close()
+    return counts
+
+
+def maintain(path, vacuum=None):
+    """封存後整理：ANALYZE 搬動過的表與 PRAGMA optimize，空頁過多時 VACUUM
+
+    vacuum 為 True／False 時強制執行／略過 VACUUM。回傳是否執行了 VACUUM。
+    """
+    db = database.connect(path)
+    try:
+        for table in TABLES:
+            db.execute(f'ANALYZE {table}')
+        db.execute('PRAGMA optimize')
+        if vacuum is None:
+            pages = db.execute('PRAGMA page_count').fetchone()[0]
+            free = db.execute('PRAGMA freelist_count').fetchone()[0]
+            vacuum = bool(pages) and free / pages >= VACUUM_FREE_RATIO
+        if vacuum:
+            db.execute('VACUUM')
+            # WAL 模式下 VACUUM 的結果先寫進 WAL，寫回主檔後截斷
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        db.close()
+
+    target = archive_path(path)
+    if os.path.exists(target):
+        store = database.connect(target)
+        try:
+            store.execute('ANALYZE')
+            store.execute('PRAGMA optimize')
+        finally:
+            store.close()
+    return vacuum
@@ -0,0 +1,158 @@
+"""
+ASGI 進入點
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+一般路由由 a2wsgi 轉接同一個 Flask app，不另寫一份 API：連線與請求內容的
+收發在事件迴圈，view 仍是同步函式，在 ASGI_THREADS 條執行緒上執行，同時
+處理中的請求數以此為上限（與 gunicorn gthread 的 threads 相同），寫入再由
+writer 的單一寫入連線合併 commit。
+
+長時間掛著的變更串流（GET /api/events）則是原生的 async handler：登入檢查
+與參數和 Flask 版相同，查詢借用 aiodb 的 reader 執行緒，等待變更時不佔
+執行緒，客戶端斷線立即結束，因此單一進程可以同時掛著上千條串流。
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import Body, build_environ
+from flask import g, session
+from werkzeug.exceptions import ClientDisconnected
+
+import aiodb
+import backup
+import database
+import events
+from app import app as flask_app, event_stream_args
+
+# 執行 Flask view 的執行緒數（預設與連線池大小相同）
+THREADS = int(os.environ.get('ASGI_THREADS', database.POOL_SIZE))
+EVENTS_PATH = '/api/events'
+
+
+def terminated_input(wsgi_app):
+    """告知 Flask wsgi.input 會在內容結尾停止（a2wsgi 依 more_body 結束），chunked 上傳才讀得到"""
+    def app(environ, start_response):
+        environ['wsgi.input_terminated'] = True
+        return wsgi_app(environ, start_response)
+    return app
+
+
+def checked_receive(receive):
+    """a2wsgi 讀取請求內容用的 receive：收完前客戶端斷線時拋出 ClientDisconnected，
+    截斷的上傳不會被當成完整內容"""
+    async def receive_body():
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        return message
+    return receive_body
+
+
+def request_path(scope):
+    path, root_path = scope['path'], scope.get('root_path', '')
+    return path[len(root_path):] if root_path and path.startswith(root_path) else path
+
+
+def _stream_args(environ):
+    """在 Flask 的請求環境中檢查登入並取得串流參數，未登入時回傳 None"""
+    with flask_app.request_context(environ):
+        user_id = session.get('user_id')
+        if user_id is None:
+            return None
+        g.user_id = user_id
+        return event_stream_args()
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_json(send, status, data, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body',
+                'body': json.dumps(data, ensure_ascii=False).encode('utf-8')})
+
+
+class App:
+    """/api/events 由原生 async handler 處理，其餘請求交給 a2wsgi 轉接的 Flask app"""
+
+    def __init__(self, wsgi_app, threads=THREADS):
+        self.wsgi = WSGIMiddleware(terminated_input(wsgi_app), workers=threads)
+        self.streams = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] != 'http':
+            await self.wsgi(scope, receive, send)
+        elif scope['method'] == 'GET' and request_path(scope) == EVENTS_PATH:
+            await self.events(scope, receive, send)
+        else:
+            await self.wsgi(scope, checked_receive(receive), send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                backup.start_scheduler()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        """等待進行中的 view 結束並關閉執行緒與閒置連線"""
+        self.wsgi.executor.shutdown(wait=True)
+        aiodb.executor.shutdown()
+
+    async def events(self, scope, receive, send):
+        """GET /api/events 的 async 版本（參數與回應同 app.get_events）"""
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, Body(loop, receive))
+        args = await aiodb.executor.run_reader(_stream_args, environ)
+        if args is None:
+            await _send_json(send, 401, {'error': '請先登入'})
+            return
+        if self.streams >= events.EVENTS_MAX_ASYNC_STREAMS:
+            await _send_json(send, 503, {'error': '同時連線數已滿，請稍後再試'},
+                             [(b'retry-after', b'30')])
+            return
+
+        self.streams += 1
+        disconnected = loop.create_task(_wait_disconnect(receive))
+        chunks = events.stream_async(*args)
+        try:
+            headers = [(b'content-type', b'text/event-stream; charset=utf-8')]
+            headers += [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in events.RESPONSE_HEADERS.items()]
+            await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+            while True:
+                step = asyncio.ensure_future(anext(chunks, None))
+                await asyncio.wait((step, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    # 客戶端已斷線：不必等到下一個事件或 heartbeat
+                    step.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await step
+                    return
+                chunk = step.result()
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'),
+                            'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            self.streams -= 1
+            disconnected.cancel()
+            await chunks.aclose()
+
+
+app = App(flask_app)
@@ -0,0 +1,144 @@
+"""
+靜態檔建置與供應
+
+建置時把 static/ 下的 JS / CSS 依內容雜湊改名（script.<hash>.js）複製到
+static/dist/，並預先壓縮成 .gz（有安裝 brotli 時另產生 .br），寫出
+manifest.json 對照原檔名。執行時讀入 manifest 與各壓縮版本，依
+Accept-Encoding 直接回傳記憶體中的內容，檔名隨內容改變，可設為永久快取。
+
+    flask --app app assets build
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from collections import namedtuple
+
+try:
+    import brotli
+except ImportError:  # 選用：沒有安裝時只產生 gzip
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = 'manifest.json'
+EXTENSIONS = ('.js', '.css')
+HASH_LENGTH = 12
+MIN_COMPRESS_BYTES = 512   # 太小的檔案壓縮後反而更大，不產生壓縮版本
+
+# 依偏好順序；只在壓縮版本存在時使用
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+Asset = namedtuple('Asset', 'mimetype etag bodies')   # bodies: encoding → bytes（'identity' 為原檔）
+
+
+def _fingerprint(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()[:HASH_LENGTH]
+
+
+def _write(path, data):
+    # 先寫暫存檔再改名，建置時正在服務的進程不會讀到寫一半的檔案
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """雜湊命名並預先壓縮靜態檔，回傳 manifest（原檔名 → 雜湊檔名）
+
+    內容不變時檔名也不變，重複建置不會產生新檔；舊版本保留給仍在使用舊頁面的瀏覽器。
+    """
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+    for name in sorted(os.listdir(static_dir)):
+        path = os.path.join(static_dir, name)
+        stem, ext = os.path.splitext(name)
+        if ext not in EXTENSIONS or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        hashed = f'{stem}.{_fingerprint(data)}{ext}'
+        manifest[name] = hashed
+        target = os.path.join(dist_dir, hashed)
+        if os.path.exists(target):
+            continue
+        if len(data) >= MIN_COMPRESS_BYTES:
+            # mtime=0：相同內容產生相同的 .gz
+            _write(f'{target}.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(f'{target}.br', brotli.compress(data, quality=11))
+        _write(target, data)
+
+    _write(os.path.join(dist_dir, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetStore:
+    """讀入 manifest 與建置好的檔案，供應時不再碰檔案系統"""
+
+    def __init__(self, dist_dir=DIST_DIR):
+        self.dist_dir = dist_dir
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.manifest = {}
+        self.assets = {}
+        self.version = None
+
+    def load(self):
+        """（重新）讀入 manifest；尚未建置時 manifest 為空，asset_url 退回原檔"""
+        manifest, assets = {}, {}
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            pass
+        for hashed in manifest.values():
+            path = os.path.join(self.dist_dir, hashed)
+            bodies = {}
+            with open(path, 'rb') as f:
+                bodies['identity'] = f.read()
+            for encoding, suffix in ENCODINGS:
+                if os.path.exists(path + suffix):
+                    with open(path + suffix, 'rb') as f:
+                        bodies[encoding] = f.read()
+            mimetype = mimetypes.guess_type(hashed)[0] or 'application/octet-stream'
+            assets[hashed] = Asset(mimetype, _fingerprint(bodies['identity']), bodies)
+        version = _fingerprint(json.dumps(manifest, sort_keys=True).encode())
+        with self._lock:
+            self.manifest, self.assets, self.version = manifest, assets, version
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def url(self, name):
+        """頁面中引用靜態檔的相對網址（已建置時為雜湊檔名）"""
+        self._ensure_loaded()
+        hashed = self.manifest.get(name)
+        return f'assets/{hashed}' if hashed else name
+
+    def get(self, hashed):
+        self._ensure_loaded()
+        return self.assets.get(hashed)
+
+    def current_version(self):
+        """manifest 的雜湊；引用靜態檔的頁面快取以此為版本"""
+        self._ensure_loaded()
+        return self.version
+
+
+def negotiate(accept_encodings, available):
+    """依 request.accept_encodings 選出可用的壓縮方式（都不接受時為 'identity'）"""
+    for encoding, _ in ENCODINGS:
+        if encoding in available and accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
+
+
+store = AssetStore()
@@ -0,0 +1,369 @@
+"""
+線上備份
+
+以 SQLite 的 backup API（sqlite3.Connection.backup）在服務運作中複製資料庫：
+每步只複製 BACKUP_PAGES 頁，之間暫停 BACKUP_PAUSE_SECONDS 秒讓出 I/O，
+複製期間來源連線保持一個讀取交易，得到的是開始當下的一致快照，其他進程的
+寫入照常進行、也不會使備份重來。每個檔案以 PRAGMA integrity_check 驗證後
+快照才算完成，只保留最近 BACKUP_KEEP 份。
+
+快照為 BACKUP_DIR/<時間>/ 目錄，內含主資料庫、封存檔與（分檔模式下）
+USER_DB_DIR 中的每個使用者檔，各自為不需要 -wal 的單一檔案。進度寫在
+BACKUP_DIR/status.json，任何 worker 的 /api/admin/backup 都讀得到；同一時間
+只會有一個備份在跑（以檔案鎖協調指令列、API 與各 worker 的背景排程）。
+
+    flask --app app db backup
+
+環境變數：
+    BACKUP_DIR              快照存放目錄（預設 backups）
+    BACKUP_KEEP             保留的快照份數（預設 7）
+    BACKUP_PAGES            每步複製的頁數（預設 256）
+    BACKUP_PAUSE_SECONDS    每步之間暫停的秒數（預設 0.05）
+    BACKUP_INTERVAL_HOURS   背景排程的間隔小時數，0 為不啟用（預設 0）
+"""
+
+import datetime
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import archive
+import database
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 256))
+BACKUP_PAUSE_SECONDS = float(os.environ.get('BACKUP_PAUSE_SECONDS', 0.05))
+BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', 0))
+STATUS_FILE = 'status.json'
+LOCK_FILE = '.lock'
+STATUS_WRITE_SECONDS = 0.5    # 進度最多每隔多久寫一次 status.json
+SCHEDULE_CHECK_SECONDS = 60   # 背景排程檢查是否到期的間隔
+RETRY_SECONDS = 15 * 60       # 背景備份失敗後多久再試
+
+SNAPSHOT_PATTERN = re.compile(r'^\d{8}-\d{6}(-\d+)?$')
+
+logger = logging.getLogger('gym_plan.backup')
+
+
+class BackupRunning(Exception):
+    """已有其他備份在執行"""
+
+
+class BackupError(Exception):
+    """快照驗證失敗"""
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def _write_json(path, data):
+    # 先寫暫存檔再改名，讀取端不會讀到寫一半的內容
+    temp = f'{path}.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp, path)
+
+
+def _read_status(directory):
+    try:
+        with open(os.path.join(directory, STATUS_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'state': 'idle'}
+
+
+def _lock(directory):
+    """取得備份目錄的檔案鎖（回傳鎖檔），已被其他執行緒或進程持有時拋出 BackupRunning"""
+    os.makedirs(directory, exist_ok=True)
+    lock = open(os.path.join(directory, LOCK_FILE), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise BackupRunning('已有備份在執行') from None
+    return lock
+
+
+@contextmanager
+def _exclusive(directory):
+    lock = _lock(directory)
+    try:
+        yield
+    finally:
+        lock.close()   # 關閉即釋放 flock
+
+
+def sources():
+    """要備份的資料庫檔：(來源路徑, 快照中的相對路徑)"""
+    files = [(database.DATABASE, os.path.basename(database.DATABASE))]
+    main_archive = archive.archive_path(database.DATABASE)
+    if os.path.exists(main_archive):
+        files.append((main_archive, os.path.basename(main_archive)))
+    if database.USER_DB_DIR and os.path.isdir(database.USER_DB_DIR):
+        for root, _, names in sorted(os.walk(database.USER_DB_DIR)):
+            for name in sorted(names):
+                if name.endswith('.db'):
+                    path = os.path.join(root, name)
+                    files.append((path, os.path.join(
+                        'users', os.path.relpath(path, database.USER_DB_DIR))))
+    return files
+
+
+def copy(source, target, progress=None, pages=None, pause=None):
+    """把 source 的一致快照逐步複製到 target 並驗證，回傳 integrity_check 的結果
+
+    progress(remaining, total) 在每步之後呼叫（單位為頁）。
+    """
+    pages = pages or BACKUP_PAGES
+    pause = BACKUP_PAUSE_SECONDS if pause is None else pause
+
+    def step(status, remaining, total):
+        if progress:
+            progress(remaining, total)
+        if remaining and pause:
+            time.sleep(pause)   # 讓出 I/O 給線上請求
+
+    src = database.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        # 開始讀取交易並保持到複製結束：之後的寫入不影響快照，也不會使備份重來
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        src.backup(dst, pages=pages, progress=step)
+        src.rollback()
+        # 來源為 WAL 模式，快照改回單一檔案
+        dst.execute('PRAGMA journal_mode=DELETE')
+        return [row[0] for row in dst.execute('PRAGMA integrity_check')]
+    finally:
+        dst.close()
+        src.close()
+
+
+def snapshots(directory=None):
+    """已完成的快照（舊到新）"""
+    directory = directory or BACKUP_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if SNAPSHOT_PATTERN.match(name))
+
+
+def rotate(directory=None, keep=None):
+    """只保留最近 keep 份快照並清除中斷留下的目錄（需持有檔案鎖），回傳刪除的快照"""
+    directory = directory or BACKUP_DIR
+    keep = BACKUP_KEEP if keep is None else keep
+    for name in os.listdir(directory):
+        if name.endswith('.partial'):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    removed = snapshots(directory)[:-keep] if keep > 0 else []
+    for name in removed:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return removed
+
+
+def _due(status, interval):
+    """背景排程：距上次成功超過 interval 秒，且距上次失敗超過 RETRY_SECONDS"""
+    now = time.time()
+    last = status.get('last_success') or {}
+    if last.get('finished_ts') and now - last['finished_ts'] < interval:
+        return False
+    if status.get('state') == 'failed' and now - status.get('finished_ts', 0) < RETRY_SECONDS:
+        return False
+    return True
+
+
+def run(directory=None, keep=None, interval=None):
+    """建立一份快照，回傳最後的狀態；已有備份在執行時拋出 BackupRunning
+
+    interval 不為 None 時（背景排程）先確認是否到期，未到期回傳 None。
+    """
+    directory = directory or BACKUP_DIR
+    keep = BACKUP_KEEP if keep is None else keep
+    with _exclusive(directory):
+        return _run(directory, keep, interval)
+
+
+def _run(directory, keep, interval):
+    previous = _read_status(directory)
+    if interval is not None and not _due(previous, interval):
+        return None
+
+    started = time.time()
+    name = base = datetime.datetime.fromtimestamp(started).strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(os.path.join(directory, name)):
+        suffix += 1
+        name = f'{base}-{suffix}'
+    partial = os.path.join(directory, f'{name}.partial')
+    files = sources()
+    sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path, _ in files]
+    status = {
+        'state': 'running',
+        'snapshot': name,
+        'started_at': _now(),
+        'pid': os.getpid(),
+        'files_total': len(files),
+        'files': [],
+        'current_file': None,
+        'progress': 0.0,
+        'last_success': previous.get('last_success'),
+    }
+    status_path = os.path.join(directory, STATUS_FILE)
+    _write_json(status_path, status)
+    written = [0.0]
+
+    def report(done_bytes, force=False):
+        status['progress'] = round(done_bytes / (sum(sizes) or 1), 4)
+        status['elapsed_seconds'] = round(time.time() - started, 3)
+        if force or time.time() - written[0] >= STATUS_WRITE_SECONDS:
+            _write_json(status_path, status)
+            written[0] = time.time()
+
+    try:
+        done = 0
+        for (source, relative), size in zip(files, sizes):
+            target = os.path.join(partial, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            status['current_file'] = relative
+            file_started = time.time()
+
+            def progress(remaining, total, base=done, size=size):
+                report(base + size * (1 - remaining / total) if total else base)
+
+            result = copy(source, target, progress)
+            if result != ['ok']:
+                raise BackupError(f"{relative} 驗證失敗：{'; '.join(result[:5])}")
+            done += size
+            status['files'].append({
+                'name': relative,
+                'bytes': os.path.getsize(target),
+                'seconds': round(time.time() - file_started, 3),
+                'integrity': 'ok',
+            })
+            report(done, force=True)
+
+        os.rename(partial, os.path.join(directory, name))
+        status['removed'] = rotate(directory, keep)
+        finished = time.time()
+        status.update({
+            'state': 'ok',
+            'current_file': None,
+            'progress': 1.0,
+            'finished_at': _now(),
+            'finished_ts': finished,
+            'duration_seconds': round(finished - started, 3),
+        })
+        status['last_success'] = {
+            'snapshot': name,
+            'finished_at': status['finished_at'],
+            'finished_ts': finished,
+            'duration_seconds': status['duration_seconds'],
+            'bytes': sum(item['bytes'] for item in status['files']),
+        }
+        status.pop('elapsed_seconds', None)
+        _write_json(status_path, status)
+        logger.info('backup %s finished in %.1fs', name, status['duration_seconds'])
+        return status
+    except BaseException as e:
+        shutil.rmtree(partial, ignore_errors=True)
+        finished = time.time()
+        status.update({
+            'state': 'failed',
+            'error': str(e) or type(e).__name__,
+            'finished_at': _now(),
+            'finished_ts': finished,
+            'duration_seconds': round(finished - started, 3),
+        })
+        _write_json(status_path, status)
+        raise
+
+
+def _alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def last_success(directory=None):
+    """最近一次成功備份的記錄，沒有時為 None"""
+    directory = directory or BACKUP_DIR
+    return _read_status(directory).get('last_success')
+
+
+def status(directory=None):
+    """目前（或最近一次）備份的狀態與已保留的快照"""
+    directory = directory or BACKUP_DIR
+    current = _read_status(directory)
+    if current.get('state') == 'running' and not _alive(current.get('pid')):
+        # 記錄為執行中但執行備份的進程已結束（中途被停止）
+        current['state'] = 'interrupted'
+    current['snapshots'] = snapshots(directory)
+    return current
+
+
+# ==================== 背景執行 ====================
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def run_in_background(directory=None, keep=None):
+    """立即在背景建立一份快照（供 API 觸發）；已有備份在執行時拋出 BackupRunning
+
+    檔案鎖在呼叫端取得後交給背景執行緒，回傳時即可確定備份已開始。
+    """
+    directory = directory or BACKUP_DIR
+    keep = BACKUP_KEEP if keep is None else keep
+    lock = _lock(directory)
+
+    def target():
+        try:
+            _run(directory, keep, None)
+        except Exception:
+            logger.exception('backup failed')
+        finally:
+            lock.close()
+    threading.Thread(target=target, name='backup-manual', daemon=True).start()
+
+
+def start_scheduler(interval_hours=None):
+    """每隔 interval_hours 小時在背景備份一次（0 為不啟用）
+
+    每個 worker 都可呼叫；到期時只有取得檔案鎖的一個進程會執行，
+    其餘進程在鎖內看到剛完成的記錄後略過。
+    """
+    global _scheduler
+    interval_hours = BACKUP_INTERVAL_HOURS if interval_hours is None else interval_hours
+    if interval_hours <= 0:
+        return False
+    interval = interval_hours * 3600
+
+    def loop():
+        while True:
+            try:
+                run(interval=interval)
+            except BackupRunning:
+                pass
+            except Exception:
+                logger.exception('scheduled backup failed')
+            time.sleep(SCHEDULE_CHECK_SECONDS)
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=loop, name='backup-scheduler', daemon=True)
+            _scheduler.start()
+    return True
@@ -0,0 +1,6 @@
+"""
+效能基準測試
+
+    python -m bench.run --scale small              # Flask test client
+    python -m bench.run --scale medium --mode both # 另外啟動多 worker gunicorn
+"""
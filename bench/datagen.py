@@ -0,0 +1,110 @@
+"""
+合成資料產生
+
+以 database.insert_default_data 寫入的預設菜單、採買清單為樣板，
+依規模複製出大型菜單、長期的每日飲食記錄與多年的體重記錄。
+同一個 seed 產生的資料完全相同，基準數字才能互相比較。
+"""
+
+import datetime
+import os
+import random
+
+import database
+import ingredients
+
+# 各規模的資料量
+SCALES = {
+    'tiny': {'meals': 100, 'daily_meals': 1_000, 'weight_days': 365},
+    'small': {'meals': 1_000, 'daily_meals': 10_000, 'weight_days': 3 * 365},
+    'medium': {'meals': 5_000, 'daily_meals': 100_000, 'weight_days': 5 * 365},
+    'large': {'meals': 20_000, 'daily_meals': 1_000_000, 'weight_days': 10 * 365},
+}
+
+CHUNK = 10_000
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+END_DATE = datetime.date(2024, 12, 31)
+USER_ID = 1  # 資料都屬於預設的 admin 帳號
+
+
+def _chunks(rows, size=CHUNK):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def generate(path, scale='small', seed=42):
+    """在 path 建立指定規模的資料庫（已存在則覆蓋），回傳各表筆數"""
+    spec = SCALES[scale]
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    database.DATABASE = path
+    database.init_db()
+    rng = random.Random(seed)
+    db = database.connect()
+    try:
+        templates = [tuple(row) for row in db.execute(
+            'SELECT name, meal_type, ingredients, calories, protein FROM meals')]
+
+        # 菜單：預設菜色加上熱量／蛋白質擾動
+        meals = []
+        for i in range(spec['meals'] - len(templates)):
+            name, meal_type, text, calories, protein = templates[i % len(templates)]
+            meals.append((f'{name} #{i}', meal_type, text,
+                          int(calories * rng.uniform(0.85, 1.15)),
+                          int(protein * rng.uniform(0.85, 1.15))))
+        ids = []
+        for chunk in _chunks(meals):
+            ids += database.insert_many(
+                db, 'meals', ('name', 'meal_type', 'ingredients', 'calories', 'protein'), chunk)
+            for meal_id, row in zip(ids[-len(chunk):], chunk):
+                ingredients.sync_meal(db, meal_id, row[2])
+            db.commit()
+
+        by_type = {t: [] for t in MEAL_TYPES}
+        for row in db.execute('SELECT id, name, meal_type FROM meals'):
+            by_type[row['meal_type']].append((row['id'], row['name']))
+
+        # 每日飲食：從 END_DATE 往回，每天三餐
+        days = -(-spec['daily_meals'] // len(MEAL_TYPES))
+        records = []
+        for offset in range(days):
+            date = (END_DATE - datetime.timedelta(days=offset)).isoformat()
+            for meal_type in MEAL_TYPES:
+                meal_id, name = rng.choice(by_type[meal_type])
+                records.append((USER_ID, date, meal_type, meal_id, name,
+                                database.MEAL_ORDER[meal_type]))
+        records = records[:spec['daily_meals']]
+        for chunk in _chunks(records):
+            db.executemany('''
+                INSERT INTO daily_meals (user_id, date, meal_type, meal_id, meal_name, meal_order)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', chunk)
+            db.commit()
+
+        # 體重：隨機漫步，約 15% 的日子沒有記錄
+        weight = 119.0
+        weights, checklist = [], []
+        for offset in range(spec['weight_days'] - 1, -1, -1):
+            date = (END_DATE - datetime.timedelta(days=offset)).isoformat()
+            weight = max(60.0, weight + rng.uniform(-0.35, 0.3))
+            if rng.random() < 0.85:
+                weights.append((USER_ID, date, round(weight, 1), spec['weight_days'] - offset))
+            for key in ('water', 'protein', 'exercise', 'sleep'):
+                checklist.append((USER_ID, date, key, int(rng.random() < 0.7)))
+        for chunk in _chunks(weights):
+            db.executemany(
+                'INSERT INTO weight_records (user_id, date, weight, day) VALUES (?, ?, ?, ?)', chunk)
+        for chunk in _chunks(checklist):
+            db.executemany(
+                'INSERT INTO daily_checklist (user_id, date, item_key, checked) VALUES (?, ?, ?, ?)',
+                chunk)
+        db.commit()
+        db.execute('ANALYZE')
+
+        return {table: db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('meals', 'daily_meals', 'weight_records', 'daily_checklist',
+                              'shopping_list')}
+    finally:
+        db.close()
@@ -0,0 +1,128 @@
+"""
+JSON 編碼基準測試
+
+以 bench.datagen 產生的資料庫，比較列表型 API 的三種編碼方式（含取出資料）：
+
+    stdlib    原本的做法：[dict(sqlite3.Row)] 交給 Flask 預設的 JSON 編碼
+    objects   serialize.encode_rows：tuple 列直接編碼（有 orjson 時使用 orjson）
+    columns   ?format=columns：欄名加陣列
+
+輸出各查詢、各方式的 p50/p95 毫秒數與回應大小（含 gzip 後）。
+
+    python -m bench.encoding --scale small
+"""
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import database
+import serialize
+from bench import datagen
+
+USER_ID = datagen.USER_ID
+
+# 名稱 → (SQL, 參數)；與 app.py 對應路由的查詢相同（不分頁時的最大回應）
+QUERIES = {
+    'history': ('SELECT * FROM daily_meals WHERE user_id = ? ORDER BY date DESC, meal_order',
+                (USER_ID,)),
+    'weight': ('SELECT * FROM weight_records WHERE user_id = ? ORDER BY date DESC', (USER_ID,)),
+    'meals': ('SELECT * FROM meals ORDER BY meal_type, id', ()),
+}
+
+
+def _stdlib(db, sql, params, provider):
+    rows = db.execute(sql, params).fetchall()
+    return provider.dumps([dict(row) for row in rows]).encode()
+
+
+def _encoded(fmt):
+    def encode(db, sql, params, provider):
+        cursor = db.execute(sql, params)
+        names = serialize.columns(cursor)
+        return serialize.encode_rows(names, serialize.plain(cursor).fetchall(), fmt)
+    return encode
+
+
+ENCODERS = {
+    'stdlib': _stdlib,
+    'objects': _encoded('objects'),
+    'columns': _encoded('columns'),
+}
+
+
+def measure(db, sql, params, encode, provider, repeat, warmup):
+    """重複編碼 repeat 次，回傳毫秒數統計與回應大小"""
+    for _ in range(warmup):
+        body = encode(db, sql, params, provider)
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode(db, sql, params, provider)
+        latencies.append(time.perf_counter() - started)
+    values = np.asarray(latencies) * 1000
+    p50, p95 = np.percentile(values, (50, 95))
+    return {
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'bytes': len(body),
+        'gzip_bytes': len(gzip.compress(body, compresslevel=6)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=datagen.SCALES, default='small')
+    parser.add_argument('--repeat', type=int, default=20, help='每種方式的重複次數')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='資料庫路徑（預設為暫存目錄）')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='gym-plan-encoding-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'bench.db'))
+    counts = datagen.generate(db_path, args.scale, args.seed)
+    # 原本的 app.json：Flask 預設（排序 key、中文轉義）
+    provider = DefaultJSONProvider(Flask(__name__))
+
+    db = database.connect(db_path)
+    results = {}
+    try:
+        for name, (sql, params) in QUERIES.items():
+            results[name] = {
+                encoder: measure(db, sql, params, encode, provider, args.repeat, args.warmup)
+                for encoder, encode in ENCODERS.items()
+            }
+            base = results[name]['stdlib']['p50_ms']
+            for encoder in ('objects', 'columns'):
+                result = results[name][encoder]
+                result['speedup'] = round(base / result['p50_ms'], 2) if result['p50_ms'] else None
+    finally:
+        db.close()
+
+    report = {
+        'meta': {
+            'scale': args.scale,
+            'rows': counts,
+            'repeat': args.repeat,
+            'backend': 'orjson' if serialize.orjson is not None else 'json',
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,538 @@
+"""
+API 基準測試
+
+以 bench.datagen 產生指定規模的資料庫，對 app.py 的每個路由量測延遲，
+可透過 Flask test client（單進程、不含網路）或實際啟動的多 worker gunicorn
+（含 HTTP 與多進程競爭）。結果以 JSON 輸出各路由的 p50/p95/p99 與吞吐量，
+並與儲存的基準比較，p95 變慢超過容許範圍時以結束碼 1 結束。
+
+    python -m bench.run --scale small --mode both
+    python -m bench.run --scale small --save-baseline   # 更新 bench/baseline.json
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+import assets
+import backup
+from bench import datagen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'bench', 'baseline.json')
+USERNAME, PASSWORD = 'admin', 'aa552300'
+
+DATE = datagen.END_DATE.isoformat()
+WEEK_START = (datagen.END_DATE - datetime.timedelta(days=6)).isoformat()
+# 基準測試寫入的記錄放在產生資料之後的日期，不影響讀取路由的資料量
+SCRATCH_DATE = '2099-01-01'
+
+MEAL = {'name': '基準測試餐', 'meal_type': 'lunch', 'ingredients': '雞胸肉 200g, 糙米飯 150g',
+        'calories': 550, 'protein': 50}
+SHOPPING = {'name': '基準測試品項', 'category': 'protein', 'spec': '1kg/包'}
+EXERCISE = {'name': '基準測試運動', 'duration': '30分鐘', 'intensity': '中',
+            'distance': '5km', 'calories': '300'}
+
+
+# ==================== 連線方式 ====================
+
+class ClientDriver:
+    """以 Flask test client 發送請求"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self):
+        self.request('POST', '/login', form={'username': USERNAME, 'password': PASSWORD})
+
+    def request(self, method, path, json_body=None, form=None):
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, json=json_body, data=form)
+        body = response.get_data()
+        # 與真正的伺服器一樣關閉回應（觸發 call_on_close，例如釋放串流名額）
+        response.close()
+        return response.status_code, body, time.perf_counter() - started
+
+    def close(self):
+        pass
+
+
+class HttpDriver:
+    """以 HTTP 連到 gunicorn（keep-alive，每個執行緒一條連線）"""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def login(self):
+        form = urllib.parse.urlencode({'username': USERNAME, 'password': PASSWORD})
+        status, _, _ = self.request('POST', '/login', form=form)
+        if status != 302:
+            raise RuntimeError(f'登入失敗：HTTP {status}')
+
+    def request(self, method, path, json_body=None, form=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = form.encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        started = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        data = response.read()
+        elapsed = time.perf_counter() - started
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status, data, elapsed
+
+    def fork(self):
+        """同一個 session 的另一條連線"""
+        other = HttpDriver(self.port)
+        other.cookie = self.cookie
+        return other
+
+    def close(self):
+        self.conn.close()
+
+
+# ==================== 路由情境 ====================
+
+def _created_id(driver, path, body):
+    status, data, _ = driver.request('POST', path, body)
+    if status != 200:
+        raise RuntimeError(f'POST {path} 失敗：HTTP {status}')
+    return json.loads(data)['id']
+
+
+def _scratch_weight_id(driver, i):
+    date = datetime.date(2098, 1, 1) + datetime.timedelta(days=i)
+    driver.request('POST', '/api/weight', {'date': date.isoformat(), 'weight': 100.0})
+    before = (date + datetime.timedelta(days=1)).isoformat()
+    _, data, _ = driver.request('GET', f'/api/weight?before={before}&limit=1')
+    return json.loads(data)[0]['id']
+
+
+@lru_cache(maxsize=None)
+def _asset_path(name):
+    # 與 gunicorn 啟動時的建置結果相同（檔名只取決於內容）；建置後重新讀入 manifest
+    manifest = assets.build()
+    assets.store.load()
+    return '/assets/' + manifest[name]
+
+
+def _relogin(driver):
+    driver.login()
+
+
+def _wait_backup(driver):
+    # 背景備份持有檔案鎖直到完成；等鎖釋放再量測下一次
+    while True:
+        try:
+            with backup._exclusive(backup.BACKUP_DIR):
+                return
+        except backup.BackupRunning:
+            time.sleep(0.01)
+
+
+class Route:
+    """一個路由的量測方式
+
+    build(driver, i) 回傳 (path, json)，其中可先發送不計時的準備請求
+    （例如先新增一筆再量測刪除）；after(driver) 在量測後執行。expect 為
+    預期的狀態碼，可為 tuple（同時請求時有多種正常結果）。
+    """
+
+    def __init__(self, method, rule, build, after=None, expect=200):
+        self.method = method
+        self.rule = rule
+        self.build = build
+        self.after = after
+        self.expect = expect if isinstance(expect, tuple) else (expect,)
+
+    @property
+    def name(self):
+        return f'{self.method} {self.rule}'
+
+
+ROUTES = [
+    Route('GET', '/login', lambda d, i: ('/login', None)),
+    Route('POST', '/login', lambda d, i: ('/login', None), after=_relogin),
+    Route('GET', '/logout', lambda d, i: ('/logout', None), after=_relogin, expect=302),
+    Route('GET', '/', lambda d, i: ('/', None)),
+    Route('GET', '/assets/<path:filename>', lambda d, i: (_asset_path('script.js'), None)),
+    Route('GET', '/metrics', lambda d, i: ('/metrics', None)),
+    Route('GET', '/api/dashboard', lambda d, i: (f'/api/dashboard?date={DATE}', None)),
+
+    Route('GET', '/api/meals', lambda d, i: ('/api/meals', None)),
+    Route('POST', '/api/meals', lambda d, i: ('/api/meals', dict(MEAL, name=f'基準測試餐 {i}'))),
+    Route('POST', '/api/meals/bulk', lambda d, i: (
+        '/api/meals/bulk', [dict(MEAL, name=f'批次 {i}-{n}') for n in range(50)])),
+    Route('PUT', '/api/meals/<int:meal_id>', lambda d, i: (
+        f"/api/meals/{_created_id(d, '/api/meals', MEAL)}",
+        dict(MEAL, ingredients=f'雞胸肉 {150 + i}g'))),
+    Route('DELETE', '/api/meals/<int:meal_id>', lambda d, i: (
+        f"/api/meals/{_created_id(d, '/api/meals', MEAL)}", None)),
+
+    Route('GET', '/api/daily-meals', lambda d, i: (f'/api/daily-meals?date={DATE}', None)),
+    Route('POST', '/api/daily-meals', lambda d, i: ('/api/daily-meals', {
+        'date': SCRATCH_DATE, 'meal_type': 'snack', 'meal_id': 1, 'meal_name': '點心'})),
+    Route('DELETE', '/api/daily-meals/<int:record_id>', lambda d, i: (
+        '/api/daily-meals/%d' % _created_id(d, '/api/daily-meals', {
+            'date': SCRATCH_DATE, 'meal_type': 'snack', 'meal_id': 1, 'meal_name': '點心'}),
+        None)),
+    Route('POST', '/api/daily-meals/clear', lambda d, i: (
+        '/api/daily-meals/clear', {'date': SCRATCH_DATE, 'meal_type': 'snack'})),
+    Route('GET', '/api/daily-meals/history', lambda d, i: ('/api/daily-meals/history?limit=30', None)),
+    Route('GET', '/api/daily-totals', lambda d, i: (f'/api/daily-totals?from={WEEK_START}&to={DATE}', None)),
+
+    Route('POST', '/api/plan/generate', lambda d, i: (
+        f'/api/plan/generate?days=7&start={SCRATCH_DATE}&seed={i}', None)),
+    Route('GET', '/api/search', lambda d, i: ('/api/search?q=' + urllib.parse.quote('雞胸肉'), None)),
+
+    Route('GET', '/api/shopping', lambda d, i: ('/api/shopping', None)),
+    Route('POST', '/api/shopping', lambda d, i: ('/api/shopping', SHOPPING)),
+    Route('GET', '/api/shopping/generate', lambda d, i: (
+        f'/api/shopping/generate?from={WEEK_START}&to={DATE}', None)),
+    Route('POST', '/api/shopping/generate', lambda d, i: (
+        f'/api/shopping/generate?from={WEEK_START}&to={DATE}', None)),
+    Route('POST', '/api/shopping/bulk', lambda d, i: (
+        '/api/shopping/bulk', [dict(SHOPPING, name=f'批次 {i}-{n}') for n in range(50)])),
+    Route('PUT', '/api/shopping/<int:item_id>', lambda d, i: (
+        f"/api/shopping/{_created_id(d, '/api/shopping', SHOPPING)}", dict(SHOPPING, price=str(i)))),
+    Route('DELETE', '/api/shopping/<int:item_id>', lambda d, i: (
+        f"/api/shopping/{_created_id(d, '/api/shopping', SHOPPING)}", None)),
+
+    Route('GET', '/api/weight', lambda d, i: ('/api/weight?limit=90', None)),
+    Route('POST', '/api/weight', lambda d, i: (
+        '/api/weight', {'date': SCRATCH_DATE, 'weight': 100 + i % 10 / 10})),
+    Route('GET', '/api/weight/trend', lambda d, i: ('/api/weight/trend', None)),
+    Route('POST', '/api/weight/bulk', lambda d, i: ('/api/weight/bulk', [
+        {'date': f'2099-02-{n + 1:02d}', 'weight': 100 + i % 10 / 10} for n in range(28)])),
+    Route('DELETE', '/api/weight/<int:record_id>', lambda d, i: (
+        f'/api/weight/{_scratch_weight_id(d, i)}', None)),
+
+    Route('GET', '/api/checklist', lambda d, i: (f'/api/checklist?date={DATE}', None)),
+    Route('POST', '/api/checklist', lambda d, i: (
+        '/api/checklist', {'date': SCRATCH_DATE, 'item_key': 'water', 'checked': i % 2})),
+    Route('POST', '/api/checklist/bulk', lambda d, i: ('/api/checklist/bulk', [
+        {'date': SCRATCH_DATE, 'item_key': key, 'checked': i % 2}
+        for key in ('water', 'protein', 'exercise', 'sleep')])),
+
+    Route('GET', '/api/exercise', lambda d, i: ('/api/exercise', None)),
+    Route('POST', '/api/exercise', lambda d, i: ('/api/exercise', EXERCISE)),
+    Route('PUT', '/api/exercise/<int:exercise_id>', lambda d, i: (
+        f"/api/exercise/{_created_id(d, '/api/exercise', EXERCISE)}", EXERCISE)),
+    Route('DELETE', '/api/exercise/<int:exercise_id>', lambda d, i: (
+        f"/api/exercise/{_created_id(d, '/api/exercise', EXERCISE)}", None)),
+
+    Route('GET', '/api/settings', lambda d, i: ('/api/settings', None)),
+    Route('POST', '/api/settings', lambda d, i: ('/api/settings', {'water_target': str(3000 + i % 2)})),
+    Route('GET', '/api/admin/pool-stats', lambda d, i: ('/api/admin/pool-stats', None)),
+    Route('GET', '/api/me', lambda d, i: ('/api/me', None)),
+    Route('GET', '/api/events', lambda d, i: ('/api/events?since=0&timeout=0', None)),
+    Route('GET', '/api/export', lambda d, i: ('/api/export?tables=weight_records', None)),
+    Route('POST', '/api/import', lambda d, i: ('/api/import', {
+        '_table': 'weight_records', 'date': SCRATCH_DATE, 'weight': 100.0 + i % 2})),
+    Route('GET', '/api/admin/backup', lambda d, i: ('/api/admin/backup', None)),
+    # 同時連線的請求在備份執行中時回應 409
+    Route('POST', '/api/admin/backup', lambda d, i: ('/api/admin/backup', None),
+          after=_wait_backup, expect=(202, 409)),
+    Route('GET', '/api/admin/users', lambda d, i: ('/api/admin/users', None)),
+    Route('POST', '/api/admin/users', lambda d, i: ('/api/admin/users', {
+        'username': f'bench_{uuid.uuid4().hex[:12]}', 'password': 'bench-password'})),
+]
+
+
+def uncovered_routes(app):
+    """app.url_map 中沒有對應情境的路由（新增路由時要一併補上情境）"""
+    covered = {route.name for route in ROUTES}
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if f'{method} {rule.rule}' not in covered:
+                missing.append(f'{method} {rule.rule}')
+    return missing
+
+
+# ==================== 量測 ====================
+
+def summarize(latencies, wall, errors):
+    """延遲（毫秒）的分位數與吞吐量"""
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, (50, 95, 99)) if len(values) else (0, 0, 0)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(values.mean()), 3) if len(values) else 0,
+        'throughput_rps': round(len(values) / wall, 1) if wall else 0,
+    }
+
+
+def measure(drivers, route, requests):
+    """以每個 driver 一個執行緒平均分攤 requests 次請求"""
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(driver, indexes):
+        for i in indexes:
+            path, body = route.build(driver, i)
+            status, _, elapsed = driver.request(route.method, path, body)
+            if route.after:
+                route.after(driver)
+            with lock:
+                latencies.append(elapsed)
+                if status not in route.expect:
+                    errors.append(status)
+
+    started = time.perf_counter()
+    if len(drivers) == 1:
+        worker(drivers[0], range(requests))
+    else:
+        with ThreadPoolExecutor(len(drivers)) as pool:
+            list(pool.map(worker, drivers,
+                          [range(n, requests, len(drivers)) for n in range(len(drivers))]))
+    return summarize(latencies, time.perf_counter() - started, len(errors))
+
+
+def run_routes(drivers, requests, warmup):
+    results = {}
+    for route in ROUTES:
+        measure(drivers[:1], route, warmup)
+        results[route.name] = measure(drivers, route, requests)
+        print(f'  {route.name:<45} p95 {results[route.name]["p95_ms"]:>9.3f} ms', file=sys.stderr)
+    return results
+
+
+def upsert_hammer(drivers, db_path, per_driver=50):
+    """多個連線同時覆寫同一天的體重與檢查項目，不得出錯且最後只留一筆"""
+    date = '2099-12-31'
+    written = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n, driver):
+        for i in range(per_driver):
+            weight = round(80 + n + i / 100, 2)
+            status, _, _ = driver.request('POST', '/api/weight', {'date': date, 'weight': weight})
+            status2, _, _ = driver.request(
+                'POST', '/api/checklist', {'date': date, 'item_key': 'water', 'checked': i % 2})
+            with lock:
+                written.append(weight)
+                errors.extend(s for s in (status, status2) if s != 200)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(len(drivers)) as pool:
+        list(pool.map(worker, range(len(drivers)), drivers))
+    wall = time.perf_counter() - started
+
+    db = sqlite3.connect(db_path)
+    try:
+        weights = db.execute('SELECT weight FROM weight_records WHERE date=?', (date,)).fetchall()
+        checks = db.execute('SELECT COUNT(*) FROM daily_checklist WHERE date=?', (date,)).fetchone()[0]
+    finally:
+        db.close()
+    consistent = len(weights) == 1 and weights[0][0] in written and checks == 1
+    return {
+        'writes': len(written) * 2,
+        'errors': len(errors),
+        'consistent': consistent,
+        'throughput_rps': round(len(written) * 2 / wall, 1),
+    }
+
+
+# ==================== 執行模式 ====================
+
+def run_client(db_path, requests, warmup):
+    os.environ['FITNESS_DB'] = db_path
+    import app as appmodule
+    import database
+    database.DATABASE = db_path
+
+    missing = uncovered_routes(appmodule.app)
+    if missing:
+        raise SystemExit(f'以下路由沒有基準測試情境：{", ".join(missing)}')
+
+    driver = ClientDriver(appmodule.app)
+    driver.login()
+    print('client:', file=sys.stderr)
+    results = run_routes([driver], requests, warmup)
+    hammer_drivers = [ClientDriver(appmodule.app) for _ in range(4)]
+    for other in hammer_drivers:
+        other.login()
+    return {'routes': results, 'upsert_hammer': upsert_hammer(hammer_drivers, db_path)}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def gunicorn_server(db_path, workers):
+    """在空閒的 port 啟動 gunicorn（使用專案的 gunicorn.conf.py），回傳 port"""
+    port = _free_port()
+    env = dict(os.environ, FITNESS_DB=db_path)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+         '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env=env)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('gunicorn 無法啟動')
+                time.sleep(0.2)
+        yield port
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def run_gunicorn(db_path, requests, warmup, workers, concurrency):
+    with gunicorn_server(db_path, workers) as port:
+        driver = HttpDriver(port)
+        driver.login()
+        drivers = [driver] + [driver.fork() for _ in range(concurrency - 1)]
+        print(f'gunicorn ({workers} workers, {concurrency} connections):', file=sys.stderr)
+        results = run_routes(drivers, requests, warmup)
+        hammer = upsert_hammer(drivers, db_path)
+        for other in drivers:
+            other.close()
+        return {'routes': results, 'upsert_hammer': hammer}
+
+
+# ==================== 基準比較 ====================
+
+def compare(report, baseline, tolerance, slack_ms):
+    """p95 超過 基準 ×(1+tolerance)+slack_ms 視為退步；寫入錯誤或資料不一致也列出"""
+    problems = []
+    for mode, result in report['results'].items():
+        hammer = result['upsert_hammer']
+        if hammer['errors'] or not hammer['consistent']:
+            problems.append(f'{mode} upsert_hammer: errors={hammer["errors"]} '
+                            f'consistent={hammer["consistent"]}')
+        for name, stats in result['routes'].items():
+            if stats['errors']:
+                problems.append(f'{mode} {name}: {stats["errors"]} 個錯誤回應')
+            base = (baseline or {}).get('results', {}).get(mode, {}).get('routes', {}).get(name)
+            if base is None:
+                continue
+            limit = base['p95_ms'] * (1 + tolerance) + slack_ms
+            if stats['p95_ms'] > limit:
+                problems.append(f'{mode} {name}: p95 {stats["p95_ms"]:.3f}ms > '
+                                f'{limit:.3f}ms（基準 {base["p95_ms"]:.3f}ms）')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=datagen.SCALES, default='small')
+    parser.add_argument('--mode', choices=('client', 'gunicorn', 'both'), default='client')
+    parser.add_argument('--requests', type=int, default=100, help='每個路由的請求數')
+    parser.add_argument('--warmup', type=int, default=5, help='每個路由不計入的暖機請求數')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker 數')
+    parser.add_argument('--concurrency', type=int, default=8, help='gunicorn 模式的同時連線數')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='資料庫路徑（預設為暫存目錄）')
+    parser.add_argument('--output', help='結果 JSON 輸出檔（預設輸出到 stdout）')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='以本次結果覆寫基準檔')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='p95 容許變慢的比例')
+    parser.add_argument('--slack-ms', type=float, default=2.0, help='p95 容許變慢的固定毫秒數')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='gym-plan-bench-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'bench.db'))
+    # 備份情境的快照放在暫存目錄（gunicorn 的環境變數由 os.environ 複製）
+    backup.BACKUP_DIR = os.environ['BACKUP_DIR'] = os.path.join(workdir, 'backups')
+    started = time.perf_counter()
+    counts = datagen.generate(db_path, args.scale, args.seed)
+    print(f'資料產生 {time.perf_counter() - started:.1f}s：{counts}', file=sys.stderr)
+
+    report = {
+        'meta': {
+            'scale': args.scale,
+            'rows': counts,
+            'requests': args.requests,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+    if args.mode in ('client', 'both'):
+        report['results']['client'] = run_client(db_path, args.requests, args.warmup)
+    if args.mode in ('gunicorn', 'both'):
+        report['results']['gunicorn'] = run_gunicorn(
+            db_path, args.requests, args.warmup, args.workers, args.concurrency)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta']['scale'] != args.scale:
+            print(f'基準檔規模為 {baseline["meta"]["scale"]}，略過延遲比較', file=sys.stderr)
+            baseline = None
+    report['regressions'] = compare(report, baseline, args.tolerance, args.slack_ms)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+    for problem in report['regressions']:
+        print('退步：' + problem, file=sys.stderr)
+    return 1 if report['regressions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
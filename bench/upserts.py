@@ -0,0 +1,122 @@
+"""
+UPSERT 並行測試
+
+啟動多 worker 的 gunicorn，再以多個客戶端進程同時覆寫同一組日期的體重與
+檢查項目（單筆與批次端點都有），結束後直接讀資料庫確認：沒有錯誤回應、
+每個 (user_id, date) 與 (user_id, date, item_key) 只有一筆，且值是某個
+客戶端實際寫入過的值。有任何錯誤或不一致時以結束碼 1 結束。
+
+    python -m bench.upserts --processes 8 --requests 100
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench import datagen
+from bench.run import HttpDriver, gunicorn_server
+
+# 寫入產生資料之後的日期，不與既有記錄混在一起
+DATES = ('2099-12-29', '2099-12-30', '2099-12-31')
+ITEM_KEYS = ('water', 'protein', 'exercise')
+
+
+def _client(args):
+    """一個客戶端進程：登入後輪流呼叫單筆與批次的 UPSERT 端點"""
+    port, n, requests = args
+    driver = HttpDriver(port)
+    driver.login()
+    weights, checks, errors = [], [], []
+    try:
+        for i in range(requests):
+            date = DATES[i % len(DATES)]
+            weight = round(70 + n + i / 1000, 3)
+            checked = (n + i) % 2
+            if i % 2:
+                calls = [
+                    ('/api/weight', {'date': date, 'weight': weight}),
+                    ('/api/checklist', {'date': date, 'item_key': ITEM_KEYS[i % len(ITEM_KEYS)],
+                                        'checked': checked}),
+                ]
+            else:
+                calls = [
+                    ('/api/weight/bulk', [{'date': d, 'weight': weight} for d in DATES]),
+                    ('/api/checklist/bulk', [{'date': date, 'item_key': key, 'checked': checked}
+                                             for key in ITEM_KEYS]),
+                ]
+            weights.append(weight)
+            checks.append(checked)
+            for path, body in calls:
+                status, data, _ = driver.request('POST', path, body)
+                if status != 200:
+                    errors.append(f'{path}: HTTP {status} {data[:200]!r}')
+                elif path.endswith('/bulk') and json.loads(data)['failed']:
+                    errors.append(f'{path}: {data[:200]!r}')
+    finally:
+        driver.close()
+    return weights, checks, errors
+
+
+def verify(db_path, weights, checks):
+    """回傳不一致的描述（空清單表示通過）"""
+    problems = []
+    db = sqlite3.connect(db_path)
+    try:
+        for date in DATES:
+            rows = db.execute('SELECT weight FROM weight_records WHERE user_id = ? AND date = ?',
+                              (datagen.USER_ID, date)).fetchall()
+            if len(rows) != 1 or rows[0][0] not in weights:
+                problems.append(f'weight_records {date}: {rows}')
+            for key in ITEM_KEYS:
+                rows = db.execute('''
+                    SELECT checked FROM daily_checklist WHERE user_id = ? AND date = ? AND item_key = ?
+                ''', (datagen.USER_ID, date, key)).fetchall()
+                if len(rows) != 1 or rows[0][0] not in checks:
+                    problems.append(f'daily_checklist {date} {key}: {rows}')
+    finally:
+        db.close()
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4, help='同時寫入的客戶端進程數')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker 數')
+    parser.add_argument('--requests', type=int, default=100, help='每個進程的回合數')
+    parser.add_argument('--db', help='資料庫路徑（預設為暫存目錄）')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='gym-plan-upserts-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'bench.db'))
+    datagen.generate(db_path, 'tiny')
+
+    with gunicorn_server(db_path, args.workers) as port:
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.map(_client, [(port, n, args.requests) for n in range(args.processes)])
+        wall = time.perf_counter() - started
+
+    weights = {weight for result in results for weight in result[0]}
+    checks = {checked for result in results for checked in result[1]}
+    errors = [error for result in results for error in result[2]]
+    problems = verify(db_path, weights, checks)
+    report = {
+        'processes': args.processes,
+        'workers': args.workers,
+        'requests': args.processes * args.requests * 2,
+        'seconds': round(wall, 2),
+        'errors': errors[:20],
+        'error_count': len(errors),
+        'inconsistent': problems,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if errors or problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
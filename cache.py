@@ -0,0 +1,61 @@
+"""
+回應快取
+
+以 table_versions 的版本號為 key，快取序列化後的 JSON bytes。
+資料表一有寫入（不論哪個 worker）版本就會改變，舊的快取自然失效。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+CacheEntry = namedtuple('CacheEntry', 'version body etag')
+
+
+def versions_sql(count):
+    """讀取 count 個資料表版本號的查詢"""
+    return f'SELECT name, version FROM table_versions WHERE name IN ({",".join("?" * count)})'
+
+
+def table_versions(db, tables):
+    """讀取多個資料表目前的版本號（依 tables 順序）"""
+    rows = db.execute(versions_sql(len(tables)), tuple(tables)).fetchall()
+    versions = {row['name']: row['version'] for row in rows}
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+class ResponseCache:
+    """程序內 LRU 快取，存放 (版本, body, ETag)"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        """版本相符時回傳快取，否則回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, version, body):
+        """存入新的回應內容，ETag 取 body 的雜湊（各 worker 一致）"""
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        entry = CacheEntry(version, body, etag)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -2,115 +2,429 @@
 資料庫初始化與管理
 """
 
+import hashlib
 import sqlite3
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+
+import ingredients
+import metrics
+import migrations
+
+DATABASE = os.environ.get('FITNESS_DB', 'fitness.db')
+
+# 餐別排序（對應 daily_meals.meal_order）
+MEAL_ORDER = {'breakfast': 1, 'lunch': 2, 'dinner': 3}
+
+# 連線池設定（每個 worker 進程中，每個資料庫檔各自一個連線池）
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# 設定 USER_DB_DIR 時，每位使用者的資料存放在各自的資料庫檔，
+# 依 user id 的雜湊分散到 USER_DB_SHARDS 個子目錄；帳號仍在主資料庫
+USER_DB_DIR = os.environ.get('USER_DB_DIR')
+USER_DB_SHARDS = int(os.environ.get('USER_DB_SHARDS', 256))
+# 每個進程同時保有連線池的資料庫檔數上限，超過時關閉最久未使用者
+DB_OPEN_MAX = int(os.environ.get('DB_OPEN_MAX', 64))
+
+# 新使用者的預設設定
+DEFAULT_SETTINGS = (
+    ('start_weight', '119'),
+    ('target_weight', '99'),
+    ('bmr', '2300'),
+    ('daily_calories_min', '1800'),
+    ('daily_calories_max', '2200'),
+    ('protein_target', '180-220'),
+    ('whey_brand', 'MARS 水解乳清隨手包'),
+    ('whey_spec', '35g/包，26g蛋白質'),
+)
+
+# 每條連線建立時套用的 PRAGMA
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),      # 讀取不再被寫入擋住
+    ('synchronous', 'NORMAL'),    # WAL 模式下安全且少一次 fsync
+    ('cache_size', -16000),       # 約 16MB page cache
+    ('mmap_size', 64 * 1024 * 1024),
+    ('busy_timeout', 5000),       # 遇到寫鎖時最多等 5 秒
+    ('temp_store', 'MEMORY'),
+)
+
+
+def connect(path=None):
+    """建立一條新的資料庫連線並套用 PRAGMA（預設為主資料庫）"""
+    path = path or DATABASE
+    db = sqlite3.connect(path, timeout=5, check_same_thread=False,
+                         factory=metrics.InstrumentedConnection)
+    db.row_factory = sqlite3.Row
+    # 快取以檔案區分（分檔模式下每位使用者的菜單、版本計數器各自獨立）
+    db.path = path
+    for name, value in CONNECTION_PRAGMAS:
+        db.execute(f'PRAGMA {name}={value}')
+    return db
+
+
+class ConnectionPool:
+    """單一資料庫檔、有上限的 SQLite 連線池
+
+    連線在請求之間重複使用，超過上限時借用者會等待，
+    逾時則拋出 TimeoutError。
+    """
+
+    def __init__(self, path=None, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path or DATABASE
+        self.size = size
+        self.closed = False
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self.stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+        }
+
+    def acquire(self):
+        """借出一條連線"""
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            db = None
+            with self._lock:
+                if self._open < self.size:
+                    self._open += 1
+                    self.stats['created'] += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    db = connect(self.path)
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                with self._lock:
+                    self.stats['waits'] += 1
+                try:
+                    db = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.stats['timeouts'] += 1
+                    raise TimeoutError('資料庫連線池已滿，等待逾時')
+                finally:
+                    with self._lock:
+                        self.stats['wait_time'] += time.perf_counter() - started
+        with self._lock:
+            self.stats['checkouts'] += 1
+        return db
+
+    def release(self, db):
+        """歸還連線，未結束的交易一律 rollback；連線池已關閉時直接關閉連線"""
+        if self.closed:
+            self._discard(db)
+            return
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            self._discard(db)
+            return
+        self._idle.put(db)
+
+    def _discard(self, db):
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._open -= 1
+            self.stats['discarded'] += 1
+
+    def close(self):
+        """關閉連線池：閒置連線立即關閉，借出中的連線在歸還時關閉"""
+        self.closed = True
+        self.close_all()
+
+    def close_all(self):
+        """關閉所有閒置連線"""
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(db)
+
+    def snapshot(self):
+        """連線池統計"""
+        with self._lock:
+            data = dict(self.stats)
+            data['open'] = self._open
+        data['idle'] = self._idle.qsize()
+        data['in_use'] = data['open'] - data['idle']
+        data['size'] = self.size
+        data['path'] = self.path
+        data['wait_time'] = round(data['wait_time'], 6)
+        data['pid'] = os.getpid()
+        return data
+
+
+_pools = OrderedDict()
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=None):
+    """取得目前進程中某個資料庫檔（預設為主資料庫）的連線池
+
+    以 LRU 保留最多 DB_OPEN_MAX 個連線池，fork 之後全部重新建立。
+    """
+    global _pools_pid
+    path = path or DATABASE
+    evicted = []
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # 父進程留下的連線不可跨 fork 使用，直接捨棄
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+            while len(_pools) > DB_OPEN_MAX:
+                evicted.append(_pools.popitem(last=False)[1])
+        else:
+            _pools.move_to_end(path)
+    for old in evicted:
+        old.close()
+    return pool
+
+
+def open_pools():
+    """目前進程開啟中的連線池（主資料庫與各使用者資料庫檔）"""
+    with _pools_lock:
+        return list(_pools.values()) if _pools_pid == os.getpid() else []
+
+
+@contextmanager
+def borrow(path=None):
+    """在請求之外借用某個資料庫檔的池化連線"""
+    pool = get_pool(path)
+    db = pool.acquire()
+    try:
+        yield db
+    finally:
+        pool.release(db)
+
+
+@contextmanager
+def transaction(db):
+    """以 BEGIN IMMEDIATE 開始交易，正常結束時 commit，發生例外時 rollback"""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+
+
+_prepared = set()
+_prepare_lock = threading.Lock()
+
+
+def is_user_db(path):
+    """path 是否為分檔模式下的使用者檔（而非主資料庫）"""
+    return bool(USER_DB_DIR) and os.path.abspath(path) != os.path.abspath(DATABASE)
+
+
+def user_db_path(user_id):
+    """使用者資料所在的資料庫檔：未啟用分檔時為主資料庫
 
-DATABASE = 'fitness.db'
+    分檔時路徑為 USER_DB_DIR/<雜湊分組>/user-<id>.db，第一次使用時
+    建立 schema 並寫入預設菜單與設定。
+    """
+    if not USER_DB_DIR:
+        return DATABASE
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=4).digest()
+    shard = int.from_bytes(digest, 'big') % USER_DB_SHARDS
+    path = os.path.join(USER_DB_DIR, f'{shard:03d}', f'user-{user_id}.db')
+    if path not in _prepared:
+        with _prepare_lock:
+            if path not in _prepared:
+                prepare_user_db(path, user_id)
+                _prepared.add(path)
+    return path
+
+
+def prepare_user_db(path, user_id):
+    """建立（或升級）單一使用者的資料庫檔"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = connect(path)
+    try:
+        migrations.upgrade(db)
+        seed(db, user_id)
+    finally:
+        db.close()
+
+
+def current_user_id():
+    """目前請求的使用者（請求外或未登入時為 None）"""
+    return g.get('user_id') if has_app_context() else None
+
+
+def db_path():
+    """目前請求的資料所在的資料庫檔"""
+    user_id = current_user_id()
+    return user_db_path(user_id) if user_id is not None else DATABASE
 
 
 def get_db():
-    """取得資料庫連線"""
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+    """取得資料庫連線
+
+    在請求中回傳綁定於 flask.g 的池化連線（依登入的使用者選擇資料庫檔），
+    請求結束時由 close_db 歸還；在請求外（指令列、初始化）則回傳一條
+    主資料庫的獨立連線，由呼叫端自行關閉。
+    """
+    if not has_app_context():
+        return connect()
+    if 'db' not in g:
+        pool = get_pool(db_path())
+        g.db = pool.acquire()
+        g.db_pool = pool
+    return g.db
+
+
+def close_db(exception=None):
+    """請求結束時歸還連線"""
+    db = g.pop('db', None)
+    pool = g.pop('db_pool', None)
+    if db is not None:
+        pool.release(db)
+
+
+def init_app(app):
+    """註冊連線歸還的 teardown"""
+    app.teardown_appcontext(close_db)
 
 
 def init_db():
-    """初始化資料庫"""
-    db = get_db()
-
-    # 建立資料表
-    db.executescript('''
-        -- 菜單表
-        CREATE TABLE IF NOT EXISTS meals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            meal_type TEXT NOT NULL,  -- breakfast, lunch, dinner
-            ingredients TEXT,
-            calories INTEGER,
-            protein INTEGER
-        );
-
-        -- 採買清單表
-        CREATE TABLE IF NOT EXISTS shopping_list (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            category TEXT,  -- protein, vegetable, carb, oil, seasoning, drink, supplement
-            brand TEXT,     -- 品牌/廠商
-            spec TEXT,
-            price TEXT,
-            weekly_amount TEXT,
-            note TEXT
-        );
-
-        -- 每日飲食記錄表
-        CREATE TABLE IF NOT EXISTS daily_meals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL,
-            meal_type TEXT NOT NULL,  -- breakfast, lunch, dinner
-            meal_id INTEGER,
-            meal_name TEXT,
-            FOREIGN KEY (meal_id) REFERENCES meals(id)
-        );
-
-        -- 體重記錄表
-        CREATE TABLE IF NOT EXISTS weight_records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT UNIQUE NOT NULL,
-            weight REAL NOT NULL,
-            day INTEGER
-        );
-
-        -- 每日檢查清單表
-        CREATE TABLE IF NOT EXISTS daily_checklist (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL,
-            item_key TEXT NOT NULL,
-            checked INTEGER DEFAULT 0,
-            UNIQUE(date, item_key)
-        );
-
-        -- 運動參數表
-        CREATE TABLE IF NOT EXISTS exercise_params (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            duration TEXT,
-            intensity TEXT,
-            distance TEXT,
-            calories TEXT
-        );
-
-        -- 設定表
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        );
-    ''')
-
-    # 檢查是否需要初始化預設資料
-    cursor = db.execute('SELECT COUNT(*) FROM meals')
-    if cursor.fetchone()[0] == 0:
-        insert_default_data(db)
+    """初始化資料庫（migration + 預設資料）
 
-    db.commit()
-    db.close()
+    只應在啟動前執行一次：gunicorn 的 on_starting hook、`flask db upgrade`
+    或開發模式的 `python app.py`，worker 進程本身不做任何 DDL。
+    """
+    db = connect()
 
+    # 套用尚未執行的 schema migration
+    applied = migrations.upgrade(db)
 
-def insert_default_data(db):
-    """插入預設資料"""
+    # 檢查是否需要初始化預設資料（歸屬管理員帳號）
+    seed(db, 1)
+
+    db.close()
+    return applied
+
+
+def seed(db, user_id):
+    """菜單為空時寫入預設資料（多個進程同時執行也只會寫入一次）"""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if db.execute('SELECT COUNT(*) FROM meals').fetchone()[0] == 0:
+            insert_default_data(db, user_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def insert_many(db, table, columns, rows):
+    """以 executemany 批次新增，回傳每筆的 id（依 rows 順序）
+
+    僅適用 AUTOINCREMENT 主鍵的資料表：同一交易持有寫鎖期間 id 連續配發，
+    由 sqlite_sequence 的最終值即可反推每筆 id。由呼叫端負責 commit。
+    """
+    if not rows:
+        return []
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    placeholders = ', '.join('?' * len(columns))
+    db.executemany(
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})', rows
+    )
+    last = db.execute('SELECT seq FROM sqlite_sequence WHERE name=?', (table,)).fetchone()[0]
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def upsert(db, table, columns, rows, conflict, update=None):
+    """原生 UPSERT：INSERT ... ON CONFLICT(conflict) DO UPDATE
+
+    一條語句完成新增或覆寫，不需要先 SELECT，多個 worker 同時寫入同一鍵
+    也不會出現重複鍵錯誤。update 為衝突時覆寫的欄位，預設為 conflict
+    以外的所有欄位。由呼叫端負責 commit。
+    """
+    if update is None:
+        update = [column for column in columns if column not in conflict]
+    placeholders = ', '.join('?' * len(columns))
+    assignments = ', '.join(f'{column}=excluded.{column}' for column in update)
+    sql = (
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders}) '
+        f'ON CONFLICT({", ".join(conflict)}) DO UPDATE SET {assignments}'
+    )
+    if len(rows) == 1:
+        return db.execute(sql, rows[0])
+    return db.executemany(sql, rows)
+
+
+def explain(db, sql, params=()):
+    """取得查詢的 EXPLAIN QUERY PLAN 明細"""
+    rows = db.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    return [row['detail'] for row in rows]
+
+
+def plan_problems(db, sql, params=(), full_scan_ok=()):
+    """找出查詢計畫中的全表掃描與暫存排序
+
+    `SCAN <table>` 未使用索引、或 ORDER BY 需要 `USE TEMP B-TREE` 排序者視為問題
+    （彙總查詢的 GROUP BY 暫存表是本質成本，不列入）；FTS 等虛擬表以
+    `VIRTUAL TABLE INDEX n:<idxStr>` 表示，idxStr 為空時才是逐列掃描。
+    full_scan_ok 列出本來就要整表讀取的小表。
+    """
+    problems = []
+    for detail in explain(db, sql, params):
+        if 'TEMP B-TREE' in detail and 'ORDER BY' in detail:
+            problems.append(detail)
+        elif 'VIRTUAL TABLE INDEX' in detail:
+            if detail.endswith(':'):
+                problems.append(detail)
+        elif detail.startswith('SCAN ') and 'USING' not in detail:
+            table = detail.split()[1]
+            if table not in full_scan_ok:
+                problems.append(detail)
+    return problems
+
+
+def insert_default_settings(db, user_id):
+    """寫入使用者的預設設定（已有的設定不覆蓋，由呼叫端 commit）"""
+    db.executemany('INSERT OR IGNORE INTO settings (user_id, key, value) VALUES (?, ?, ?)',
+                   [(user_id, key, value) for key, value in DEFAULT_SETTINGS])
+
+
+def insert_default_data(db, user_id=1):
+    """插入預設資料（共用的菜單、採買清單、運動參數與 user_id 的設定）"""
 
     # 預設設定
-    settings = [
-        ('start_weight', '119'),
-        ('target_weight', '99'),
-        ('bmr', '2300'),
-        ('daily_calories_min', '1800'),
-        ('daily_calories_max', '2200'),
-        ('protein_target', '180-220'),
-        ('whey_brand', 'MARS 水解乳清隨手包'),
-        ('whey_spec', '35g/包，26g蛋白質'),
-    ]
-    db.executemany('INSERT INTO settings (key, value) VALUES (?, ?)', settings)
+    insert_default_settings(db, user_id)
 
     # 預設運動參數
     exercises = [
@@ -168,6 +482,8 @@ def insert_default_data(db):
         INSERT INTO meals (name, meal_type, ingredients, calories, protein)
         VALUES (?, ?, ?, ?, ?)
     ''', breakfast_meals + lunch_meals + dinner_meals)
+    for row in db.execute('SELECT id, ingredients FROM meals').fetchall():
+        ingredients.sync_meal(db, row['id'], row['ingredients'])
 
     # 預設採買清單 - 蛋白質 (name, category, brand, spec, price, weekly_amount, note)
     protein_items = [
@@ -231,10 +547,89 @@ def insert_default_data(db):
     ''', all_shopping)
 
 
-if __name__ == '__main__':
-    # 直接執行可重新初始化資料庫
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-        print(f"已刪除舊資料庫: {DATABASE}")
+# ==================== 指令列 ====================
+
+def reset_db():
+    """刪除並重新初始化主資料庫"""
+    import archive
+
+    for path in (DATABASE, archive.archive_path(DATABASE)):
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"已刪除舊資料庫: {path}")
     init_db()
     print(f"資料庫已初始化: {DATABASE}")
+
+
+def export_file(output, tables, fmt, user_id):
+    """匯出到檔案（output 為 None 時寫到標準輸出）"""
+    import sys
+    import transfer
+
+    init_db()
+    db = connect(user_db_path(user_id))
+    out = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    try:
+        for chunk in transfer.dump(db, tables, fmt, user_id):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+        db.close()
+
+
+def import_file(source, fmt, user_id, table=None):
+    """從檔案匯入（source 為 '-' 時讀標準輸入），單一交易，回傳各表筆數"""
+    import sys
+    import transfer
+
+    init_db()
+    db = connect(user_db_path(user_id))
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8-sig', newline='')
+    try:
+        with transaction(db):
+            return transfer.load(db, stream, fmt, user_id, table)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        db.close()
+
+
+def main(argv=None):
+    import argparse
+    import transfer
+
+    parser = argparse.ArgumentParser(description='資料庫管理（FITNESS_DB 指定資料庫檔）')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('reset', help='刪除並重新初始化資料庫（未指定指令時的預設動作）')
+
+    export = commands.add_parser('export', help='匯出資料為 NDJSON / CSV')
+    export.add_argument('-o', '--output', help='輸出檔（預設為標準輸出，副檔名 .csv 時輸出 CSV）')
+    export.add_argument('--tables', help='以逗號分隔的資料表（預設全部）')
+    export.add_argument('--format', choices=transfer.FORMATS)
+    export.add_argument('--user', type=int, default=1, help='個人資料所屬的使用者 id（預設 1）')
+
+    load = commands.add_parser('import', help='匯入 NDJSON / CSV（單一交易）')
+    load.add_argument('file', help="資料檔（'-' 為標準輸入）")
+    load.add_argument('--format', choices=transfer.FORMATS)
+    load.add_argument('--table', help='CSV 或未標示 _table 的 NDJSON 要匯入的資料表')
+    load.add_argument('--user', type=int, default=1, help='個人資料所屬的使用者 id（預設 1）')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'export':
+            fmt = args.format or transfer.guess_format(args.output)
+            export_file(args.output, transfer.parse_tables(args.tables), fmt, args.user)
+        elif args.command == 'import':
+            fmt = args.format or transfer.guess_format(args.file)
+            counts = import_file(args.file, fmt, args.user, args.table)
+            for table, count in counts.items():
+                print(f'{table}: {count} 筆')
+        else:
+            reset_db()
+    except ValueError as e:
+        parser.exit(1, f'錯誤：{e}\n')
+
+
+if __name__ == '__main__':
+    main()
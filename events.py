@@ -0,0 +1,142 @@
+"""
+變更串流（Server-Sent Events）
+
+資料表的每次寫入由 trigger 記錄在 change_log（見 migrations.create_change_log），
+/api/events 從指定的 seq 之後持續推送給瀏覽器，前端依事件更新畫面，
+不必在每次寫入後重新載入整個清單，其他分頁也能即時看到變更。
+
+同一進程的寫入 commit 後立即喚醒串流，其他 worker 的寫入則最多
+EVENTS_POLL_SECONDS 秒後讀到。WSGI（gunicorn）下每條串流佔用一條執行緒，
+因此每個進程同時開啟的串流數有上限（EVENTS_MAX_STREAMS），超過時回應 503，
+前端改回寫入後重新載入。ASGI（uvicorn）下由 asgi.py 以 stream_async 推送，
+等待時不佔執行緒，上限為 EVENTS_MAX_ASYNC_STREAMS。
+
+環境變數：
+    EVENTS_MAX_STREAMS    每個 WSGI 進程同時開啟的串流數（預設 2）
+    EVENTS_MAX_ASYNC_STREAMS  每個 ASGI 進程同時開啟的串流數（預設 1000）
+    EVENTS_MAX_SECONDS    單一連線最長秒數，之後由瀏覽器帶 Last-Event-ID 重連（預設 300）
+    EVENTS_POLL_SECONDS   檢查其他進程寫入的間隔（預設 1）
+"""
+
+import json
+import os
+import threading
+import time
+
+import aiodb
+import database
+import writer
+
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 2))
+EVENTS_MAX_ASYNC_STREAMS = int(os.environ.get('EVENTS_MAX_ASYNC_STREAMS', 1000))
+EVENTS_MAX_SECONDS = float(os.environ.get('EVENTS_MAX_SECONDS', 300))
+EVENTS_POLL_SECONDS = float(os.environ.get('EVENTS_POLL_SECONDS', 1))
+HEARTBEAT_SECONDS = 15     # 沒有事件時送出註解行，讓代理不斷線、也能及早發現連線已關閉
+RETRY_MS = 3000            # 瀏覽器斷線後的重連間隔
+BATCH_SIZE = 500           # 每次讀取的變更筆數
+# 讓 Nginx 不緩衝，事件才會即時送出
+RESPONSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+LATEST_QUERY = "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name='change_log'), 0)"
+CHANGES_QUERY = '''
+    SELECT seq, tbl, op, row_id, row FROM change_log
+    WHERE seq > ? AND (user_id IS NULL OR user_id = ?)
+    ORDER BY seq LIMIT ?
+'''
+OLDEST_QUERY = 'SELECT MIN(seq) FROM change_log'
+
+_streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+
+def acquire_stream():
+    """取得一個串流名額，已滿時回傳 False"""
+    return _streams.acquire(blocking=False)
+
+
+def release_stream():
+    _streams.release()
+
+
+def latest_seq(db):
+    """目前最新的 seq（清除舊記錄不影響）"""
+    return db.execute(LATEST_QUERY).fetchone()[0]
+
+
+def changes(db, user_id, since, limit=BATCH_SIZE):
+    """seq 之後、使用者看得到的變更（共用資料與自己的資料）"""
+    return db.execute(CHANGES_QUERY, (since, user_id, limit)).fetchall()
+
+
+def missed(db, since):
+    """since 之後的記錄是否已被清除（或 since 比目前最新的還新，例如資料庫重建）"""
+    oldest = db.execute(OLDEST_QUERY).fetchone()[0]
+    latest = latest_seq(db)
+    return since > latest or (oldest is not None and since < oldest - 1)
+
+
+def format_event(row):
+    data = {'seq': row['seq'], 'table': row['tbl'], 'op': row['op'], 'id': row['row_id'],
+            'row': json.loads(row['row'])}
+    return f"id: {row['seq']}\nevent: change\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream(path, user_id, since=None, duration=EVENTS_MAX_SECONDS):
+    """產生 SSE 文字；since 為 None 時只推送之後的新變更
+
+    遺漏的記錄已被清除時先送出 reset 事件，前端應重新載入全部資料。
+    """
+    deadline = time.monotonic() + duration
+    yield f'retry: {RETRY_MS}\n\n'
+    with database.borrow(path) as db:
+        if since is None:
+            since = latest_seq(db)
+        elif missed(db, since):
+            since = latest_seq(db)
+            yield f"id: {since}\nevent: reset\ndata: {json.dumps({'seq': since})}\n\n"
+
+    queue = writer.get_writer()
+    last_sent = time.monotonic()
+    while True:
+        with database.borrow(path) as db:
+            rows = changes(db, user_id, since)
+        if rows:
+            since = rows[-1]['seq']
+            last_sent = time.monotonic()
+            yield ''.join(format_event(row) for row in rows)
+            if len(rows) == BATCH_SIZE:
+                continue
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now - last_sent >= HEARTBEAT_SECONDS:
+            last_sent = now
+            yield ': keepalive\n\n'
+        queue.wait_for_commit(min(EVENTS_POLL_SECONDS, deadline - now))
+
+
+async def stream_async(path, user_id, since=None, duration=EVENTS_MAX_SECONDS):
+    """stream() 的 async 版本（ASGI）：查詢在 aiodb 的 reader 執行緒，等待時不佔執行緒"""
+    deadline = time.monotonic() + duration
+    yield f'retry: {RETRY_MS}\n\n'
+    if since is None:
+        since = await aiodb.executor.read(latest_seq, path=path)
+    elif await aiodb.executor.read(missed, since, path=path):
+        since = await aiodb.executor.read(latest_seq, path=path)
+        yield f"id: {since}\nevent: reset\ndata: {json.dumps({'seq': since})}\n\n"
+
+    last_sent = time.monotonic()
+    while True:
+        rows = await aiodb.executor.read(changes, user_id, since, path=path)
+        if rows:
+            since = rows[-1]['seq']
+            last_sent = time.monotonic()
+            yield ''.join(format_event(row) for row in rows)
+            if len(rows) == BATCH_SIZE:
+                continue
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now - last_sent >= HEARTBEAT_SECONDS:
+            last_sent = now
+            yield ': keepalive\n\n'
+        await aiodb.executor.wait_for_commit(min(EVENTS_POLL_SECONDS, deadline - now))
@@ -0,0 +1,29 @@
+"""
+Gunicorn 設定
+
+在 master 進程 fork worker 之前執行一次資料庫 migration 與靜態檔建置，
+worker 啟動時不再做任何 DDL，也不會同時搶寫鎖。設定 BACKUP_INTERVAL_HOURS 時
+各 worker 啟動背景備份排程（同一時間只有一個進程實際執行）。
+"""
+
+import os
+
+# 每個 worker 的執行緒數（大於 1 時使用 gthread worker）；同一 worker 內
+# 同時到達的寫入會在 writer 佇列中合併成同一個交易
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+
+def on_starting(server):
+    import assets
+    from database import init_db
+
+    applied = init_db()
+    if applied:
+        server.log.info('已套用資料庫 migration: %s', ', '.join(map(str, applied)))
+    assets.build()
+
+
+def post_worker_init(worker):
+    import backup
+
+    backup.start_scheduler()
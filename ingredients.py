@@ -0,0 +1,214 @@
+"""
+食材解析與自動採買清單
+
+把菜單的自由文字食材（如 '雞胸肉 200g, 水煮蛋 2顆'）解析成
+(食材, 數量, 單位) 存入 meal_ingredients，並依日期區間的飲食記錄
+加總用量，再依 shopping_list 的 spec 換算成要買幾包／幾盒。
+"""
+
+import math
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+import cache
+
+Ingredient = namedtuple('Ingredient', 'name quantity unit')
+Pack = namedtuple('Pack', 'quantity unit label')
+
+_SEPARATORS = re.compile(r'[,，、+＋]')
+_AMOUNT = re.compile(r'^(?P<name>.+?)\s*(?P<quantity>\d+(?:\.\d+)?)\s*(?P<unit>[^\d\s]*)$')
+_SPEC = re.compile(
+    r'(?P<quantity>\d+(?:\.\d+)?)\s*(?P<unit>kg|g|ml|L|入|顆)'
+    r'(?:\s*[×xX]\s*(?P<count>\d+))?(?:\s*/\s*(?P<label>[^\s（(]+))?'
+)
+_PARENTHESES = re.compile(r'[（(][^）)]*[）)]')
+
+# 換算成基本單位：重量 g、容量 ml、個數 顆
+_UNITS = {
+    'g': ('g', 1), 'kg': ('g', 1000),
+    'ml': ('ml', 1), 'L': ('ml', 1000), 'l': ('ml', 1000),
+    '顆': ('顆', 1), '個': ('顆', 1), '入': ('顆', 1),
+}
+
+# 菜單用詞與採買品名不一致者
+ALIASES = {
+    '蛋': '雞蛋',
+    '全蛋': '雞蛋',
+    '蛋白': '雞蛋',
+    '糙米飯': '糙米',
+    '紫米飯': '紫米',
+    '瘦牛肉': '牛肋條',
+    '牛排': '牛肋條',
+    'MARS水解乳清': '水解乳清隨手包',
+}
+
+
+def normalize_unit(quantity, unit):
+    """把數量換算成基本單位，無法換算的單位原樣保留"""
+    if quantity is None:
+        return None, unit or None
+    base, factor = _UNITS.get(unit, (unit or None, 1))
+    return quantity * factor, base
+
+
+@lru_cache(maxsize=1024)
+def parse_ingredients(text):
+    """解析食材文字，回傳 Ingredient tuple（相同文字只解析一次）"""
+    result = []
+    for part in _SEPARATORS.split(text or ''):
+        part = part.strip()
+        if not part:
+            continue
+        match = _AMOUNT.match(part)
+        if match:
+            quantity, unit = normalize_unit(float(match['quantity']), match['unit'])
+            result.append(Ingredient(match['name'].strip(), quantity, unit))
+        else:
+            result.append(Ingredient(part, None, None))
+    return tuple(result)
+
+
+def sync_meal(db, meal_id, text):
+    """重建一道菜的 meal_ingredients（由呼叫端負責 commit）"""
+    db.execute('DELETE FROM meal_ingredients WHERE meal_id=?', (meal_id,))
+    db.executemany('''
+        INSERT INTO meal_ingredients (meal_id, position, ingredient, quantity, unit)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(meal_id, position, *item) for position, item in enumerate(parse_ingredients(text))])
+
+
+def parse_spec(spec):
+    """由採買規格（如 '2.5kg/包（6塊裝）'、'1.8L×2'）取出每包的基本單位數量"""
+    match = _SPEC.search(spec or '')
+    if not match:
+        return None
+    quantity, unit = normalize_unit(float(match['quantity']), match['unit'])
+    if match['count']:
+        quantity *= int(match['count'])
+    label = match['label'] or ('組' if match['count'] else '份')
+    return Pack(quantity, unit, label)
+
+
+def _keys(name):
+    """採買品名可對應的關鍵字：去掉括號說明，'/' 分隔的別名各自成立"""
+    name = _PARENTHESES.sub('', name)
+    return [key.strip() for key in name.split('/') if key.strip()]
+
+
+class ShoppingIndex:
+    """食材名稱 → 採買項目的對照（依 shopping_list 版本快取）"""
+
+    def __init__(self, rows):
+        self.items = {row['id']: dict(row, pack=parse_spec(row['spec'])) for row in rows}
+        self.by_key = {}
+        for row in rows:
+            for key in _keys(row['name']):
+                self.by_key.setdefault(key, row['id'])
+        # 長的關鍵字優先比對，避免 '雞蛋' 搶走 '水煮蛋'
+        self.ordered_keys = sorted(self.by_key, key=len, reverse=True)
+        self._matches = {}
+
+    def match(self, ingredient):
+        """找出食材對應的採買項目 id，找不到回傳 None（結果記在本索引內）"""
+        if ingredient not in self._matches:
+            self._matches[ingredient] = self._lookup(ALIASES.get(ingredient, ingredient))
+        return self._matches[ingredient]
+
+    def _lookup(self, name):
+        if name in self.by_key:
+            return self.by_key[name]
+        for key in self.ordered_keys:
+            if key in name:
+                return self.by_key[key]
+        for key in reversed(self.ordered_keys):
+            if name in key:
+                return self.by_key[key]
+        return None
+
+
+SHOPPING_INDEX_QUERY = 'SELECT * FROM shopping_list'
+
+# 每個資料庫檔各自的 (版本, 對照表)；分檔模式下每位使用者一份
+INDEX_CACHE_FILES = 64
+_indexes = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def shopping_index(db):
+    """取得目前 shopping_list 版本的對照表"""
+    version = cache.table_versions(db, ('shopping_list',))
+    with _index_lock:
+        cached = _indexes.get(db.path)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(db.path)
+            return cached[1]
+    rows = db.execute(SHOPPING_INDEX_QUERY).fetchall()
+    index = ShoppingIndex(rows)
+    with _index_lock:
+        _indexes[db.path] = (version, index)
+        _indexes.move_to_end(db.path)
+        while len(_indexes) > INDEX_CACHE_FILES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _format_amount(packs, label):
+    """無條件進位到 0.5 包，格式同手動填寫的 weekly_amount（如 '3包'、'0.5包'）"""
+    rounded = math.ceil(packs * 2) / 2
+    return f'{rounded:g}{label}'
+
+
+# 日期區間內各食材的用量（參數：user_id, 起日, 迄日）；不加 ORDER BY，
+# 分組後只剩數十列，在 Python 排序，省去第二個暫存 B-tree
+NEEDS_QUERY = '''
+    SELECT mi.ingredient, mi.unit, SUM(mi.quantity) AS quantity, COUNT(*) AS uses
+    FROM daily_meals dm
+    JOIN meal_ingredients mi ON mi.meal_id = dm.meal_id
+    WHERE dm.user_id = ? AND dm.date BETWEEN ? AND ?
+    GROUP BY mi.ingredient, mi.unit
+'''
+
+
+def shopping_needs(db, user_id, date_from, date_to):
+    """加總日期區間內飲食記錄的食材用量，並換算成各採買項目的包數"""
+    rows = db.execute(NEEDS_QUERY, (user_id, date_from, date_to)).fetchall()
+    rows.sort(key=lambda row: (row['ingredient'], row['unit'] or ''))
+
+    index = shopping_index(db)
+    needs, unmatched = {}, []
+    for row in rows:
+        usage = {'ingredient': row['ingredient'], 'quantity': row['quantity'],
+                 'unit': row['unit'], 'uses': row['uses']}
+        item_id = index.match(row['ingredient'])
+        item = index.items.get(item_id)
+        pack = item and item['pack']
+        packs = None
+        if pack and row['quantity'] is not None:
+            if row['unit'] == pack.unit:
+                packs = row['quantity'] / pack.quantity
+            elif row['unit'] == pack.label:
+                packs = row['quantity']
+        if packs is None:
+            unmatched.append(dict(usage, shopping_id=item_id))
+            continue
+        need = needs.setdefault(item_id, {
+            'shopping_id': item_id, 'name': item['name'], 'spec': item['spec'],
+            'packs': 0.0, 'label': pack.label, 'ingredients': [],
+        })
+        need['packs'] += packs
+        need['ingredients'].append(usage)
+
+    for need in needs.values():
+        need['packs'] = round(need['packs'], 3)
+        need['amount'] = _format_amount(need['packs'], need['label'])
+    return list(needs.values()), unmatched
+
+
+def apply_weekly_amounts(db, needs, days):
+    """把用量換算成每週份量寫回 shopping_list.weekly_amount（由呼叫端 commit）"""
+    rows = [(_format_amount(need['packs'] * 7 / days, need['label']), need['shopping_id'])
+            for need in needs]
+    db.executemany('UPDATE shopping_list SET weekly_amount=? WHERE id=?', rows)
+    return len(rows)
@@ -0,0 +1,272 @@
+"""
+效能指標
+
+記錄每個路由的延遲分佈、每個 SQL 的執行時間（含讀取結果列）與筆數，並輸出
+Prometheus 文字格式。資料以進程為單位（gunicorn 每個 worker 各自一份，以 pid
+標籤區分）。
+
+環境變數：
+    SLOW_QUERY_MS  大於 0 時，執行超過此毫秒數的 SQL 以 WARNING 記錄
+    SQL_TRACE      設為 1 時以 set_trace_callback 記錄實際執行的每個語句
+                   （含 trigger 內的語句），並以 DEBUG 輸出
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('gym_plan.sql')
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+SQL_TRACE = os.environ.get('SQL_TRACE') == '1'
+
+# 延遲分佈的 bucket 上界（秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SQL_LABEL_LENGTH = 160
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Histogram:
+    """固定 bucket 的累積分佈"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.sum += seconds
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            yield bound, total
+
+
+class QueryStats:
+    __slots__ = ('histogram', 'rows')
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.rows = 0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.queries = {}
+        self.statements = 0
+
+    def observe_request(self, route, method, status, seconds):
+        key = (route, method, str(status))
+        with self._lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram()
+            histogram.observe(seconds)
+
+    def _query(self, sql):
+        stats = self.queries.get(sql)
+        if stats is None:
+            stats = self.queries[sql] = QueryStats()
+        return stats
+
+    def observe_query(self, sql, seconds, rows=0):
+        with self._lock:
+            stats = self._query(sql)
+            stats.histogram.observe(seconds)
+            stats.rows += rows
+
+    def count_statement(self):
+        with self._lock:
+            self.statements += 1
+
+
+registry = Registry()
+
+
+def normalize(sql):
+    """SQL 標籤：壓縮空白並截斷，參數一律是 ? 佔位符所以不會爆量"""
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return sql if len(sql) <= SQL_LABEL_LENGTH else sql[:SQL_LABEL_LENGTH] + '…'
+
+
+def trace(statement):
+    """set_trace_callback：計數並記錄實際執行的語句"""
+    registry.count_statement()
+    logger.debug('SQL %s', statement)
+
+
+def _record(sql, elapsed, rows=0):
+    registry.observe_query(sql, elapsed, rows)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning('slow query %.1fms: %s', elapsed * 1000, sql)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """記錄執行時間與讀取筆數的 cursor
+
+    時間為 execute 加上之後每次 fetch 所花的時間（不含呼叫端處理各列的時間）；
+    筆數先累計在 cursor 上，讀完、close、重新 execute 或 cursor 回收時才一次
+    寫入 registry，逐列讀取不必每列搶鎖。
+    """
+
+    _label = None
+    _elapsed = 0.0
+    _rows = 0
+
+    def _finish(self):
+        if self._label is not None:
+            label, self._label = self._label, None
+            _record(label, self._elapsed, self._rows)
+
+    def _fetched(self, started, rows, done):
+        self._elapsed += time.perf_counter() - started
+        self._rows += rows
+        if done:
+            self._finish()
+
+    def _executed(self, sql, started):
+        self._label, self._elapsed, self._rows = normalize(sql), time.perf_counter() - started, 0
+        if self.description is None:
+            # 沒有結果列的語句（寫入、DDL）在 execute 後就知道影響筆數
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._executed(sql, started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._executed(sql, started)
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # 只讀了部分結果（例如 fetchone 取第一列）就丟棄的 cursor
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """database.connect() 使用的連線類別，所有查詢經過 InstrumentedCursor"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if SQL_TRACE:
+            self.set_trace_callback(trace)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ==================== Prometheus 輸出 ====================
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, histogram, labels):
+    for bound, count in histogram.cumulative():
+        yield f'{name}_bucket{_labels(**labels, le=bound)} {count}'
+    yield f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}'
+    yield f'{name}_sum{_labels(**labels)} {histogram.sum:.6f}'
+    yield f'{name}_count{_labels(**labels)} {histogram.count}'
+
+
+def render(gauges=None):
+    """輸出 Prometheus text format（0.0.4）"""
+    pid = os.getpid()
+    lines = []
+    with registry._lock:
+        requests = list(registry.requests.items())
+        queries = [(sql, stats.histogram, stats.rows) for sql, stats in registry.queries.items()]
+        statements = registry.statements
+
+    lines.append('# HELP gym_plan_http_request_duration_seconds 每個路由的回應時間')
+    lines.append('# TYPE gym_plan_http_request_duration_seconds histogram')
+    for (route, method, status), histogram in requests:
+        lines.extend(_histogram_lines('gym_plan_http_request_duration_seconds', histogram,
+                                      dict(pid=pid, route=route, method=method, status=status)))
+
+    lines.append('# HELP gym_plan_sql_query_duration_seconds 每個 SQL 的執行與讀取結果列時間（不含呼叫端處理）')
+    lines.append('# TYPE gym_plan_sql_query_duration_seconds histogram')
+    for sql, histogram, _ in queries:
+        lines.extend(_histogram_lines('gym_plan_sql_query_duration_seconds', histogram,
+                                      dict(pid=pid, query=sql)))
+
+    lines.append('# HELP gym_plan_sql_rows_total 每個 SQL 讀取或影響的筆數')
+    lines.append('# TYPE gym_plan_sql_rows_total counter')
+    for sql, _, rows in queries:
+        lines.append(f'gym_plan_sql_rows_total{_labels(pid=pid, query=sql)} {rows}')
+
+    if SQL_TRACE:
+        lines.append('# HELP gym_plan_sql_statements_total 實際執行的語句數（含 trigger）')
+        lines.append('# TYPE gym_plan_sql_statements_total counter')
+        lines.append(f'gym_plan_sql_statements_total{_labels(pid=pid)} {statements}')
+
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name}{_labels(pid=pid)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,637 @@
+"""
+資料庫 schema migration
+
+每個 migration 為 (版本, 說明, SQL 字串或 callable(db))，依版本號遞增套用，
+已套用的版本記錄在 schema_version 表。新增 schema 變更時只能往 MIGRATIONS
+尾端追加，不可修改已發佈的 migration。
+"""
+
+import sqlite3
+
+
+MIGRATIONS = [
+    (1, '建立初始資料表', '''
+        -- 菜單表
+        CREATE TABLE IF NOT EXISTS meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            meal_type TEXT NOT NULL,  -- breakfast, lunch, dinner
+            ingredients TEXT,
+            calories INTEGER,
+            protein INTEGER
+        );
+
+        -- 採買清單表
+        CREATE TABLE IF NOT EXISTS shopping_list (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category TEXT,  -- protein, vegetable, carb, oil, seasoning, drink, supplement
+            brand TEXT,     -- 品牌/廠商
+            spec TEXT,
+            price TEXT,
+            weekly_amount TEXT,
+            note TEXT
+        );
+
+        -- 每日飲食記錄表
+        CREATE TABLE IF NOT EXISTS daily_meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,  -- breakfast, lunch, dinner
+            meal_id INTEGER,
+            meal_name TEXT,
+            FOREIGN KEY (meal_id) REFERENCES meals(id)
+        );
+
+        -- 體重記錄表
+        CREATE TABLE IF NOT EXISTS weight_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT UNIQUE NOT NULL,
+            weight REAL NOT NULL,
+            day INTEGER
+        );
+
+        -- 每日檢查清單表
+        CREATE TABLE IF NOT EXISTS daily_checklist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            checked INTEGER DEFAULT 0,
+            UNIQUE(date, item_key)
+        );
+
+        -- 運動參數表
+        CREATE TABLE IF NOT EXISTS exercise_params (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            duration TEXT,
+            intensity TEXT,
+            distance TEXT,
+            calories TEXT
+        );
+
+        -- 設定表
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    '''),
+    (2, '日期索引與 meal_order 欄位', '''
+        -- 餐別排序改為儲存欄位，取代每列計算的 CASE
+        ALTER TABLE daily_meals ADD COLUMN meal_order INTEGER;
+        UPDATE daily_meals SET meal_order = CASE meal_type
+            WHEN 'breakfast' THEN 1
+            WHEN 'lunch' THEN 2
+            WHEN 'dinner' THEN 3
+        END;
+
+        -- 依日期查詢／歷史記錄（date DESC, meal_order）免排序
+        CREATE INDEX IF NOT EXISTS idx_daily_meals_date_order ON daily_meals(date DESC, meal_order);
+        -- 清除某日某餐
+        CREATE INDEX IF NOT EXISTS idx_daily_meals_date_type ON daily_meals(date, meal_type);
+        -- 菜單、採買清單列表排序
+        CREATE INDEX IF NOT EXISTS idx_meals_type ON meals(meal_type, id);
+        CREATE INDEX IF NOT EXISTS idx_shopping_category ON shopping_list(category, id);
+    '''),
+    (3, '資料表版本計數器', lambda db: create_version_triggers(db, VERSIONED_TABLES)),
+    (4, '每日營養總計表', '''
+        -- 每日熱量／蛋白質總計，由 trigger 依 daily_meals、meals 的變動增量維護
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            date TEXT PRIMARY KEY,
+            calories INTEGER NOT NULL DEFAULT 0,
+            protein INTEGER NOT NULL DEFAULT 0,
+            meal_count INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- 菜單營養值變動時找出引用它的記錄
+        CREATE INDEX IF NOT EXISTS idx_daily_meals_meal ON daily_meals(meal_id, date);
+
+        INSERT OR REPLACE INTO daily_totals (date, calories, protein, meal_count)
+        SELECT dm.date, COALESCE(SUM(m.calories), 0), COALESCE(SUM(m.protein), 0), COUNT(*)
+        FROM daily_meals dm LEFT JOIN meals m ON m.id = dm.meal_id
+        GROUP BY dm.date;
+
+        CREATE TRIGGER IF NOT EXISTS daily_totals_meal_insert
+        AFTER INSERT ON daily_meals
+        BEGIN
+            INSERT INTO daily_totals (date, calories, protein, meal_count)
+            VALUES (
+                NEW.date,
+                COALESCE((SELECT calories FROM meals WHERE id = NEW.meal_id), 0),
+                COALESCE((SELECT protein FROM meals WHERE id = NEW.meal_id), 0),
+                1
+            )
+            ON CONFLICT(date) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                meal_count = meal_count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS daily_totals_meal_delete
+        AFTER DELETE ON daily_meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - COALESCE((SELECT calories FROM meals WHERE id = OLD.meal_id), 0),
+                protein = protein - COALESCE((SELECT protein FROM meals WHERE id = OLD.meal_id), 0),
+                meal_count = meal_count - 1
+            WHERE date = OLD.date;
+            DELETE FROM daily_totals WHERE date = OLD.date AND meal_count <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS daily_totals_meal_update
+        AFTER UPDATE OF date, meal_id ON daily_meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - COALESCE((SELECT calories FROM meals WHERE id = OLD.meal_id), 0),
+                protein = protein - COALESCE((SELECT protein FROM meals WHERE id = OLD.meal_id), 0),
+                meal_count = meal_count - 1
+            WHERE date = OLD.date;
+            DELETE FROM daily_totals WHERE date = OLD.date AND meal_count <= 0;
+            INSERT INTO daily_totals (date, calories, protein, meal_count)
+            VALUES (
+                NEW.date,
+                COALESCE((SELECT calories FROM meals WHERE id = NEW.meal_id), 0),
+                COALESCE((SELECT protein FROM meals WHERE id = NEW.meal_id), 0),
+                1
+            )
+            ON CONFLICT(date) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                meal_count = meal_count + 1;
+        END;
+
+        -- 修改菜單熱量／蛋白質：依各日期引用次數套用差額
+        CREATE TRIGGER IF NOT EXISTS daily_totals_catalog_update
+        AFTER UPDATE OF calories, protein ON meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories + (COALESCE(NEW.calories, 0) - COALESCE(OLD.calories, 0)) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = NEW.id AND date = daily_totals.date),
+                protein = protein + (COALESCE(NEW.protein, 0) - COALESCE(OLD.protein, 0)) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = NEW.id AND date = daily_totals.date)
+            WHERE date IN (SELECT date FROM daily_meals WHERE meal_id = NEW.id);
+        END;
+
+        -- 刪除菜單：記錄仍保留，但不再計入營養值（與 LEFT JOIN 結果一致）
+        CREATE TRIGGER IF NOT EXISTS daily_totals_catalog_delete
+        AFTER DELETE ON meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - COALESCE(OLD.calories, 0) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = OLD.id AND date = daily_totals.date),
+                protein = protein - COALESCE(OLD.protein, 0) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = OLD.id AND date = daily_totals.date)
+            WHERE date IN (SELECT date FROM daily_meals WHERE meal_id = OLD.id);
+        END;
+    '''),
+    (5, '結構化食材表', lambda db: create_meal_ingredients(db)),
+    (6, 'FTS5 全文搜尋', '''
+        -- trigram 斷詞不依賴空白，中文可直接以任意 3 字以上子字串搜尋
+        CREATE VIRTUAL TABLE IF NOT EXISTS meals_fts USING fts5(
+            name, ingredients,
+            content='meals', content_rowid='id', tokenize='trigram'
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS shopping_fts USING fts5(
+            name, brand, note,
+            content='shopping_list', content_rowid='id', tokenize='trigram'
+        );
+        INSERT INTO meals_fts(meals_fts) VALUES ('rebuild');
+        INSERT INTO shopping_fts(shopping_fts) VALUES ('rebuild');
+
+        CREATE TRIGGER IF NOT EXISTS meals_fts_insert AFTER INSERT ON meals
+        BEGIN
+            INSERT INTO meals_fts(rowid, name, ingredients)
+            VALUES (NEW.id, NEW.name, NEW.ingredients);
+        END;
+        CREATE TRIGGER IF NOT EXISTS meals_fts_delete AFTER DELETE ON meals
+        BEGIN
+            INSERT INTO meals_fts(meals_fts, rowid, name, ingredients)
+            VALUES ('delete', OLD.id, OLD.name, OLD.ingredients);
+        END;
+        CREATE TRIGGER IF NOT EXISTS meals_fts_update AFTER UPDATE OF name, ingredients ON meals
+        BEGIN
+            INSERT INTO meals_fts(meals_fts, rowid, name, ingredients)
+            VALUES ('delete', OLD.id, OLD.name, OLD.ingredients);
+            INSERT INTO meals_fts(rowid, name, ingredients)
+            VALUES (NEW.id, NEW.name, NEW.ingredients);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS shopping_fts_insert AFTER INSERT ON shopping_list
+        BEGIN
+            INSERT INTO shopping_fts(rowid, name, brand, note)
+            VALUES (NEW.id, NEW.name, NEW.brand, NEW.note);
+        END;
+        CREATE TRIGGER IF NOT EXISTS shopping_fts_delete AFTER DELETE ON shopping_list
+        BEGIN
+            INSERT INTO shopping_fts(shopping_fts, rowid, name, brand, note)
+            VALUES ('delete', OLD.id, OLD.name, OLD.brand, OLD.note);
+        END;
+        CREATE TRIGGER IF NOT EXISTS shopping_fts_update AFTER UPDATE OF name, brand, note ON shopping_list
+        BEGIN
+            INSERT INTO shopping_fts(shopping_fts, rowid, name, brand, note)
+            VALUES ('delete', OLD.id, OLD.name, OLD.brand, OLD.note);
+            INSERT INTO shopping_fts(rowid, name, brand, note)
+            VALUES (NEW.id, NEW.name, NEW.brand, NEW.note);
+        END;
+    '''),
+    (7, '使用者帳號與個人資料分割', lambda db: partition_by_user(db)),
+    (8, '變更記錄（SSE 變更串流）', lambda db: create_change_log(db)),
+    (9, '歷史資料封存狀態', '''
+        -- 每位使用者封存到哪一天：早於 cutoff 的飲食記錄與檢查清單已搬到封存檔（見 archive.py）
+        CREATE TABLE IF NOT EXISTS archive_state (
+            user_id INTEGER PRIMARY KEY,
+            cutoff TEXT NOT NULL,
+            archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+    '''),
+    (10, '移除使用者檔中的帳號', lambda db: drop_user_db_accounts(db)),
+]
+
+
+# 以 table_versions 追蹤變更次數的資料表（供回應快取失效判斷）
+VERSIONED_TABLES = (
+    'meals', 'shopping_list', 'daily_meals', 'weight_records',
+    'daily_checklist', 'exercise_params', 'settings',
+)
+
+
+def create_version_triggers(db, tables):
+    """建立 table_versions 表，並讓每次寫入都把對應資料表的版本 +1
+
+    計數器由 trigger 維護，任何連線、任何 worker 的寫入都會反映出來。
+    重建資料表後需再呼叫一次以補回 trigger。
+    """
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in tables:
+        db.execute('INSERT OR IGNORE INTO table_versions (name) VALUES (?)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+
+def create_meal_ingredients(db):
+    """建立 meal_ingredients 並解析既有菜單的食材文字"""
+    import ingredients
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS meal_ingredients (
+            meal_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            ingredient TEXT NOT NULL,
+            quantity REAL,          -- 已換算成基本單位（g、ml、顆），無數量時為 NULL
+            unit TEXT,
+            PRIMARY KEY (meal_id, position)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS meal_ingredients_catalog_delete
+        AFTER DELETE ON meals
+        BEGIN
+            DELETE FROM meal_ingredients WHERE meal_id = OLD.id;
+        END
+    ''')
+    for row in db.execute('SELECT id, ingredients FROM meals').fetchall():
+        ingredients.sync_meal(db, row[0], row[1])
+
+
+# 依使用者分割的資料表（migration 7 起）：(表名, 重建後的 schema, 沿用的欄位)
+USER_TABLES = (
+    ('daily_meals', '''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,  -- breakfast, lunch, dinner
+            meal_id INTEGER REFERENCES meals(id),
+            meal_name TEXT,
+            meal_order INTEGER
+        )
+    ''', 'id, date, meal_type, meal_id, meal_name, meal_order'),
+    ('weight_records', '''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            date TEXT NOT NULL,
+            weight REAL NOT NULL,
+            day INTEGER,
+            UNIQUE(user_id, date)
+        )
+    ''', 'id, date, weight, day'),
+    ('daily_checklist', '''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            date TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            checked INTEGER DEFAULT 0,
+            UNIQUE(user_id, date, item_key)
+        )
+    ''', 'id, date, item_key, checked'),
+    ('settings', '''
+        CREATE TABLE {name} (
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            key TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (user_id, key)
+        )
+    ''', 'key, value'),
+    ('daily_totals', '''
+        CREATE TABLE {name} (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            calories INTEGER NOT NULL DEFAULT 0,
+            protein INTEGER NOT NULL DEFAULT 0,
+            meal_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date)
+        )
+    ''', 'date, calories, protein, meal_count'),
+)
+
+USER_INDEXES = (
+    # 依日期查詢／歷史記錄（user_id, date DESC, meal_order）免排序
+    'CREATE INDEX IF NOT EXISTS idx_daily_meals_user_date_order ON daily_meals(user_id, date DESC, meal_order)',
+    # 清除某日某餐
+    'CREATE INDEX IF NOT EXISTS idx_daily_meals_user_date_type ON daily_meals(user_id, date, meal_type)',
+    # 菜單營養值變動時找出引用它的記錄
+    'CREATE INDEX IF NOT EXISTS idx_daily_meals_meal ON daily_meals(meal_id, user_id, date)',
+)
+
+# daily_totals 的增量維護，與 migration 4 相同但以 (user_id, date) 為鍵
+DAILY_TOTALS_TRIGGERS = (
+    ('daily_totals_meal_insert', '''
+        CREATE TRIGGER daily_totals_meal_insert
+        AFTER INSERT ON daily_meals
+        BEGIN
+            INSERT INTO daily_totals (user_id, date, calories, protein, meal_count)
+            VALUES (
+                NEW.user_id,
+                NEW.date,
+                COALESCE((SELECT calories FROM meals WHERE id = NEW.meal_id), 0),
+                COALESCE((SELECT protein FROM meals WHERE id = NEW.meal_id), 0),
+                1
+            )
+            ON CONFLICT(user_id, date) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                meal_count = meal_count + 1;
+        END
+    '''),
+    ('daily_totals_meal_delete', '''
+        CREATE TRIGGER daily_totals_meal_delete
+        AFTER DELETE ON daily_meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - COALESCE((SELECT calories FROM meals WHERE id = OLD.meal_id), 0),
+                protein = protein - COALESCE((SELECT protein FROM meals WHERE id = OLD.meal_id), 0),
+                meal_count = meal_count - 1
+            WHERE user_id = OLD.user_id AND date = OLD.date;
+            DELETE FROM daily_totals
+            WHERE user_id = OLD.user_id AND date = OLD.date AND meal_count <= 0;
+        END
+    '''),
+    ('daily_totals_meal_update', '''
+        CREATE TRIGGER daily_totals_meal_update
+        AFTER UPDATE OF user_id, date, meal_id ON daily_meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - COALESCE((SELECT calories FROM meals WHERE id = OLD.meal_id), 0),
+                protein = protein - COALESCE((SELECT protein FROM meals WHERE id = OLD.meal_id), 0),
+                meal_count = meal_count - 1
+            WHERE user_id = OLD.user_id AND date = OLD.date;
+            DELETE FROM daily_totals
+            WHERE user_id = OLD.user_id AND date = OLD.date AND meal_count <= 0;
+            INSERT INTO daily_totals (user_id, date, calories, protein, meal_count)
+            VALUES (
+                NEW.user_id,
+                NEW.date,
+                COALESCE((SELECT calories FROM meals WHERE id = NEW.meal_id), 0),
+                COALESCE((SELECT protein FROM meals WHERE id = NEW.meal_id), 0),
+                1
+            )
+            ON CONFLICT(user_id, date) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                meal_count = meal_count + 1;
+        END
+    '''),
+    ('daily_totals_catalog_update', '''
+        CREATE TRIGGER daily_totals_catalog_update
+        AFTER UPDATE OF calories, protein ON meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories + (COALESCE(NEW.calories, 0) - COALESCE(OLD.calories, 0)) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = NEW.id
+                     AND user_id = daily_totals.user_id AND date = daily_totals.date),
+                protein = protein + (COALESCE(NEW.protein, 0) - COALESCE(OLD.protein, 0)) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = NEW.id
+                     AND user_id = daily_totals.user_id AND date = daily_totals.date)
+            WHERE (user_id, date) IN (SELECT user_id, date FROM daily_meals WHERE meal_id = NEW.id);
+        END
+    '''),
+    ('daily_totals_catalog_delete', '''
+        CREATE TRIGGER daily_totals_catalog_delete
+        AFTER DELETE ON meals
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - COALESCE(OLD.calories, 0) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = OLD.id
+                     AND user_id = daily_totals.user_id AND date = daily_totals.date),
+                protein = protein - COALESCE(OLD.protein, 0) *
+                    (SELECT COUNT(*) FROM daily_meals WHERE meal_id = OLD.id
+                     AND user_id = daily_totals.user_id AND date = daily_totals.date)
+            WHERE (user_id, date) IN (SELECT user_id, date FROM daily_meals WHERE meal_id = OLD.id);
+        END
+    '''),
+)
+
+
+def _is_user_db(db):
+    """是否為分檔模式下的使用者檔（帳號只存在主資料庫）"""
+    import database
+
+    return database.is_user_db(getattr(db, 'path', database.DATABASE))
+
+
+def partition_by_user(db):
+    """建立 users 表與管理員帳號，並在個人資料表加上 user_id
+
+    既有資料全部歸屬管理員（id 1），登入帳密與先前相同；使用者檔只建空的
+    users 表，不寫入管理員的密碼雜湊。有 UNIQUE／主鍵的表需重建才能把 user_id
+    納入唯一鍵；重建會連同 trigger 一起刪除，最後補回。
+    """
+    import os
+    from werkzeug.security import generate_password_hash
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            password_hash TEXT NOT NULL,
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if not _is_user_db(db):
+        db.execute(
+            "INSERT INTO users (id, username, password_hash, is_admin) VALUES (1, 'admin', ?, 1)",
+            (generate_password_hash(os.environ.get('ADMIN_PASSWORD', 'aa552300')),))
+
+    # 先移除引用 daily_totals 的 trigger，重建後的改名才不會因引用失效而失敗
+    for name, _ in DAILY_TOTALS_TRIGGERS:
+        db.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for table, schema, columns in USER_TABLES:
+        db.execute(schema.format(name=f'{table}_new'))
+        db.execute(f'INSERT INTO {table}_new (user_id, {columns}) SELECT 1, {columns} FROM {table}')
+        db.execute(f'DROP TABLE {table}')
+        db.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+    for sql in USER_INDEXES:
+        db.execute(sql)
+    for _, sql in DAILY_TOTALS_TRIGGERS:
+        db.execute(sql)
+    create_version_triggers(db, ('daily_meals', 'weight_records', 'daily_checklist', 'settings'))
+
+
+def drop_user_db_accounts(db):
+    """刪除先前的 migration 7 寫進使用者檔的管理員帳號（登入只查主資料庫）"""
+    if _is_user_db(db):
+        db.execute('DELETE FROM users')
+
+
+# 寫入變更記錄的資料表與欄位（user_id 為 NULL 表示共用資料）；
+# 之後若有 migration 重建這些表，需再呼叫 create_change_triggers 補回 trigger
+CHANGE_LOG_TABLES = (
+    ('meals', 'id, name, meal_type, ingredients, calories, protein'),
+    ('shopping_list', 'id, name, category, brand, spec, price, weekly_amount, note'),
+    ('exercise_params', 'id, name, duration, intensity, distance, calories'),
+    ('daily_meals', 'id, user_id, date, meal_type, meal_id, meal_name, meal_order'),
+    ('weight_records', 'id, user_id, date, weight, day'),
+    ('daily_checklist', 'id, user_id, date, item_key, checked'),
+    ('settings', 'user_id, key, value'),
+)
+
+# 變更記錄保留的筆數；每 CHANGE_LOG_PRUNE_EVERY 筆清除一次更舊的記錄
+CHANGE_LOG_KEEP = 10000
+CHANGE_LOG_PRUNE_EVERY = 1000
+
+
+def create_change_triggers(db, tables=CHANGE_LOG_TABLES):
+    """每次新增、修改、刪除都在 change_log 留下一筆（含整列內容的 JSON）"""
+    for table, columns in tables:
+        names = [column.strip() for column in columns.split(',')]
+        user = 'user_id' in names
+        for event, ref in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            row = ', '.join(f"'{name}', {ref}.{name}" for name in names)
+            db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_change_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO change_log (user_id, tbl, op, row_id, row)
+                    VALUES ({f'{ref}.user_id' if user else 'NULL'}, '{table}', '{event.lower()}',
+                            {f'{ref}.id' if 'id' in names else 'NULL'}, json_object({row}));
+                END
+            ''')
+
+
+def create_change_log(db):
+    """建立 change_log 表、各資料表的 trigger 與定期清除舊記錄的 trigger"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            tbl TEXT NOT NULL,
+            op TEXT NOT NULL,        -- insert, update, delete
+            row_id INTEGER,
+            row TEXT NOT NULL        -- 變更後（刪除時為刪除前）的整列 JSON
+        )
+    ''')
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS change_log_prune
+        AFTER INSERT ON change_log
+        WHEN NEW.seq % {CHANGE_LOG_PRUNE_EVERY} = 0
+        BEGIN
+            DELETE FROM change_log WHERE seq <= NEW.seq - {CHANGE_LOG_KEEP};
+        END
+    ''')
+    create_change_triggers(db)
+
+
+def ensure_version_table(db):
+    """建立 schema_version 表"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.commit()
+
+
+def current_version(db):
+    """目前資料庫的 schema 版本（尚未建立時為 0）"""
+    ensure_version_table(db)
+    row = db.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def pending(db):
+    """尚未套用的 migration"""
+    version = current_version(db)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def apply(db, migration):
+    """在單一交易中套用一個 migration，回傳是否真的有套用
+
+    先寫入 schema_version 再執行變更，若另一個進程已搶先套用，
+    主鍵衝突會讓本次交易整個 rollback。
+    """
+    version, description, change = migration
+    record = ('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+              (version, description))
+    try:
+        if callable(change):
+            db.execute('BEGIN IMMEDIATE')
+            db.execute(*record)
+            change(db)
+            db.commit()
+        else:
+            quoted = description.replace("'", "''")
+            db.executescript(
+                f"BEGIN IMMEDIATE;"
+                f"INSERT INTO schema_version (version, description) "
+                f"VALUES ({int(version)}, '{quoted}');"
+                f"{change};"
+                f"COMMIT;"
+            )
+    except sqlite3.IntegrityError:
+        if db.in_transaction:
+            db.rollback()
+        return False
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return True
+
+
+def upgrade(db, target=None):
+    """套用所有（或到 target 版本為止的）待執行 migration，回傳已套用的版本"""
+    applied = []
+    for migration in pending(db):
+        if target is not None and migration[0] > target:
+            break
+        if apply(db, migration):
+            applied.append(migration[0])
+    return applied
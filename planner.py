@@ -0,0 +1,120 @@
+"""
+菜單規劃
+
+從菜單中為每天挑選早、午、晚餐，使總熱量落在每日區間、蛋白質接近目標，
+並避免同一道菜連續出現。每種餐別先剪枝成少量候選，再以 NumPy 對所有
+早×午×晚組合一次算分，數千道菜的菜單也能在數毫秒內完成。
+"""
+
+import datetime
+
+import numpy as np
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+CANDIDATES_PER_TYPE = 48     # 每種餐別保留的候選數（48³ ≈ 11 萬種組合）
+PROTEIN_WEIGHT = 4.0         # 1 g 蛋白質不足相當於偏離熱量區間 4 kcal
+PROTEIN_SURPLUS_WEIGHT = 0.5 # 超過蛋白質上限的扣分權重
+REPEAT_PENALTY = 40.0        # 每重複使用一次的扣分
+MAX_DAYS = 80
+
+MEALS_QUERY = 'SELECT id, name, meal_type, calories, protein FROM meals ORDER BY meal_type, id'
+
+
+def prune(meals, k=CANDIDATES_PER_TYPE):
+    """保留 k 個候選：一半取蛋白質密度最高者，一半沿熱量分位數平均取樣"""
+    if len(meals) <= k:
+        return meals
+    calories = np.array([meal['calories'] or 0 for meal in meals], dtype=np.float64)
+    protein = np.array([meal['protein'] or 0 for meal in meals], dtype=np.float64)
+    density = protein / np.maximum(calories, 1.0)
+
+    chosen = list(np.argsort(-density, kind='stable')[:k // 2])
+    by_calories = np.argsort(calories, kind='stable')
+    picked = set(chosen)
+    for position in np.linspace(0, len(meals) - 1, k - len(chosen)).astype(int):
+        index = by_calories[position]
+        if index not in picked:
+            picked.add(index)
+            chosen.append(index)
+    return [meals[i] for i in sorted(picked)]
+
+
+def generate(meals, days, calorie_range, protein_range, seed=None):
+    """產生 days 天的菜單，回傳每天 (早, 午, 晚) 的 meal dict
+
+    每天從所有組合中取分數最低者；前一天吃過的菜不再入選，
+    其餘使用過的菜依使用次數加扣分以增加變化。
+    """
+    by_type = [prune([m for m in meals if m['meal_type'] == t]) for t in MEAL_TYPES]
+    if not all(by_type):
+        raise ValueError('每種餐別至少需要一道菜')
+
+    calories = [np.array([m['calories'] or 0 for m in group], dtype=np.float64) for group in by_type]
+    protein = [np.array([m['protein'] or 0 for m in group], dtype=np.float64) for group in by_type]
+    total_calories = calories[0][:, None, None] + calories[1][None, :, None] + calories[2][None, None, :]
+    total_protein = protein[0][:, None, None] + protein[1][None, :, None] + protein[2][None, None, :]
+
+    cal_min, cal_max = calorie_range
+    protein_min, protein_max = protein_range
+    score = (
+        np.maximum(cal_min - total_calories, 0) + np.maximum(total_calories - cal_max, 0)
+        + PROTEIN_WEIGHT * np.maximum(protein_min - total_protein, 0)
+        + PROTEIN_SURPLUS_WEIGHT * np.maximum(total_protein - protein_max, 0)
+    )
+    if seed is not None:
+        # 同分時的隨機挑選，讓不同 seed 產生不同但同樣合格的菜單
+        score = score + np.random.default_rng(seed).random(score.shape)
+
+    uses = [np.zeros(len(group)) for group in by_type]
+    previous = None
+    plan = []
+    for _ in range(days):
+        penalty = [REPEAT_PENALTY * u for u in uses]
+        if previous is not None:
+            for axis, index in enumerate(previous):
+                if len(by_type[axis]) > 1:
+                    penalty[axis] = penalty[axis].copy()
+                    penalty[axis][index] = np.inf
+        day_score = score + penalty[0][:, None, None] + penalty[1][None, :, None] + penalty[2][None, None, :]
+        choice = np.unravel_index(np.argmin(day_score), day_score.shape)
+        for axis, index in enumerate(choice):
+            uses[axis][index] += 1
+        previous = choice
+        plan.append(tuple(by_type[axis][index] for axis, index in enumerate(choice)))
+    return plan
+
+
+def build_plan(db, start, days, settings, seed=None):
+    """依菜單與設定（user_settings.Settings），產生從 start 起 days 天的菜單（尚未寫入）"""
+    meals = [dict(row) for row in db.execute(MEALS_QUERY)]
+    combos = generate(meals, days, settings.daily_calories, settings.protein_target, seed)
+
+    result = []
+    for offset, combo in enumerate(combos):
+        date = (start + datetime.timedelta(days=offset)).isoformat()
+        day = {'date': date}
+        for meal_type, meal in zip(MEAL_TYPES, combo):
+            day[meal_type] = meal
+        day['calories'] = sum(meal['calories'] or 0 for meal in combo)
+        day['protein'] = sum(meal['protein'] or 0 for meal in combo)
+        result.append(day)
+    return result
+
+
+def write_plan(db, plan, meal_order, user_id):
+    """以新菜單取代使用者這些日期原有的三餐記錄（由呼叫端負責交易與 commit）"""
+    dates = [(user_id, day['date']) for day in plan]
+    rows = [
+        (user_id, day['date'], meal_type, day[meal_type]['id'], day[meal_type]['name'],
+         meal_order[meal_type])
+        for day in plan for meal_type in MEAL_TYPES
+    ]
+    db.executemany(
+        "DELETE FROM daily_meals WHERE user_id=? AND date=? "
+        "AND meal_type IN ('breakfast', 'lunch', 'dinner')",
+        dates)
+    db.executemany('''
+        INSERT INTO daily_meals (user_id, date, meal_type, meal_id, meal_name, meal_order)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    return len(rows)
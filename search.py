@@ -0,0 +1,66 @@
+"""
+全文搜尋
+
+以 FTS5（trigram 斷詞）搜尋菜單與採買清單。每個關鍵字都至少 3 個字時
+走 MATCH 並依 bm25 排序；有較短的關鍵字（如兩個字的中文詞）時，
+trigram 無法建立索引詞，改以 LIKE 比對 FTS 內容。
+"""
+
+TRIGRAM = 3
+
+# (FTS 表, 來源表, 搜尋欄位)
+SOURCES = {
+    'meals': ('meals_fts', 'meals', ('name', 'ingredients')),
+    'shopping': ('shopping_fts', 'shopping_list', ('name', 'brand', 'note')),
+}
+
+
+def _phrase(term):
+    """把關鍵字包成 FTS5 片語，避免使用者輸入被當成查詢語法"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_sql(source, terms):
+    """單一來源的搜尋查詢，回傳 (SQL, 參數)；LIMIT 的值由呼叫端附加在參數最後"""
+    fts, table, columns = SOURCES[source]
+    if all(len(term) >= TRIGRAM for term in terms):
+        return f'''
+            SELECT t.*, {fts}.rank AS rank FROM {fts}
+            JOIN {table} t ON t.id = {fts}.rowid
+            WHERE {fts} MATCH ?
+            ORDER BY {fts}.rank
+            LIMIT ?
+        ''', [' '.join(_phrase(term) for term in terms)]
+    # 每個關鍵字都要出現在任一欄位；名稱命中者排前面
+    conditions = ' AND '.join(
+        '(' + ' OR '.join(f"{fts}.{column} LIKE ? ESCAPE '\\'" for column in columns) + ')'
+        for _ in terms
+    )
+    params = [_like(term) for term in terms for _ in columns]
+    name_hit = ' + '.join(f"({fts}.name LIKE ? ESCAPE '\\')" for _ in terms)
+    return f'''
+        SELECT t.*, -({name_hit}) AS rank FROM {fts}
+        JOIN {table} t ON t.id = {fts}.rowid
+        WHERE {conditions}
+        ORDER BY rank, t.id
+        LIMIT ?
+    ''', [_like(term) for term in terms] + params
+
+
+def search_source(db, source, terms, limit):
+    """在單一來源中搜尋，回傳原始資料列（依相關度排序）"""
+    sql, params = search_sql(source, terms)
+    return [dict(row) for row in db.execute(sql, params + [limit]).fetchall()]
+
+
+def search(db, query, sources=tuple(SOURCES), limit=20):
+    """搜尋多個來源，回傳 {來源: [資料列]}"""
+    terms = query.split()
+    if not terms:
+        return {source: [] for source in sources}
+    return {source: search_source(db, source, terms, limit) for source in sources}
@@ -0,0 +1,100 @@
+"""
+JSON 編碼
+
+所有回應經由 JSONProvider（app.json）編碼：有安裝 orjson 時使用 orjson，
+直接產生 UTF-8 bytes；沒有時退回標準庫 json。中文一律輸出原字而非
+\\uXXXX，回應較小。
+
+列表型 API 直接由 cursor 的 tuple 與欄名編碼（不建立 sqlite3.Row），
+?format=columns 時回傳 {"columns": [...], "rows": [[...], ...]}，
+欄名只出現一次，資料量大時體積約為一般格式的一半。
+"""
+
+import json
+
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:  # 選用：沒有安裝時使用標準庫
+    orjson = None
+
+FORMATS = ('objects', 'columns')
+
+if orjson is not None:
+    # 非字串的 key 照標準庫轉成字串；日期交給 Flask 的 _default（HTTP 日期格式）
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def dumps(obj, indent=False):
+    """編碼成 UTF-8 bytes"""
+    if orjson is not None:
+        option = _ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=_default, option=option)
+    if indent:
+        return json.dumps(obj, default=_default, ensure_ascii=False, indent=2).encode()
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask 的 JSON 介面：jsonify、request.json 與樣板的 tojson 都經過這裡
+
+    key 依原本的順序輸出（查詢結果即為欄位順序），不另外排序。
+    """
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(dumps(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+# ==================== 查詢結果 ====================
+
+def columns(cursor):
+    """cursor 的欄名"""
+    return [column[0] for column in cursor.description]
+
+
+def plain(cursor):
+    """讓 cursor 之後取出的列為 tuple（省去建立 sqlite3.Row）"""
+    cursor.row_factory = None
+    return cursor
+
+
+def row_items(names, rows, fmt):
+    """各列的 JSON 值：objects 為 欄名 → 值 的 dict，columns 為 tuple 本身"""
+    if fmt == 'columns':
+        return rows
+    return [dict(zip(names, row)) for row in rows]
+
+
+def encode_rows(names, rows, fmt='objects'):
+    """把 tuple 列編碼成 JSON 陣列（objects）或欄名加陣列（columns）"""
+    if fmt == 'columns':
+        return dumps({'columns': names, 'rows': rows})
+    return dumps(row_items(names, rows, fmt))
+
+
+def fetch_dicts(cursor):
+    """取出全部結果為 dict 清單（比逐列 dict(sqlite3.Row) 快）"""
+    names = columns(cursor)
+    return row_items(names, plain(cursor).fetchall(), 'objects')
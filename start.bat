@@ -15,7 +15,7 @@ if errorlevel 1 (
 
 :: 安裝依賴
 echo [1/2] 檢查並安裝依賴...
-pip install -q flask
+pip install -q flask numpy
 
 :: 啟動 Server
 echo [2/2] 啟動 Server...
@@ -12,24 +12,28 @@ fi
 
 # 檢查虛擬環境
 if [ -d "venv" ]; then
-    echo "[1/3] 啟用虛擬環境..."
+    echo "[1/4] 啟用虛擬環境..."
     source venv/bin/activate
 else
-    echo "[1/3] 建立虛擬環境..."
+    echo "[1/4] 建立虛擬環境..."
     python3 -m venv venv
     source venv/bin/activate
 fi
 
 # 安裝依賴
-echo "[2/3] 檢查並安裝依賴..."
-pip install -q flask gunicorn
+echo "[2/4] 檢查並安裝依賴..."
+pip install -q -r requirements.txt
+
+# 檢查 API 查詢是否都用得到索引（依 schema 檢查，不需要既有資料）
+echo "[3/4] 檢查查詢計畫..."
+flask --app app db check-plans -q || exit 1
 
 # 啟動 Server
-echo "[3/3] 啟動 Server..."
+echo "[4/4] 啟動 Server..."
 echo
 echo "服務運行於: http://0.0.0.0:5000"
 echo "按 Ctrl+C 停止 Server"
 echo
 
 # 使用 gunicorn 啟動（生產模式）
-gunicorn -w 4 -b 0.0.0.0:5000 app:app
+gunicorn -c gunicorn.conf.py -w 4 -b 0.0.0.0:5000 app:app
@@ -0,0 +1,42 @@
+#!/bin/bash
+echo "========================================"
+echo "  80天減重計畫 Server (ASGI)"
+echo "========================================"
+echo
+
+# 檢查 Python
+if ! command -v python3 &> /dev/null; then
+    echo "[錯誤] 找不到 Python3，請先安裝"
+    exit 1
+fi
+
+# 檢查虛擬環境
+if [ -d "venv" ]; then
+    echo "[1/4] 啟用虛擬環境..."
+    source venv/bin/activate
+else
+    echo "[1/4] 建立虛擬環境..."
+    python3 -m venv venv
+    source venv/bin/activate
+fi
+
+# 安裝依賴
+echo "[2/4] 檢查並安裝依賴..."
+pip install -q -r requirements.txt
+
+# 資料庫 migration（只執行一次，worker 不做 DDL）、查詢計畫檢查與靜態檔建置
+echo "[3/4] 升級資料庫、檢查查詢計畫、建置靜態檔..."
+flask --app app db upgrade || exit 1
+flask --app app db check-plans -q || exit 1
+flask --app app assets build
+
+# 啟動 Server
+echo "[4/4] 啟動 Server..."
+echo
+echo "服務運行於: http://0.0.0.0:5000"
+echo "按 Ctrl+C 停止 Server"
+echo
+
+# 使用 uvicorn 啟動：一般路由在 ASGI_THREADS 條執行緒上執行，
+# 變更串流（/api/events）以 async 處理，單一進程可同時掛著大量分頁
+uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers "${ASGI_WORKERS:-1}"
@@ -12,6 +12,11 @@ async function api(endpoint, method = 'GET', data = null) {
     if (data) options.body = JSON.stringify(data);
 
     const response = await fetch(`api${endpoint}`, options);
+    // 登入逾時或被登出：回到登入頁
+    if (response.status === 401) {
+        window.location.href = 'login';
+        return new Promise(() => {});
+    }
     return response.json();
 }
 
@@ -26,13 +31,82 @@ function showToast(message, type = 'success') {
 
 document.addEventListener('DOMContentLoaded', () => {
     initNavigation();
-    loadSettings();
-    loadExercises();
-    loadWeightRecords();
+    loadDashboard().finally(connectChangeFeed);
     initWeekNavigation();
     renderWeekExercise(1);
 });
 
+function getToday() {
+    return new Date().toISOString().split('T')[0];
+}
+
+// 頁面載入只發一個請求，取得設定、運動參數與體重記錄，以及這份資料對應的變更 seq
+async function loadDashboard() {
+    const data = await api('/dashboard');
+    changeFeedSeq = data.seq;
+    renderSettings(data.settings);
+    renderExercises(data.exercises);
+    renderWeightRecords(data.weights);
+}
+
+// ==================== 變更串流 ====================
+
+// 串流連線中時，寫入後的畫面更新由串流事件完成（其他分頁的變更也會即時出現）；
+// 未連線（不支援、伺服器名額已滿、斷線）時退回寫入後重新載入
+let changeFeedLive = false;
+// 畫面資料已包含到哪個 seq：串流從這裡接續，總覽載入到連線之間的變更不會遺漏
+let changeFeedSeq = null;
+const CHANGE_FEED_RETRY_MS = 30000;
+
+function refresh(loader) {
+    if (!changeFeedLive) loader();
+}
+
+function connectChangeFeed() {
+    if (!window.EventSource) return;
+    // 瀏覽器自動重連時改帶 Last-Event-ID（伺服器優先採用），since 只用於第一次連線
+    const since = changeFeedSeq === null ? '' : `?since=${changeFeedSeq}`;
+    const source = new EventSource(`api/events${since}`);
+    source.addEventListener('open', () => { changeFeedLive = true; });
+    source.addEventListener('change', e => {
+        const change = JSON.parse(e.data);
+        changeFeedSeq = change.seq;
+        applyChange(change);
+    });
+    // 錯過的變更已被清除：重新載入全部資料（並更新 seq）
+    source.addEventListener('reset', () => loadDashboard());
+    source.addEventListener('error', () => {
+        changeFeedLive = false;
+        // CONNECTING 時瀏覽器會自行重連；CLOSED（例如 503）則稍後再試
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(connectChangeFeed, CHANGE_FEED_RETRY_MS);
+        }
+    });
+}
+
+function upsertById(list, row) {
+    const index = list.findIndex(item => item.id === row.id);
+    if (index >= 0) list[index] = row;
+    else list.push(row);
+}
+
+function applyChange(change) {
+    const { table, op, id, row } = change;
+    if (table === 'weight_records') {
+        const records = weightRecords.filter(r => r.id !== id && (op === 'delete' || r.date !== row.date));
+        if (op !== 'delete') records.push(row);
+        records.sort((a, b) => b.date.localeCompare(a.date));
+        renderWeightRecords(records);
+    } else if (table === 'exercise_params') {
+        const list = op === 'delete' ? exercises.filter(ex => ex.id !== id) : [...exercises];
+        if (op !== 'delete') upsertById(list, row);
+        renderExercises(list);
+    } else if (table === 'settings') {
+        currentSettings = { ...currentSettings, [row.key]: op === 'delete' ? undefined : row.value };
+        renderSettings(currentSettings);
+    }
+}
+
 // ==================== 導航 ====================
 
 function initNavigation() {
@@ -52,8 +126,14 @@ function initNavigation() {
 
 // ==================== 設定 ====================
 
+let currentSettings = {};
+
 async function loadSettings() {
-    const settings = await api('/settings');
+    renderSettings(await api('/settings'));
+}
+
+function renderSettings(settings) {
+    currentSettings = settings;
     document.getElementById('startWeight').textContent = settings.start_weight || '119';
     document.getElementById('targetWeight').textContent = settings.target_weight || '99';
     document.getElementById('bmrValue').textContent = settings.bmr || '2300';
@@ -65,8 +145,14 @@ async function loadSettings() {
 
 // ==================== 運動參數 ====================
 
+let exercises = [];
+
 async function loadExercises() {
-    const exercises = await api('/exercise');
+    renderExercises(await api('/exercise'));
+}
+
+function renderExercises(list) {
+    exercises = list;
     const tbody = document.getElementById('exerciseTable');
 
     if (exercises.length === 0) {
@@ -101,7 +187,7 @@ async function deleteExercise(id) {
     if (!confirm('確定要刪除嗎？')) return;
     await api(`/exercise/${id}`, 'DELETE');
     showToast('已刪除');
-    loadExercises();
+    refresh(loadExercises);
 }
 
 function showExerciseModal(exercise = null) {
@@ -116,8 +202,7 @@ function showExerciseModal(exercise = null) {
     modal.classList.add('active');
 }
 
-async function editExercise(id) {
-    const exercises = await api('/exercise');
+function editExercise(id) {
     const exercise = exercises.find(e => e.id === id);
     if (exercise) showExerciseModal(exercise);
 }
@@ -141,7 +226,7 @@ async function saveExercise() {
     }
 
     closeExerciseModal();
-    loadExercises();
+    refresh(loadExercises);
 }
 
 function closeExerciseModal() {
@@ -236,8 +321,15 @@ function renderWeekExercise(week) {
 
 // ==================== 體重追蹤 ====================
 
+// 最近一次載入的體重記錄（新到舊），供計算 Day 與重繪圖表使用
+let weightRecords = [];
+
 async function loadWeightRecords() {
-    const records = await api('/weight');
+    renderWeightRecords(await api('/weight'));
+}
+
+function renderWeightRecords(records) {
+    weightRecords = records;
     renderWeightTable(records);
     updateWeightStats(records);
     drawWeightChart(records);
@@ -295,21 +387,21 @@ async function saveWeight() {
         return;
     }
 
-    const today = new Date().toISOString().split('T')[0];
-    const records = await api('/weight');
+    const today = getToday();
+    const records = weightRecords;
     const day = records.length > 0 ? Math.max(...records.map(r => r.day)) + 1 : 1;
 
     await api('/weight', 'POST', { date: today, weight, day });
     showToast('體重已記錄');
     weightInput.value = '';
-    loadWeightRecords();
+    refresh(loadWeightRecords);
 }
 
 async function deleteWeight(id) {
     if (!confirm('確定要刪除這筆記錄嗎？')) return;
     await api(`/weight/${id}`, 'DELETE');
     showToast('已刪除');
-    loadWeightRecords();
+    refresh(loadWeightRecords);
 }
 
 function drawWeightChart(records) {
@@ -403,7 +495,7 @@ function drawWeightChart(records) {
     });
 }
 
-window.addEventListener('resize', () => loadWeightRecords());
+window.addEventListener('resize', () => drawWeightChart(weightRecords));
 
 // Event bindings
 document.getElementById('saveWeightBtn')?.addEventListener('click', saveWeight);
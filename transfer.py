@@ -0,0 +1,304 @@
+"""
+資料匯出與匯入
+
+以 NDJSON（每行一筆，`_table` 標示資料表）或 CSV（單一資料表、首行為欄名）
+匯出／匯入資料。匯出直接從 cursor 逐批產生文字，匯入逐行解析並以
+EXPORT_CHUNK 筆為單位 executemany，兩者的記憶體用量都與資料量無關。
+
+菜單、採買清單、運動參數為共用資料，保留 id（匯入時同 id 覆寫，
+daily_meals.meal_id 的對應才不會亂掉）；個人資料不含 id 與 user_id，
+匯入時歸屬到指定的使用者，有自然鍵的表（體重、檢查清單、設定）同鍵覆寫，
+飲食記錄則一律新增。數值與日期欄位在寫入前檢查型別。匯入不處理交易，由呼叫端
+（API 或指令列）以單一交易包住：任何一行有錯就整批回滾，可以放心修正後重匯。
+"""
+
+import csv
+import datetime
+import io
+import json
+import math
+import sqlite3
+from collections import OrderedDict, namedtuple
+
+import archive
+import database
+import ingredients
+
+EXPORT_CHUNK = 5000   # 匯出每次 fetchmany、匯入每次 executemany 的筆數
+FORMATS = ('ndjson', 'csv')
+
+# columns：匯出／匯入的欄位；key：匯入時判斷同一筆的欄位（None 表示一律新增）；
+# scoped：是否為個人資料；numeric：數值欄位（CSV 中空字串視為 NULL）；order：匯出順序
+TableSpec = namedtuple('TableSpec', 'columns key scoped numeric order')
+
+# 依匯入順序排列（菜單要先於引用它的飲食記錄）
+TABLES = OrderedDict([
+    ('meals', TableSpec(
+        ('id', 'name', 'meal_type', 'ingredients', 'calories', 'protein'),
+        ('id',), False, ('id', 'calories', 'protein'), 'id')),
+    ('shopping_list', TableSpec(
+        ('id', 'name', 'category', 'brand', 'spec', 'price', 'weekly_amount', 'note'),
+        ('id',), False, ('id',), 'id')),
+    ('exercise_params', TableSpec(
+        ('id', 'name', 'duration', 'intensity', 'distance', 'calories'),
+        ('id',), False, ('id',), 'id')),
+    ('daily_meals', TableSpec(
+        ('date', 'meal_type', 'meal_id', 'meal_name', 'meal_order'),
+        None, True, ('meal_id', 'meal_order'), 'date DESC, meal_order')),
+    ('weight_records', TableSpec(
+        ('date', 'weight', 'day'),
+        ('date',), True, ('weight', 'day'), 'date')),
+    ('daily_checklist', TableSpec(
+        ('date', 'item_key', 'checked'),
+        ('date', 'item_key'), True, ('checked',), 'date, item_key')),
+    ('settings', TableSpec(
+        ('key', 'value'),
+        ('key',), True, (), 'key')),
+])
+
+
+def parse_tables(value):
+    """把 'meals,weight_records' 轉成資料表清單（空值為全部），有未知的表時拋出 ValueError"""
+    if not value:
+        return list(TABLES)
+    tables = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in tables if name not in TABLES]
+    if unknown:
+        raise ValueError(f"未知的資料表：{', '.join(unknown)}")
+    return tables
+
+
+def export_sql(table):
+    """匯出一個資料表的查詢（個人資料需帶 user_id 參數）"""
+    spec = TABLES[table]
+    where = 'WHERE user_id = ? ' if spec.scoped else ''
+    return f'SELECT {", ".join(spec.columns)} FROM {table} {where}ORDER BY {spec.order}'
+
+
+def export_query(table):
+    """可封存的資料表的匯出查詢（已封存的記錄也一併匯出）"""
+    spec = TABLES[table]
+    return archive.Query(table, ', '.join(spec.columns), 'user_id = ?', f' ORDER BY {spec.order}')
+
+
+def _cursors(db, tables, user_id):
+    for table in tables:
+        spec = TABLES[table]
+        if table in archive.TABLES:
+            sql, params = archive.query(db, export_query(table), user_id, (user_id,))
+        else:
+            sql, params = export_sql(table), (user_id,) if spec.scoped else ()
+        yield table, db.execute(sql, params)
+
+
+def _batches(cursor):
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def dump(db, tables, fmt, user_id):
+    """依序匯出 tables，逐批產生 NDJSON 或 CSV 文字
+
+    在同一個讀取交易中執行，各表是同一個時間點的快照。CSV 只能匯出單一資料表。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'不支援的格式：{fmt}')
+    if fmt == 'csv' and len(tables) != 1:
+        raise ValueError('CSV 一次只能匯出一個資料表')
+
+    db.execute('BEGIN')
+    try:
+        for table, cursor in _cursors(db, tables, user_id):
+            columns = TABLES[table].columns
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                out = csv.writer(buffer, lineterminator='\n')
+                out.writerow(columns)
+                for rows in _batches(cursor):
+                    out.writerows(tuple(row) for row in rows)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                if buffer.tell():
+                    yield buffer.getvalue()
+            else:
+                for rows in _batches(cursor):
+                    yield ''.join(
+                        json.dumps({'_table': table, **dict(zip(columns, row))},
+                                   ensure_ascii=False) + '\n'
+                        for row in rows)
+    finally:
+        db.rollback()
+
+
+# ==================== 匯入 ====================
+
+class SharedTableError(ValueError):
+    """不允許匯入共用資料（菜單、採買清單、運動參數）時遇到這些表"""
+
+
+def _ndjson_records(stream, table):
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f'第 {number} 行不是有效的 JSON') from None
+        if not isinstance(record, dict):
+            raise ValueError(f'第 {number} 行不是物件')
+        name = record.pop('_table', None) or table
+        if not name:
+            raise ValueError(f'第 {number} 行沒有 _table，請指定 table')
+        yield number, name, record
+
+
+def _csv_records(stream, table):
+    if not table:
+        raise ValueError('CSV 匯入需要指定 table')
+    numeric = TABLES[table].numeric if table in TABLES else ()
+    reader = csv.DictReader(stream)
+    for record in reader:
+        for column in numeric:
+            if record.get(column) == '':
+                record[column] = None
+        yield reader.line_num, table, record
+
+
+def _number(value):
+    """數值欄位的值：JSON 的數字原樣使用，CSV 的字串轉成 int／float，其餘拋出 ValueError"""
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            value = float(value)
+    elif not isinstance(value, (int, float)):
+        raise ValueError(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(value)
+    return value
+
+
+def _check_types(number, table, spec, record):
+    for column in spec.numeric:
+        value = record.get(column)
+        if value is None:
+            continue
+        try:
+            record[column] = _number(value)
+        except ValueError:
+            raise ValueError(f'第 {number} 行：{table}.{column} 不是數字：{value!r}') from None
+    date = record.get('date')
+    if 'date' in spec.columns and date is not None:
+        try:
+            valid = datetime.date.fromisoformat(date).isoformat() == date
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise ValueError(f'第 {number} 行：{table}.date 不是 YYYY-MM-DD 日期：{date!r}')
+
+
+class _Loader:
+    """累積同一資料表的連續列，滿 EXPORT_CHUNK 筆或換表時以 executemany 寫入
+
+    依檔案中的順序寫入，菜單會先於之後引用它的飲食記錄（每日總計才正確）。
+    """
+
+    def __init__(self, db, user_id, shared=True):
+        self.db = db
+        self.user_id = user_id
+        self.shared = shared
+        self.table = None
+        self.rows = []
+        self.counts = OrderedDict()
+
+    def add(self, number, table, record):
+        spec = TABLES.get(table)
+        if spec is None:
+            raise ValueError(f'第 {number} 行：未知的資料表 {table}')
+        if not spec.scoped and not self.shared:
+            raise SharedTableError(f'第 {number} 行：{table} 為共用資料，需要管理員權限')
+        if table == 'daily_meals' and record.get('meal_order') is None:
+            record['meal_order'] = database.MEAL_ORDER.get(record.get('meal_type'))
+        # 共用資料沒有 id 時視為新增
+        missing = [column for column in spec.key or ()
+                   if column != 'id' and record.get(column) is None]
+        if missing:
+            raise ValueError(f"第 {number} 行：{table} 缺少欄位 {', '.join(missing)}")
+        _check_types(number, table, spec, record)
+        row = tuple(record.get(column) for column in spec.columns)
+        if spec.scoped:
+            row = (self.user_id,) + row
+        if table != self.table:
+            self.flush()
+            self.table = table
+        self.rows.append(row)
+        if len(self.rows) >= EXPORT_CHUNK:
+            self.flush()
+
+    def flush(self):
+        table, rows = self.table, self.rows
+        if not rows:
+            return
+        self.rows = []
+        spec = TABLES[table]
+        columns = ('user_id',) + spec.columns if spec.scoped else spec.columns
+        try:
+            if table == 'meals':
+                self._load_meals(rows)
+            elif spec.key is None:
+                placeholders = ', '.join('?' * len(columns))
+                self.db.executemany(
+                    f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})', rows)
+            else:
+                key = ('user_id',) + spec.key if spec.scoped else spec.key
+                database.upsert(self.db, table, columns, rows, key)
+        except (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+            # NOT NULL、型別不符等資料問題視為格式錯誤
+            raise ValueError(f'{table}：{e}') from None
+        self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+    def _load_meals(self, rows):
+        # 食材要依每道菜的 id 重新解析，逐筆執行才能取得新增的 id
+        columns = TABLES['meals'].columns
+        for row in rows:
+            cursor = database.upsert(self.db, 'meals', columns, [row], ('id',))
+            meal_id = row[0] if row[0] is not None else cursor.lastrowid
+            ingredients.sync_meal(self.db, meal_id, row[3])
+
+    def finish(self):
+        self.flush()
+        return dict(self.counts)
+
+
+def load(db, stream, fmt, user_id, table=None, shared=True):
+    """從文字串流匯入，回傳各資料表匯入的筆數；格式錯誤時拋出 ValueError
+
+    shared 為 False 時檔案中有共用資料就拋出 SharedTableError。
+    由呼叫端負責交易：失敗時整批回滾，不會留下匯入一半的資料。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'不支援的格式：{fmt}')
+    if table is not None and table not in TABLES:
+        raise ValueError(f'未知的資料表：{table}')
+    records = _csv_records(stream, table) if fmt == 'csv' else _ndjson_records(stream, table)
+    loader = _Loader(db, user_id, shared)
+    for number, name, record in records:
+        loader.add(number, name, record)
+    return loader.finish()
+
+
+def text_stream(binary):
+    """把上傳的二進位串流包成文字（容許 UTF-8 BOM，CSV 需要 newline=''）"""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def guess_format(filename, default='ndjson'):
+    """由副檔名判斷格式"""
+    return 'csv' if (filename or '').lower().endswith('.csv') else default
@@ -0,0 +1,103 @@
+"""
+使用者設定
+
+settings 表的值都是字串（'119'、'180-220'），這裡一次解析成有型別的
+Settings（數字、區間），並依 table_versions 的版本快取：設定一有寫入
+（不論哪個 worker）版本就會改變，下次取用時重新讀取，其餘時候不查整張表、
+也不重複解析。
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+import cache
+import database
+
+SETTINGS_CACHE_USERS = 256  # 每個 worker 最多快取幾位使用者的設定
+SETTINGS_QUERY = 'SELECT key, value FROM settings WHERE user_id=?'
+
+Range = namedtuple('Range', 'low high')
+
+# raw 保留原始字串（key → value），供 API 原樣回傳
+Settings = namedtuple('Settings', (
+    'start_weight target_weight bmr daily_calories protein_target whey_brand whey_spec raw'))
+
+DEFAULTS = dict(database.DEFAULT_SETTINGS)
+
+
+def parse_number(value, default=None):
+    """把 '119' 轉成 119.0，無法解析時回傳 default"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_range(value, default=None):
+    """把 '180-220' 或 '119' 轉成 Range(下限, 上限)"""
+    try:
+        parts = [float(part) for part in str(value).split('-') if part.strip()]
+    except ValueError:
+        return default
+    if not parts:
+        return default
+    return Range(min(parts), max(parts))
+
+
+def parse(raw):
+    """由 key → 字串 的設定建立 Settings；缺少或格式錯誤的值以預設值代替"""
+    def number(key):
+        return parse_number(raw.get(key), parse_number(DEFAULTS[key]))
+
+    def bounds(key):
+        return parse_range(raw.get(key), parse_range(DEFAULTS[key]))
+
+    return Settings(
+        start_weight=number('start_weight'),
+        target_weight=number('target_weight'),
+        bmr=number('bmr'),
+        daily_calories=Range(bounds('daily_calories_min').low, bounds('daily_calories_max').high),
+        protein_target=bounds('protein_target'),
+        whey_brand=raw.get('whey_brand', DEFAULTS['whey_brand']),
+        whey_spec=raw.get('whey_spec', DEFAULTS['whey_spec']),
+        raw=raw,
+    )
+
+
+class SettingsCache:
+    """依 (資料庫檔, 使用者) 快取解析後的設定（每個 worker 一份，LRU）"""
+
+    def __init__(self, maxsize=SETTINGS_CACHE_USERS):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db, user_id):
+        key = (db.path, user_id)
+        version = cache.table_versions(db, ('settings',))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        rows = db.execute(SETTINGS_QUERY, (user_id,)).fetchall()
+        settings = parse({row['key']: row['value'] for row in rows})
+        with self._lock:
+            self._entries[key] = (version, settings)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return settings
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+settings_cache = SettingsCache()
+
+
+def get(db, user_id):
+    """取得使用者目前的設定"""
+    return settings_cache.get(db, user_id)
@@ -0,0 +1,238 @@
+"""
+寫入佇列（group commit）
+
+每個進程只有一個 writer 執行緒持有寫入連線，所有寫入路由把工作
+（fn(db) 函式）排入佇列並等待結果。writer 一次取出佇列中累積的工作，
+依資料庫檔分組，每個檔案在同一個交易中依序執行後只 commit 一次：
+負載越高，每次 fsync 分攤的寫入越多，進程內的請求也不再互搶 SQLite 寫鎖。
+
+每個工作各自包在 SAVEPOINT 中，失敗時只回滾該工作並把例外交給呼叫端，
+同批其他工作照常 commit。結果（lastrowid 等）在 commit 成功後才交回。
+
+環境變數：
+    WRITE_BATCH_WINDOW_MS  有其他寫入同時到達時，最多再等待多久湊成一批（預設 2）
+    WRITE_BATCH_MAX        每批最多幾個工作（預設 256）
+    WRITE_TIMEOUT          呼叫端等待結果的秒數上限（預設 30）
+    WRITE_OPEN_MAX         writer 同時保持開啟的寫入連線數（每個資料庫檔一條，預設 16）
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
+import database
+
+WRITE_BATCH_WINDOW_MS = float(os.environ.get('WRITE_BATCH_WINDOW_MS', 2))
+WRITE_BATCH_MAX = int(os.environ.get('WRITE_BATCH_MAX', 256))
+WRITE_TIMEOUT = float(os.environ.get('WRITE_TIMEOUT', 30))
+WRITE_OPEN_MAX = int(os.environ.get('WRITE_OPEN_MAX', 16))
+
+WriteResult = namedtuple('WriteResult', 'lastrowid rowcount')
+
+
+class WriteQueue:
+    """單一 writer 執行緒 + group commit"""
+
+    def __init__(self, window_ms=WRITE_BATCH_WINDOW_MS, max_batch=WRITE_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._busy = False
+        # 每次 commit 後通知等待中的變更串流（執行緒等 _committed，事件迴圈用 listener）
+        self._committed = threading.Condition()
+        self._listeners = []
+        self.stats = {
+            'batches': 0,
+            'operations': 0,
+            'failed': 0,
+            'max_batch': 0,
+            'commit_time': 0.0,
+        }
+
+    def submit(self, fn, *args, path=None):
+        """排入一個寫入工作 fn(db, *args)，回傳 concurrent.futures.Future
+
+        fn 在 writer 的交易中執行，不可自行 commit / rollback。path 為
+        要寫入的資料庫檔，預設為目前請求的使用者所在的檔案。
+        """
+        future = Future()
+        self._queue.put((path or database.db_path(), fn, args, future))
+        self._ensure_thread()
+        return future
+
+    def run(self, fn, *args, path=None, timeout=WRITE_TIMEOUT):
+        """排入並等待結果（fn 拋出的例外會在這裡重新拋出）"""
+        return self.submit(fn, *args, path=path).result(timeout)
+
+    def execute(self, sql, params=(), path=None):
+        """執行單一語句，回傳 WriteResult(lastrowid, rowcount)"""
+        return self.run(statement, sql, params, path=path)
+
+    def executemany(self, sql, rows, path=None):
+        return self.run(statements, sql, rows, path=path)
+
+    def wait_for_commit(self, timeout):
+        """等待本進程下一次 commit（最多 timeout 秒），回傳是否有 commit"""
+        with self._committed:
+            return self._committed.wait(timeout)
+
+    def add_commit_listener(self, fn):
+        """註冊每次 commit 後呼叫的 fn()（在 writer 執行緒呼叫，不可阻塞）"""
+        with self._lock:
+            self._listeners.append(fn)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+        data['pending'] = self._queue.qsize()
+        data['commit_time'] = round(data['commit_time'], 6)
+        data['pid'] = os.getpid()
+        return data
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name='db-writer', daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        """取出一批工作；只有在前一批也不只一個工作（有負載）時才等待湊批"""
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if self._busy or len(batch) > 1:
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        self._busy = len(batch) > 1
+        return batch
+
+    def _loop(self):
+        connections = OrderedDict()
+        while True:
+            groups = OrderedDict()
+            for path, fn, args, future in self._collect():
+                groups.setdefault(path, []).append((fn, args, future))
+            for path, batch in groups.items():
+                db = connections.pop(path, None)
+                try:
+                    if db is None:
+                        db = database.connect(path)
+                    self._commit(db, batch)
+                except sqlite3.Error as e:
+                    # 整批失敗（例如 commit 時磁碟錯誤）：丟棄連線，所有呼叫端收到例外
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    _close(db)
+                    continue
+                connections[path] = db
+                while len(connections) > WRITE_OPEN_MAX:
+                    _close(connections.popitem(last=False)[1])
+
+    def _commit(self, db, batch):
+        started = time.perf_counter()
+        results = []
+        failed = 0
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                db.execute('SAVEPOINT write_op')
+                try:
+                    results.append((future, True, fn(db, *args)))
+                    db.execute('RELEASE write_op')
+                except Exception as e:
+                    db.execute('ROLLBACK TO write_op')
+                    db.execute('RELEASE write_op')
+                    results.append((future, False, e))
+                    failed += 1
+            db.commit()
+        except BaseException:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        with self._committed:
+            self._committed.notify_all()
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['operations'] += len(batch)
+            self.stats['failed'] += failed
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+            self.stats['commit_time'] += time.perf_counter() - started
+            listeners = list(self._listeners)
+        for fn in listeners:
+            fn()
+
+
+def _close(db):
+    if db is None:
+        return
+    try:
+        db.close()
+    except sqlite3.Error:
+        pass
+
+
+def statement(db, sql, params=()):
+    """寫入工作：執行單一語句"""
+    cursor = db.execute(sql, params)
+    return WriteResult(cursor.lastrowid, cursor.rowcount)
+
+
+def statements(db, sql, rows):
+    """寫入工作：以 executemany 執行"""
+    cursor = db.executemany(sql, rows)
+    return WriteResult(cursor.lastrowid, cursor.rowcount)
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """取得目前進程的寫入佇列（fork 之後會重新建立）"""
+    global _writer, _writer_pid
+    pid = os.getpid()
+    if _writer is None or _writer_pid != pid:
+        with _writer_lock:
+            if _writer is None or _writer_pid != pid:
+                _writer = WriteQueue()
+                _writer_pid = pid
+    return _writer
+
+
+def run(fn, *args, path=None, timeout=WRITE_TIMEOUT):
+    """以目前進程的寫入佇列執行 fn(db, *args) 並等待結果"""
+    return get_writer().run(fn, *args, path=path, timeout=timeout)
+
+
+def execute(sql, params=(), path=None):
+    return get_writer().execute(sql, params, path=path)
+
+
+def executemany(sql, rows, path=None):
+    return get_writer().executemany(sql, rows, path=path)